@@ -0,0 +1,189 @@
+"""
+Times every entry point, on synthetic exports of several sizes, and keeps the results, so a change can be compared
+with the runs before it.
+
+Example usage: python benchmark.py --scale small medium
+               python benchmark.py --scale large --only xml_reader.gen record_store.convert
+
+Each scale's export is generated once (see synthetic_export.py), into the temp directory, and reused after that.
+The results are appended to benchmark_results.jsonl, one line per benchmark, with the commit, and each time is
+printed next to the last stored time for the same scale and benchmark. The times only compare with others from the
+same machine, so that file isn't committed (it's in .gitignore), and each checkout keeps its own. The other benchmark_*.py files go deeper
+into one thing each.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from health import list_categories, list_vitals, extract_all_values, do_vital, yield_observation_files, \
+    ClinicalIndex, StatInfo, load_index, ingest, export
+import record_store
+import sparklines
+import xml_reader
+from synthetic_export import write_clinical_records, write_export_xml, write_export_cda_xml
+
+SCALES = {
+    "small": dict(observations=2000, conditions=50, allergies=10, procedures=50, medication_requests=100,
+                  export_xml_mb=10, export_cda_mb=5),
+    "medium": dict(observations=20000, conditions=200, allergies=20, procedures=300, medication_requests=500,
+                   export_xml_mb=100, export_cda_mb=50),
+    # About four million Records in export.xml
+    "large": dict(observations=200000, conditions=500, allergies=30, procedures=2000, medication_requests=3000,
+                  export_xml_mb=1000, export_cda_mb=500),
+}
+RESULTS_FILE = Path(__file__).parent / "benchmark_results.jsonl"
+BLOOD_PRESSURE = StatInfo("Vital Signs", "Blood Pressure")
+
+
+def synthetic_export(scale: str) -> Path:
+    """
+    :return: the directory of the export for scale, like export/apple_health_export, writing it first if needed.
+    """
+    base = Path(tempfile.gettempdir()) / F"synthetic_export_{scale}"
+    params = SCALES[scale]
+    done = base / "synthetic_export.json"
+    if done.exists() and json.loads(done.read_text()) == params:
+        return base
+    print(F"Writing the {scale} export to {base}")
+    if base.exists():
+        shutil.rmtree(base)
+    write_clinical_records(base / "clinical-records", observations=params["observations"],
+                           conditions=params["conditions"], allergies=params["allergies"],
+                           procedures=params["procedures"], medication_requests=params["medication_requests"])
+    write_export_xml(base / "export.xml", megabytes=params["export_xml_mb"])
+    write_export_cda_xml(base / "export_cda.xml", megabytes=params["export_cda_mb"])
+    done.write_text(json.dumps(params))
+    return base
+
+def quietly(function):
+    """
+    Calls function, throwing away what it prints, which would only be noise here.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function()
+
+def benchmarks(base: Path) -> dict:
+    """
+    :return: benchmark name -> a function to time, or (setup, function), where setup is run first, without timing it.
+    """
+    cr = base / "clinical-records"
+    store = base / "records"
+    cache = base / "clinical-records-cache.sqlite"
+    stats = []
+    old_cache = base / "clinical-records-cache-old.sqlite"
+
+    def lab_stats():
+        if not stats:
+            index = load_index(cr)
+            stats.extend(extract_all_values(index, stat_info=StatInfo("Lab", name))
+                         for name in sorted(list_vitals(index, "Lab")))
+
+    def build_cache():
+        cache.unlink(missing_ok=True)
+        load_index(cr)
+
+    def new_export():
+        # After a new export, every file has a new modification time, which is the same as the cache having the
+        # wrong ones. Done on a copy of the cache, so each run starts the same.
+        shutil.copy(cache, old_cache)
+        with sqlite3.connect(old_cache) as con:
+            con.execute("UPDATE files SET mtime_ns = 0")
+        con.close()
+        ingest(cr, old_cache)
+
+    return {
+        "list_categories": lambda: list_categories(cr, False, one_prefix=None),
+        "list_vitals": lambda: list_vitals(yield_observation_files(cr), "Vital Signs"),
+        "extract_all_values": lambda: extract_all_values(yield_observation_files(cr), stat_info=BLOOD_PRESSURE),
+        "do_vital": lambda: do_vital(cr, "Blood Pressure", None, True, False, False, category_name="Vital Signs"),
+        "ClinicalIndex.from_directory": lambda: ClinicalIndex.from_directory(cr),
+        "load_index (new cache)": build_cache,
+        "load_index (cached)": (lambda: load_index(cr), lambda: load_index(cr)),
+        "ingest (new export)": (lambda: load_index(cr), new_export),
+        "export (csv, from cache)": (lambda: load_index(cr), lambda: export(cr, load_index(cr), None, os.devnull)),
+        "export (csv, streaming)": lambda: export(cr, None, None, os.devnull),
+        "sparklines page (png)": (lab_stats, lambda: sparklines.html_page(io.StringIO(), stats)),
+        "sparklines page (svg)": (lab_stats, lambda: sparklines.html_page(io.StringIO(), stats, svg=True)),
+        "xml_reader.gen": lambda: sum(1 for _ in xml_reader.gen(str(base / "export.xml"), ["end"])),
+        "xml_reader.find_display_names": lambda: xml_reader.find_display_names(
+            str(base / "export_cda.xml"), ["component", "observation", "code"]),
+        "xml_reader.get_test_results": lambda: xml_reader.get_test_results(str(base / "export_cda.xml")),
+        "record_store.convert": lambda: record_store.convert(str(base / "export.xml"), store),
+        "record_store.query": (lambda: store.exists() or record_store.convert(str(base / "export.xml"), store),
+                               lambda: record_store.print_query(record_store.RecordStore(store).load(
+                                   "HKQuantityTypeIdentifierHeartRate"), "2020-01-01")),
+    }
+
+def timed(function, repeat: int) -> float:
+    """
+    :return: the fastest of repeat runs, in seconds
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+def read_results(file_name: Path) -> list[dict]:
+    if not file_name.exists():
+        return []
+    with open(file_name) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+def run(scales: list[str], only: list[str], repeat: int, results_file: Path, save: bool) -> None:
+    previous = read_results(results_file)
+    common = {"date": datetime.now().isoformat(timespec="seconds"), "commit": git_commit(),
+              "python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()}
+    new = []
+    for scale in scales:
+        base = synthetic_export(scale)
+        print(F"{scale}: {base}")
+        print(F"  {'':32} {'seconds':>9} {'last':>9} {'change':>7}")
+        for name, function in benchmarks(base).items():
+            if only and name not in only:
+                continue
+            if isinstance(function, tuple):
+                setup, function = function
+                quietly(setup)
+            seconds = timed(lambda: quietly(function), repeat)
+            last = [r for r in previous if r["scale"] == scale and r["benchmark"] == name]
+            if last:
+                before = last[-1]["seconds"]
+                print(F"  {name:32} {seconds:9.3f} {before:9.3f} {seconds / before - 1:+7.0%}")
+            else:
+                print(F"  {name:32} {seconds:9.3f}")
+            new.append(common | {"scale": scale, "benchmark": name, "seconds": round(seconds, 4)})
+    if save:
+        with open(results_file, "a") as f:
+            for result in new:
+                print(json.dumps(result), file=f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every entry point on synthetic exports.")
+    parser.add_argument("--scale", nargs="+", choices=list(SCALES), default=["small"])
+    parser.add_argument("--only", nargs="+", help="Only these benchmarks. Default is all of them.")
+    parser.add_argument("--repeat", type=int, default=1, help="Run each benchmark this many times, and keep the best.")
+    parser.add_argument("--results", type=str, default=str(RESULTS_FILE), help="Where to store the results.")
+    parser.add_argument("--no-save", action="store_true", help="Don't store the results, only compare them.")
+    args = parser.parse_args()
+    run(args.scale, args.only, args.repeat, Path(args.results), not args.no_save)
@@ -0,0 +1,48 @@
+"""
+Measures how fast each installed json decoder decodes clinical-records, and checks they all decode it the same.
+
+Example usage: python benchmark_json.py --scale medium
+
+The files are from benchmark.py's synthetic export for the scale, and are read into memory first, so only decoding is
+timed. Then ClinicalIndex.from_directory is timed with each decoder, which is reading and decoding together, to show
+how much of a difference it makes to something real. pip install orjson or msgspec to have more than json to compare.
+"""
+import argparse
+import json
+import time
+
+import json_decoder
+from benchmark import SCALES, synthetic_export, timed
+from health import ClinicalIndex
+
+
+def decode_all(loads, files: list[bytes]) -> None:
+    # What's decoded isn't kept, like in health.py. Keeping all of it would make the garbage collector take a good part
+    # of the time, the same for every decoder.
+    for raw in files:
+        loads(raw)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark decoding clinical-records with each json decoder.")
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--repeat", type=int, default=3, help="Keep the fastest of this many runs.")
+    args = parser.parse_args()
+
+    cr = synthetic_export(args.scale) / "clinical-records"
+    files = [p.read_bytes() for p in sorted(cr.glob("*.json"))]
+    megabytes = sum(len(raw) for raw in files) / 2**20
+    names = json_decoder.available()
+    print(F"{len(files):,} files, {megabytes:.1f} MiB. Installed: {', '.join(names)}. Default: {json_decoder.decoder}")
+    results = {}
+    for name in names:
+        loads = json_decoder.make_loads(name)
+        assert all(loads(raw) == json.loads(raw) for raw in files), F"{name} doesn't decode the same as json"
+        json_decoder.use(name)
+        results[name] = (timed(lambda: decode_all(loads, files), args.repeat),
+                         timed(lambda: ClinicalIndex.from_directory(cr), args.repeat))
+    json_decoder.use()
+    print(F"{'decoder':10} {'decode':>9} {'MiB/s':>8} {'files/s':>10} {'':6} {'from_directory':>15}")
+    for name, (seconds, index_seconds) in results.items():
+        print(F"{name:10} {seconds:8.3f}s {megabytes / seconds:8.1f} {len(files) / seconds:10,.0f} "
+              F"{results['json'][0] / seconds:5.2f}x {index_seconds:14.3f}s")
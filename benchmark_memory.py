@@ -0,0 +1,97 @@
+"""
+Measures how much memory a large number of Observations takes, with the slotted, interned model classes in health.py,
+compared to the plain dataclasses they replaced.
+
+Example usage: python benchmark_memory.py --observations 100000
+
+The observations come from synthetic_export.py. Each one goes through a json round trip first, like it would when
+read from its own file, so that every string starts out as a separate object, just as it does in a real load.
+"""
+import argparse
+import json
+import random
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from health import extract_observation, convert_units
+from synthetic_export import observation
+
+
+# The model classes as they were before they were slotted and interned.
+@dataclass
+class PlainValueQuantity:
+    value: float
+    unit: str
+    name: str
+
+@dataclass
+class PlainReferenceRange:
+    low: Optional[PlainValueQuantity]
+    high: Optional[PlainValueQuantity]
+    text: str
+
+@dataclass
+class PlainObservation:
+    name: str
+    date: str = None
+    data: list[PlainValueQuantity] = None
+    range: Optional[PlainReferenceRange] = None
+    filename: Path = None
+
+
+def plain_value_quantity(val: dict, name: str) -> PlainValueQuantity:
+    v, u = convert_units(val["value"], val["unit"])
+    return PlainValueQuantity(v, u, name)
+
+def plain_extract(condition: dict) -> Optional[PlainObservation]:
+    """
+    What extract_observation did, with the plain classes.
+    """
+    t = condition['code']['text']
+    d = condition['effectiveDateTime']
+    if "valueQuantity" in condition:
+        rr = None
+        if "referenceRange" in condition:
+            r = condition["referenceRange"][0]
+            low = high = None
+            if "low" in r:
+                low = plain_value_quantity(r["low"], "low")
+                high = plain_value_quantity(r["high"], "high")
+            rr = PlainReferenceRange(low, high, r["text"])
+        return PlainObservation(t, d, [plain_value_quantity(condition["valueQuantity"], t)], rr)
+    if "component" in condition:
+        return PlainObservation(t, d, [plain_value_quantity(c["valueQuantity"], c["code"]["text"])
+                                       for c in condition["component"]])
+    return None
+
+def synthetic_conditions(count: int, seed: int = 0):
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield json.loads(json.dumps(observation(rng, datetime(2010, 1, 1), 15 * 365)))
+
+def measure(count: int, extract) -> tuple[int, int]:
+    """
+    :return: (bytes still allocated for the observations, number of observations)
+    """
+    tracemalloc.start()
+    kept = [ob for ob in (extract(c) for c in synthetic_conditions(count)) if ob is not None]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current, len(kept)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the memory used by Observations.")
+    parser.add_argument("--observations", type=int, default=100000)
+    args = parser.parse_args()
+
+    plain, n = measure(args.observations, plain_extract)
+    slotted, n2 = measure(args.observations, lambda c: extract_observation(filename=None, condition=c, notes=[]))
+    assert n == n2
+    print(F"{n} observations")
+    print(F"plain dataclasses:    {plain / 2**20:8.1f} MiB  {plain / n:6.0f} bytes each")
+    print(F"slotted and interned: {slotted / 2**20:8.1f} MiB  {slotted / n:6.0f} bytes each")
+    print(F"reduction:            {1 - slotted / plain:8.0%}")
@@ -0,0 +1,64 @@
+"""
+Measures how reading clinical-records scales with --jobs, on a synthetic directory of Observation files.
+
+Example usage: python benchmark_parallel.py --observations 50000 --max-jobs 8
+
+The directory is generated once (see synthetic_export.py) and reused if it already exists, since writing 50k files
+takes longer than reading them. Each run also checks that the results are the same as with one job.
+"""
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from health import extract_all_values, yield_observation_files, list_categories, ClinicalIndex, StatInfo
+from synthetic_export import write_observations
+
+
+def job_counts(max_jobs: int) -> list[int]:
+    counts = []
+    jobs = 1
+    while jobs < max_jobs:
+        counts.append(jobs)
+        jobs *= 2
+    counts.append(max_jobs)
+    return counts
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+def run(dir_path: Path, max_jobs: int) -> None:
+    stat = StatInfo("Vital Signs", "Blood Pressure")
+    tests = {
+        "extract_all_values": lambda jobs: extract_all_values(yield_observation_files(dir_path), stat_info=stat,
+                                                              jobs=jobs),
+        "list_categories": lambda jobs: list_categories(dir_path, False, one_prefix=None, jobs=jobs),
+        "ClinicalIndex.from_directory": lambda jobs: ClinicalIndex.from_directory(dir_path, jobs).files,
+    }
+    print(F"{'':30} {'jobs':>4} {'seconds':>8} {'speedup':>8}")
+    for name, test in tests.items():
+        baseline_time = baseline = None
+        for jobs in job_counts(max_jobs):
+            seconds, result = timed(lambda: test(jobs))
+            if baseline is None:
+                baseline_time, baseline = seconds, result
+            else:
+                assert result == baseline, F"{name} with {jobs} jobs is different from 1 job"
+            print(F"{name:30} {jobs:4} {seconds:8.2f} {baseline_time / seconds:7.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark parallel reading of clinical-records.")
+    parser.add_argument("--observations", type=int, default=50000, help="Number of synthetic Observation files.")
+    parser.add_argument("--max-jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--dir", type=str, help="Where to keep the synthetic files. Default is a temp directory.")
+    args = parser.parse_args()
+
+    data_dir = Path(args.dir) if args.dir else Path(tempfile.gettempdir()) / F"synthetic_observations_{args.observations}"
+    if len(list(data_dir.glob("Observation*.json"))) != args.observations:
+        print(F"Writing {args.observations} files to {data_dir}")
+        write_observations(data_dir, args.observations)
+    run(data_dir, args.max_jobs)
@@ -0,0 +1,67 @@
+"""
+Measures how long html_page takes to draw sparklines, like sparklines_all.html does for every lab.
+
+Example usage: python benchmark_sparklines.py --sparklines 200 --max-jobs 4
+
+The observations are random, but the same every time. The page is also checked against the one drawn by sparkline(),
+a new figure per sparkline, which is how it was done before the figure was reused. The SVG page is timed too, along
+with the size of both pages.
+"""
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from io import StringIO
+
+import sparklines
+from health import Observation, make_value_quantity, make_reference_range
+
+
+def synthetic_stats(count: int, per_stat: int, seed: int = 0) -> list[list[Observation]]:
+    rng = random.Random(seed)
+    stats = []
+    for i in range(count):
+        typical = rng.uniform(1, 300)
+        low, high = typical * 0.8, typical * 1.2
+        ranged = rng.random() < 0.6
+        n = 1 if i % 20 == 0 else rng.randrange(2, per_stat)
+        observations = []
+        for _ in range(n):
+            d = datetime(2010, 1, 1) + timedelta(seconds=rng.randrange(14 * 365 * 24 * 3600))
+            observations.append(Observation(
+                F"Lab {i}", d.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                [make_value_quantity(round(rng.gauss(typical, typical / 10), 2), "mg/dL", F"Lab {i}")],
+                make_reference_range(make_value_quantity(low, "mg/dL", "low"),
+                                     make_value_quantity(high, "mg/dL", "high"), "") if ranged else None))
+        stats.append(sorted(observations, key=lambda ob: ob.date))
+    return stats
+
+def page(stats, jobs: int, svg: bool = False) -> tuple[float, str]:
+    f = StringIO()
+    start = time.perf_counter()
+    sparklines.html_page(f, stats, jobs, svg)
+    return time.perf_counter() - start, f.getvalue()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark drawing sparklines.")
+    parser.add_argument("--sparklines", type=int, default=200)
+    parser.add_argument("--observations", type=int, default=40, help="Most observations per sparkline.")
+    parser.add_argument("--max-jobs", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    stats = synthetic_stats(args.sparklines, args.observations)
+    # A new figure for every sparkline, as before.
+    render_sparklines = sparklines.render_sparklines
+    sparklines.render_sparklines = lambda all_args, jobs: [sparklines.sparkline(*a) for a in all_args]
+    before, expected = page(stats, 1)
+    sparklines.render_sparklines = render_sparklines
+    print(F"{args.sparklines} sparklines")
+    print(F"{'new figure each':20} {'':>4} {before:8.2f} s {'':7} {len(expected) / 1024:8.0f} KiB")
+    for jobs in sorted({1, 2, args.max_jobs}):
+        seconds, html = page(stats, jobs)
+        assert html == expected, F"The page drawn with {jobs} jobs is different"
+        print(F"{'reused figure':20} {jobs:4} {seconds:8.2f} s {before / seconds:6.2f}x")
+    seconds, html = page(stats, 1, svg=True)
+    print(F"{'svg':20} {'':>4} {seconds:8.2f} s {before / seconds:6.0f}x {len(html) / 1024:8.0f} KiB")
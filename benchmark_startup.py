@@ -0,0 +1,44 @@
+"""
+Measures how long it takes to start each of the command line tools, with python -X importtime, which reports the time
+to import every module, and what imported what.
+
+Example usage: python benchmark_startup.py
+
+test_startup.py runs the same measurements, to catch a heavy import creeping back in.
+"""
+import subprocess
+import sys
+
+COMMANDS = {
+    "health": "import health",
+    "text_ui": "import text_ui",
+    "xml_reader": "import xml_reader",
+    "sparklines": "import sparklines",
+    "record_store": "import record_store",
+    # For comparison
+    "matplotlib.pyplot": "import matplotlib.pyplot",
+    "numpy": "import numpy",
+}
+
+
+def import_times(statement: str) -> dict[str, int]:
+    """
+    Runs statement in a new python, with -X importtime.
+    :return: module name -> cumulative import time in microseconds, for every module imported.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], capture_output=True, text=True,
+                            check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+if __name__ == "__main__":
+    print(F"{'':20} {'ms':>6} {'modules':>8}  matplotlib  numpy")
+    for name, statement in COMMANDS.items():
+        times = import_times(statement)
+        print(F"{name:20} {times[name] / 1000:6.0f} {len(times):8}  {'matplotlib' in times!s:10}  {'numpy' in times}")
@@ -0,0 +1,71 @@
+"""
+Measures peak memory and records per second reading export.xml, streaming with xml_reader.gen, compared to a
+plain iterparse, which keeps the whole tree.
+
+Example usage: python benchmark_xml.py --size-mb 2048
+
+The file is generated once (see synthetic_export.py) and reused if it's already there. Each way of reading it runs in
+its own process, so that the peak memory of one doesn't hide the other's.
+"""
+import argparse
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import xml_reader
+from synthetic_export import write_export_xml
+
+
+def count_streaming(file_name: str) -> int:
+    return sum(1 for _, _, element in xml_reader.gen(file_name, ["end"]) if element.tag == "Record")
+
+def count_iterparse(file_name: str) -> int:
+    return sum(1 for _, element in ET.iterparse(file_name, ("end",)) if element.tag == "Record")
+
+MODES = {
+    "streaming": count_streaming,
+    "iterparse": count_iterparse,
+}
+
+def run_one(mode: str, file_name: str) -> None:
+    """
+    Runs in the child process. Prints records, seconds, and peak RSS in KiB.
+    """
+    start = time.perf_counter()
+    records = MODES[mode](file_name)
+    seconds = time.perf_counter() - start
+    print(records, seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+def run(file_name: Path) -> None:
+    size = file_name.stat().st_size
+    print(F"{file_name}: {size / 2**20:.0f} MiB, parser: {'lxml' if xml_reader.lxml_etree else 'ElementTree'}")
+    print(F"{'':10} {'records':>10} {'seconds':>8} {'records/s':>10} {'peak RSS MiB':>13}")
+    for mode in MODES:
+        out = subprocess.run([sys.executable, __file__, "--run", mode, str(file_name)],
+                             capture_output=True, text=True, check=True).stdout.split()
+        records, seconds, peak_kib = int(out[0]), float(out[1]), int(out[2])
+        print(F"{mode:10} {records:10} {seconds:8.1f} {records / seconds:10.0f} {peak_kib / 1024:13.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark memory and speed of reading export.xml.")
+    parser.add_argument("--size-mb", type=float, default=200, help="Size of the synthetic export.xml.")
+    parser.add_argument("--file", type=str, help="Use this export.xml instead of a synthetic one.")
+    parser.add_argument("--run", nargs=2, metavar=("MODE", "FILE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_one(*args.run)
+        sys.exit(0)
+    if args.file:
+        xml_file = Path(args.file)
+    else:
+        xml_file = Path(tempfile.gettempdir()) / F"synthetic_export_{args.size_mb:g}mb.xml"
+        if not xml_file.exists():
+            print(F"Writing {xml_file}")
+            write_export_xml(xml_file, megabytes=args.size_mb)
+    run(xml_file)
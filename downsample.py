@@ -0,0 +1,58 @@
+"""
+Fewer points to draw, for series too long to plot point by point, like years of heart rate from a watch.
+
+A plot is only so many pixels wide, so hundreds of thousands of points mostly draw on top of each other, and take
+seconds, and a lot of memory, to do it. lttb() picks a budget of them that keep the shape of the line: the peaks and
+dips that would be lost by just taking every nth point. envelope() gives the lowest and highest value in each of a
+number of buckets, so what LTTB left out can still be shown, as a band behind the line.
+
+Largest-Triangle-Three-Buckets is from Sveinn Steinarsson, "Downsampling Time Series for Visual Representation", 2013.
+
+x has to be sorted, like the dates of an ObservationSeries, as seconds or any other number. NaN values are left out.
+"""
+import numpy as np
+
+
+def lttb(x: np.ndarray, y: np.ndarray, budget: int) -> np.ndarray:
+    """
+    :param x: sorted numbers, like seconds
+    :param y: the value at each x
+    :param budget: the most points to keep. At least 3, or the first and last are all there is.
+    :return: the indexes of the points to keep, in order. All of them, if there are no more than budget.
+    """
+    keep = np.flatnonzero(~np.isnan(y))
+    if len(keep) <= budget:
+        return keep
+    if budget < 3:
+        raise ValueError(F"The budget for lttb has to be at least 3, not {budget}")
+    xs, ys = x[keep].astype(np.float64), y[keep].astype(np.float64)
+    # The first and last points are always kept. Everything in between is split into budget - 2 buckets, and the
+    # point kept from each is the one making the largest triangle with the point kept from the bucket before, and the
+    # average of the bucket after.
+    edges = np.linspace(1, len(xs) - 1, budget - 1).astype(np.intp)
+    next_x = np.append(np.add.reduceat(xs[1:-1], edges[:-1] - 1) / np.diff(edges), xs[-1])
+    next_y = np.append(np.add.reduceat(ys[1:-1], edges[:-1] - 1) / np.diff(edges), ys[-1])
+    chosen = np.empty(budget, dtype=np.intp)
+    chosen[0], chosen[-1] = 0, len(xs) - 1
+    a = 0
+    for bucket in range(budget - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        ax, ay = xs[a], ys[a]
+        # Twice the area, which is just as good for finding the largest.
+        cx, cy = next_x[bucket + 1], next_y[bucket + 1]
+        areas = np.abs((ax - cx) * (ys[start:end] - ay) - (ax - xs[start:end]) * (cy - ay))
+        a = start + int(np.argmax(areas))
+        chosen[bucket + 1] = a
+    return keep[chosen]
+
+def envelope(x: np.ndarray, y: np.ndarray, buckets: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The lowest and highest value in each of up to buckets runs of points, of about the same number of points each.
+    :return: x at the start of each bucket, and the lowest and highest y in it
+    """
+    keep = ~np.isnan(y)
+    xs, ys = x[keep], y[keep]
+    if not len(xs):
+        return xs, ys, ys
+    starts = np.unique(np.linspace(0, len(xs), min(buckets, len(xs)), endpoint=False).astype(np.intp))
+    return xs[starts], np.minimum.reduceat(ys, starts), np.maximum.reduceat(ys, starts)
@@ -0,0 +1,167 @@
+"""
+Reading an export straight from the zip that Apple Health writes, without unzipping it first.
+
+The zip is about as big as what's in it, so unzipping takes a while, and twice the disk. source_dir() turns --source
+into something that can be used like the export directory: a Path, for a directory, or a ZipDir, for a zip.
+
+    base = source_dir("export.zip")
+    for p in (base / "clinical-records").glob("Observation*.json"):
+        data = json.loads(p.read_bytes())
+
+ZipDir and ZipMember only have the parts of Path that this project uses. They are just the zip's file name and a name
+in it, so they can be sent to worker processes for --jobs. Each process opens the zip once, and finds members by name
+in its central directory, which zipfile reads when the zip is opened. A member is decompressed as it's read, so a big
+one, like export.xml, streams through open_file() without being read into memory.
+
+zipfile is only imported when there is a zip, to keep it out of starting up, like in health.py.
+"""
+import os
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from fnmatch import fnmatchcase
+from functools import cache
+from pathlib import Path, PurePosixPath
+from typing import BinaryIO, NamedTuple
+
+# What we look for in the zip, to find the export directory in it.
+EXPORT_FILES = ["export.xml", "clinical-records"]
+
+
+@cache
+def _open_zip(zip_name: str, pid: int) -> "zipfile.ZipFile":
+    import zipfile
+    return zipfile.ZipFile(zip_name)
+
+def open_zip(zip_name: str) -> "zipfile.ZipFile":
+    """
+    The zip, opened once per process. A process started by fork has its parent's open file, and they would move each
+    other's file position, so each process opens its own.
+    """
+    return _open_zip(zip_name, os.getpid())
+
+
+class ZipStat(NamedTuple):
+    """
+    The parts of os.stat_result that load_index uses. The time in a zip is only to two seconds.
+    """
+    st_size: int
+    st_mtime_ns: int
+
+
+@dataclass(frozen=True)
+class ZipMember:
+    """
+    A file in a zip, that can be used like the Path of a file.
+    """
+    zip_name: str
+    member: str
+
+    @property
+    def name(self) -> str:
+        return PurePosixPath(self.member).name
+
+    @property
+    def stem(self) -> str:
+        return PurePosixPath(self.member).stem
+
+    def info(self) -> "zipfile.ZipInfo":
+        return open_zip(self.zip_name).getinfo(self.member)
+
+    def stat(self) -> ZipStat:
+        info = self.info()
+        # date_time is local time, with no time zone, but only a change matters, not what the time is.
+        seconds = datetime(*info.date_time, tzinfo=timezone.utc).timestamp()
+        return ZipStat(info.file_size, int(seconds) * 10**9)
+
+    def open(self, mode: str = "rb") -> BinaryIO:
+        assert mode == "rb", F"{self} can only be opened to read bytes"
+        return open_zip(self.zip_name).open(self.member)
+
+    def read_bytes(self) -> bytes:
+        return open_zip(self.zip_name).read(self.member)
+
+    def __fspath__(self) -> str:
+        # So that Path(member) works, for its name. It isn't a file that open() can read.
+        return str(self)
+
+    def __str__(self) -> str:
+        return F"{self.zip_name}/{self.member}"
+
+
+@dataclass(frozen=True)
+class ZipDir:
+    """
+    A directory in a zip, that can be used like the Path of a directory. A zip doesn't have to have entries for its
+    directories, so this is just the start of the member names in it.
+    """
+    zip_name: str
+    prefix: str  # Without a / at the end. "" is the top of the zip.
+
+    @property
+    def name(self) -> str:
+        return PurePosixPath(self.prefix).name
+
+    @property
+    def parent(self) -> "ZipDir":
+        parent = str(PurePosixPath(self.prefix).parent)
+        return ZipDir(self.zip_name, "" if parent == "." else parent)
+
+    def _member_name(self, name: str) -> str:
+        return F"{self.prefix}/{name}" if self.prefix else name
+
+    def __truediv__(self, name: str) -> "ZipDir | ZipMember":
+        member = self._member_name(name)
+        try:
+            open_zip(self.zip_name).getinfo(member)
+        except KeyError:
+            return ZipDir(self.zip_name, member)
+        return ZipMember(self.zip_name, member)
+
+    def glob(self, pattern: str) -> list[ZipMember]:
+        """
+        The files directly in this directory that match pattern, like Path.glob, in the zip's order.
+        """
+        start = self._member_name("")
+        members = []
+        for member in open_zip(self.zip_name).namelist():
+            if member.startswith(start):
+                rest = member[len(start):]
+                if rest and "/" not in rest and fnmatchcase(rest, pattern):
+                    members.append(ZipMember(self.zip_name, member))
+        return members
+
+    def exists(self) -> bool:
+        start = self._member_name("")
+        return any(member.startswith(start) for member in open_zip(self.zip_name).namelist())
+
+    def __str__(self) -> str:
+        return F"{self.zip_name}/{self.prefix}"
+
+
+def is_zip(source: str) -> bool:
+    if not Path(source).is_file():
+        return False
+    import zipfile
+    return zipfile.is_zipfile(source)
+
+def source_dir(source: str) -> "Path | ZipDir":
+    """
+    The export directory, for --source, which can be the directory or the zip. In the zip, it's the directory that
+    has export.xml or clinical-records in it, which is apple_health_export, in the zips that Apple writes.
+    """
+    if not is_zip(source):
+        return Path(source)
+    for member in open_zip(source).namelist():
+        parts = PurePosixPath(member).parts
+        for i, part in enumerate(parts):
+            if part in EXPORT_FILES:
+                return ZipDir(source, "/".join(parts[:i]))
+    raise ValueError(F"{source} doesn't look like an Apple Health export. It has no {' or '.join(EXPORT_FILES)}.")
+
+def open_file(file) -> BinaryIO:
+    """
+    open(file, "rb"), for a file that may be in a zip.
+    """
+    if isinstance(file, ZipMember):
+        return file.open()
+    return open(file, "rb")
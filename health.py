@@ -5,29 +5,37 @@ Design note: This is an exploration tool, not a product. As I don't have documen
 I try to put assertions in, to verify my assumptions, like "A referenceRange only has one value". That's the only case
 I have seen, but there are probably millions of cases I have not seen, yet. It's better to hit an assertion and fix
 it, than to silently hide information.
+
+matplotlib takes longer to import than everything else here put together, so it's only imported by plot(), when a
+plot is actually asked for. numpy (for ObservationSeries), and the process pool for --jobs, are imported the same way,
+when they are first needed, so that things like --categories, -d or -c start quickly. test_startup.py checks this.
 """
-import glob
 import json
+import os
+import sqlite3
 import sys
-from io import StringIO
 from pathlib import Path
 from typing import NoReturn, Iterable, Optional
 import re
 import argparse
-from datetime import datetime, timedelta
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, timezone
 import csv
-from dataclasses import dataclass
+from dataclasses import dataclass, field, replace
 from collections import Counter
+from fnmatch import fnmatch
+from functools import partial
+from itertools import batched, repeat
+import json_decoder
+import profiling
+from resource_query import Query, Result, Scan, Where, project, to_timestamp
+from row_writer import FORMATS, format_of, open_writer
+from export_zip import ZipDir, open_file, source_dir
 
 
 # TODO Split this file into UI code, and library code. We already have text_ui, and xml_reader which use this file.
-# TODO print_condition and print_medicines should be generalized and combined.
-# TODO Do we want to have an option to process multiple or all stats in one run?
 # TODO Should be able to graph anything with a value quantity and a date. This is only observations, at least
 #      in my data. Need to handle string values for Observations
-# TODO When getting multiple stats, I reread ALL the observation files for each stat. Optimize.
 # TODO I don't currently handle the difference between < and <= on reference ranges. Is there really a difference?
 # TODO New format for valueQuantity, see ValueQuantity doc string
 # TODO Some data appears to be missing from my download (PSA).
@@ -41,11 +49,15 @@ class StatInfo:
     name: str
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class ValueQuantity:
     """
     Represents a "valueQuantity", from an Observation. It provides a value, a unit and optionally a name.
 
+    There can be hundreds of thousands of these in memory, so they have no __dict__ (slots), and are made with
+    make_value_quantity, which interns the unit and name, so there is one "mg/dL" string, not thousands.
+    They are frozen, because ReferenceRanges share them.
+
     We are combining two objects from the documentation.
 
     "referenceRange" seems to use the same schema as valueQuantity, once for min and once for max, so we'll
@@ -80,11 +92,14 @@ class ValueQuantity:
 
 
 reference_range_pattern = re.compile(r"[<=>]+")
-@dataclass
+@dataclass(slots=True, frozen=True)
 class ReferenceRange:
     """
     The normal or "referenceRange" from the Observation file.
 
+    Every test of the same kind usually has the same range, so make_reference_range hands out one shared instance
+    for each distinct range, instead of a new one per Observation. That's why it's frozen.
+
     "referenceRange" : [
     {
         "low" : {
@@ -155,17 +170,41 @@ class ReferenceRange:
 
         return None  # TODO extract from text field, where possible.
 
-@dataclass
+@dataclass(slots=True)
 class Observation:
     """
     This holds data from one file, which records an observation, such as height or blood pressure.
+
+    timestamp is the date, as seconds since 1970. It's worked out once, when the Observation is made, and kept in the
+    cache, so sorting, date ranges and plotting don't parse the date again.
     """
     name: str
     date: str = None
     data: list[ValueQuantity] = None
     range: Optional[ReferenceRange] = None
     filename: Path = None
+    timestamp: Optional[int] = None
 
+    def __post_init__(self):
+        if self.timestamp is None and self.date is not None:
+            self.timestamp = to_timestamp(self.date)
+
+
+def make_value_quantity(value: float, unit: str, name: str) -> ValueQuantity:
+    """
+    Use this, rather than ValueQuantity(), to make ValueQuantities that share their unit and name strings.
+    """
+    return ValueQuantity(value, sys.intern(unit), sys.intern(name))
+
+# The flyweights for make_reference_range. There are only as many entries as distinct ranges in the data.
+reference_ranges: dict[ReferenceRange, ReferenceRange] = {}
+
+def make_reference_range(low: Optional[ValueQuantity], high: Optional[ValueQuantity], text: str) -> ReferenceRange:
+    """
+    Use this, rather than ReferenceRange(), to get the one shared instance of each distinct range.
+    """
+    rr = ReferenceRange(low, high, text)
+    return reference_ranges.setdefault(rr, rr)
 
 def convert_units(v, u):
     # TODO this should be optional, but we are parsing US data.
@@ -184,7 +223,7 @@ def get_value_quantity(val: dict, test_name) -> ValueQuantity:
     else:
         u = val["unit"]
         v, u = convert_units(v, u)
-    vq = ValueQuantity(v, u, test_name)
+    vq = make_value_quantity(v, u, test_name)
     return vq
 
 def get_reference_range(rl: list) -> ReferenceRange:
@@ -199,9 +238,73 @@ def get_reference_range(rl: list) -> ReferenceRange:
         low = None
         high = None
     text = r['text']
-    return ReferenceRange(low, high, text)
+    return make_reference_range(low, high, text)
+
+def extract_observation(*, filename: str, condition: dict, notes: list[str]) -> Optional[Observation]:
+    """
+    Pulls the date and value(s) out of an Observation that we already know we want.
+
+    Messages about data we can't handle are added to notes, rather than printed, so that the index can collect them
+    for every file, and only show them when someone asks for that stat.
+    :param filename: Just for error messages
+    :param condition: The contents of the file.
+    :param notes: Messages about this file are appended here.
+    :return: Observation, or None if there was no numeric value, or it wasn't where we look for it.
+    """
+    try:
+        return read_observation(filename, condition, notes)
+    except (KeyError, IndexError, TypeError, ValueError) as e:
+        # A valid Observation can have its date in effectivePeriod, or a component with a valueString, and there
+        # will be other things we haven't seen yet. Say so, and go on with the rest of the files.
+        notes.append(F"*** Couldn't read the value in {filename}: {type(e).__name__} {e} ***")
+        return None
+
+def read_observation(filename: str, condition: dict, notes: list[str]) -> Optional[Observation]:
+    """
+    extract_observation, without catching what goes wrong on data we don't understand.
+    """
+    t = sys.intern(condition['code']['text'])
+    d = condition['effectiveDateTime']
+    # It turns out that blood pressure, which has two values, like 144/100,
+    # has a slightly different format. First find "component", then each has
+    # its own "valueQuantity"
+    # TODO There is a get_value_quantity function that duplicates this with different errors. Combine!
+    if "valueQuantity" in condition:
+        v = condition["valueQuantity"]["value"]
+        if "unit" not in condition["valueQuantity"]:
+            notes.append(F"Debug: no units in valueQuantity.  {filename}")
+            u = "NoUnit."
+        else:
+            u = condition["valueQuantity"]["unit"]
+            v, u = convert_units(v, u)
+        vq = make_value_quantity(v, u, t)
+        if "referenceRange" in condition:
+            rr = get_reference_range(condition["referenceRange"])
+        else:
+            rr = None
+        return Observation(t, d, [vq], rr, filename)
+
+    elif "component" in condition:
+        sub_values = []
+        for component in condition["component"]:
+            val = component["valueQuantity"]["value"]
+            unit = component["valueQuantity"]["unit"]
+            text = component["code"]["text"]
+            val, unit = convert_units(val, unit)
+            vq = make_value_quantity(val, unit, text)
+
+            sub_values.append(vq)
+        return Observation(t, d, sub_values)
+    elif "valueString" in condition:
+        val = condition["valueString"]
+        notes.append(F"We don't handle 'valueString' yet: value is '{val}'")
+        return None
+    else:
+        notes.append(F"*** No value found in {filename} ***")
+    return None
 
-def extract_value_helper(*, filename: str, condition: dict, stat_info) -> Optional[Observation]:
+def extract_value_helper(*, filename: str, condition: dict, stat_info,
+                         notes: Optional[list[str]] = None) -> Optional[Observation]:
     """
 
     :param filename: Just for printing error messages
@@ -209,6 +312,7 @@ def extract_value_helper(*, filename: str, condition: dict, stat_info) -> Option
     :param stat_info: contains
         category_name: Filtering to this category, like "lab" or "Vital Sign"
         name:  The name of the stat / vital sign we are looking for
+    :param notes: If given, messages about the data are added to this, instead of being printed.
     :return:
     """
     category_name, sign_name = stat_info.category_name, stat_info.name
@@ -219,61 +323,166 @@ def extract_value_helper(*, filename: str, condition: dict, stat_info) -> Option
             continue
         if condition['code']['text'] != sign_name:
             continue
-        t = sign_name
-        d = condition['effectiveDateTime']
-        # It turns out that blood pressure, which has two values, like 144/100,
-        # has a slightly different format. First find "component", then each has
-        # its own "valueQuantity"
-        # TODO There is a get_value_quantity function that duplicates this with different errors. Combine!
-        if "valueQuantity" in condition:
-            v = condition["valueQuantity"]["value"]
-            if "unit" not in condition["valueQuantity"]:
-                print("Debug: no units in valueQuantity. ", filename)
-                u = "NoUnit."
-            else:
-                u = condition["valueQuantity"]["unit"]
-                v, u = convert_units(v, u)
-            vq = ValueQuantity(v, u, sign_name)
-            if "referenceRange" in condition:
-                rr = get_reference_range(condition["referenceRange"])
-            else:
-                rr = None
-            return Observation(t, d, [vq], rr, filename)
-
-        elif "component" in condition:
-            sub_values = []
-            for component in condition["component"]:
-                val = component["valueQuantity"]["value"]
-                unit = component["valueQuantity"]["unit"]
-                text = component["code"]["text"]
-                val, unit = convert_units(val, unit)
-                vq = ValueQuantity(val, unit, text)
-
-                sub_values.append(vq)
-                reference_range = None
-            return Observation(t, d, sub_values)
-        elif "valueString" in condition:
-            val = condition["valueString"]
-            print(F"We don't handle 'valueString' yet: value is '{val}'")
-            return None
+        found = []
+        observation = extract_observation(filename=filename, condition=condition, notes=found)
+        if notes is None:
+            for note in found:
+                print(note)
         else:
-            print(F"*** No value found in {filename} ***")
+            notes.extend(found)
+        if observation is not None:
+            return observation
     return None
 
-def extract_value(file: str, stat_info) -> Observation | None:
+def might_contain(raw: bytes, texts: Iterable[str]) -> bool:
+    """
+    A quick check of a file's bytes, before we spend the time to decode the json. Most files don't have the stat we
+    are looking for, and this lets us skip them.
+
+    If there are no backslashes in the file, there are no escapes, so every string in the json appears in the bytes
+    exactly as it will be decoded, with its quotes. So if one of the texts isn't there, it can't be in the json.
+    If there is a backslash anywhere, we can't tell, so we say it might, and the caller decodes the file.
+    It can say True when the text is somewhere else in the file, but it never says False for a file that has it.
+    :param raw: the contents of a json file
+    :param texts: strings that must all appear as json strings in the file
+    :return: False if the file can't contain all of texts
+    """
+    if b"\\" in raw:
+        return True
+    for text in texts:
+        if b'"' + text.encode("utf-8") + b'"' not in raw:
+            return False
+    return True
+
+def read_file(file) -> bytes:
+    """
+    Reads one file in clinical-records, which can be in the export zip. Every file is read through here.
+    """
+    if not profiling.active:
+        # The same as below, without the measuring, which would cost more than the rest of this, for small files.
+        with open_file(file) as f:
+            return f.read()
+    with profiling.phase("read"):
+        with open_file(file) as f:
+            raw = f.read()
+    profiling.count("files read")
+    profiling.count("bytes read", len(raw))
+    return raw
+
+def decode_json(raw: bytes) -> dict:
+    """
+    Decodes one json file. Every json file is decoded through here, with orjson if it's installed, see json_decoder.py.
+    """
+    if not profiling.active:
+        return json_decoder.loads(raw)
+    with profiling.phase("json decode"):
+        return json_decoder.loads(raw)
+
+def read_json(file, must_contain: Optional[list[str]] = None) -> Optional[dict]:
+    """
+    Reads and decodes one json file.
+    :param file: the file to read
+    :param must_contain: strings the file has to have (see might_contain). If it can't have them, it isn't decoded.
+    :return: the decoded json, or None if it was skipped because of must_contain.
+    """
+    raw = read_file(file)
+    if must_contain is not None and not might_contain(raw, must_contain):
+        profiling.count("files skipped undecoded")
+        return None
+    return decode_json(raw)
+
+def extract_value(file: str, stat_info, notes: Optional[list[str]] = None) -> Observation | None:
     """
     Processes one file and extracts the value of a vital sign or other test, from it.
     :param file:
     :param stat_info: contains the sign_name ("Spo2") and the category, like "Lab"
+    :param notes: If given, messages about the data are added to this, instead of being printed.
     :return: Optional[Observation
     """
-    with open(file) as f:
-        condition = json.load(f)
-    return extract_value_helper(filename=file, condition=condition, stat_info=stat_info)
+    condition = read_json(file, [stat_info.name, stat_info.category_name])
+    if condition is None:
+        return None
+    if not profiling.active:
+        return extract_value_helper(filename=file, condition=condition, stat_info=stat_info, notes=notes)
+    with profiling.phase("extract"):
+        observation = extract_value_helper(filename=file, condition=condition, stat_info=stat_info, notes=notes)
+    profiling.count("records matched" if observation is not None else "records skipped")
+    return observation
+
+# How many files each worker process gets at a time, when using more than one job.
+FILES_PER_BATCH = 256
+
+def map_files(function, files: Iterable, jobs: int, *args, pack=None, unpack=None) -> Iterable:
+    """
+    Calls function(batch, *args) on batches of files, and yields the items of the lists it returns.
+    With jobs > 1, the batches are spread over a pool of processes, but results still come back in the same order as
+    the files, so anything built from them is the same as when run with one job.
+    :param function: takes a batch (a tuple of files) and the args, and returns a list with one item per file.
+                     It has to be a top level function in this module, so the worker processes can find it.
+    :param files: files to process
+    :param jobs: number of worker processes. 1 (or less) means do everything in this process.
+    :param args: passed to every call of function
+    :param pack: with jobs > 1, turns each item into plain tuples in the worker, which pickle much faster than our
+                 dataclasses. Also has to be a top level function.
+    :param unpack: turns what pack made back into the item.
+    :return: iterable of the items from function
+    """
+    if jobs <= 1:
+        # Still in batches, so that a caller that doesn't keep the results, like export, doesn't have them all at once.
+        for batch in batched(files, FILES_PER_BATCH):
+            yield from function(batch, *args)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    if pack is not None:
+        function = partial(pack_results, function, pack)
+    with ProcessPoolExecutor(jobs) as pool:
+        for result in pool.map(function, batched(files, FILES_PER_BATCH), *[repeat(arg) for arg in args]):
+            yield from result if unpack is None else map(unpack, result)
+
+def pack_results(function, pack, batch, *args) -> list:
+    return [pack(item) for item in function(batch, *args)]
+
+def pack_observation(ob: Optional[Observation]) -> Optional[tuple]:
+    """
+    An Observation as tuples, lists and strings, to send back from a worker. See map_files().
+    """
+    if ob is None:
+        return None
+    rr = ob.range
+    if rr is not None:
+        rr = (value_quantity_to_json(rr.low), value_quantity_to_json(rr.high), rr.text)
+    return (ob.name, ob.date, [value_quantity_to_json(vq) for vq in ob.data], rr,
+            None if ob.filename is None else str(ob.filename), ob.timestamp)
+
+def unpack_observation(packed: Optional[tuple]) -> Optional[Observation]:
+    if packed is None:
+        return None
+    name, date, data, rr, filename, timestamp = packed
+    if rr is not None:
+        rr = make_reference_range(value_quantity_from_json(rr[0]), value_quantity_from_json(rr[1]), rr[2])
+    return Observation(sys.intern(name), date, [value_quantity_from_json(vq) for vq in data], rr,
+                       None if filename is None else Path(filename), timestamp)
+
+def pack_value(value: tuple[Optional[Observation], list[str]]) -> tuple:
+    return pack_observation(value[0]), value[1]
+
+def unpack_value(packed: tuple) -> tuple[Optional[Observation], list[str]]:
+    return unpack_observation(packed[0]), packed[1]
+
+def extract_values(files: Iterable[str], stat_info: StatInfo) -> list[tuple[Optional[Observation], list[str]]]:
+    """
+    extract_value for a batch of files. Messages are returned rather than printed, so they stay in order.
+    """
+    results = []
+    for p in files:
+        notes = []
+        results.append((extract_value(p, stat_info, notes), notes))
+    return results
 
 def yield_observation_files(dir_path: Path) -> Iterable[str]:
-    for p in dir_path.glob("Observation*.json"):
-        yield p
+    with profiling.phase("glob"):
+        files = list(dir_path.glob("Observation*.json"))
+    yield from files
 
 def filter_category(observation_files: Iterable[str], category: str) -> Iterable[dict]:
     """
@@ -283,107 +492,788 @@ def filter_category(observation_files: Iterable[str], category: str) -> Iterable
     :return:
     """
     for file in observation_files:
-        with open(file) as f:
-            observation = json.load(f)
-            category_info = observation['category']
-            assert isinstance(category_info, list)
-            for ci in category_info:
-                if ci['text'] == category:
-                    yield observation
+        observation = read_json(file, [category])
+        if observation is None:
+            continue
+        category_info = observation['category']
+        assert isinstance(category_info, list)
+        for ci in category_info:
+            if ci['text'] == category:
+                profiling.count("records matched")
+                yield observation
+
+def filter_codes(observation_files: Iterable[str], category: str) -> list[str]:
+    """
+    The code text of every observation that filter_category passes, for list_vitals.
+    """
+    return [observation['code']['text'] for observation in filter_category(observation_files, category)]
 
-def extract_all_values(observation_files: Iterable[str], *, stat_info: StatInfo) -> list[Observation]:
+def extract_all_values(observation_files: "Iterable[str] | ClinicalIndex", *, stat_info: StatInfo,
+                       jobs: int = 1) -> list[Observation]:
     """
 sign_name: str, *, category_name
     :param observation_files: iterable of files to read. Only Obser
+                              Can also be a ClinicalIndex, in which case no files are read.
     :param stat_info: contains
         category_name: Filtering to this category, like "lab" or "Vital Sign"
         name:  The name of the stat / vital sign we are looking for
+    :param jobs: number of processes to read the files with.
     :return: Instance of class Observation or None
     """
+    if isinstance(observation_files, ClinicalIndex):
+        return observation_files.extract_all_values(stat_info)
     values = []
-    for p in observation_files:
-        value = extract_value(p, stat_info)
+    for value, notes in map_files(extract_values, observation_files, jobs, stat_info,
+                                  pack=pack_value, unpack=unpack_value):
+        for note in notes:
+            print(note)
         if value is not None:
             values.append(value)
-    values = sorted(values, key=lambda x: x.date)
+    with profiling.phase("sort"):
+        values = sorted(values, key=lambda x: x.timestamp)
     return values
 
-def print_csv(data: Iterable):
-    output = StringIO()
-    wr = csv.writer(output, quoting=csv.QUOTE_ALL)
-    wr.writerow(data)
-    print(output.getvalue(), end="")
-
-
-def print_conditions(cd: Path, csv_format: bool, match: str) -> NoReturn:
-    path = cd / match
-    conditions = []
-    for p in glob.glob(str(path)):
-        with open(p) as f:
-            condition = json.load(f)
-            conditions.append(
-                (condition['resourceType'],
-                 condition['recordedDate'],
-                 condition['clinicalStatus']['coding'][0]['code'],
-                 condition['verificationStatus']['coding'][0]['code'],
-                 condition['code']['text'],
-                 )
-            )
-    cs = sorted(conditions, key=lambda x: x[1])
-    for condition in cs:
-        if csv_format:
-            print_csv(condition)
-        else:
-            # Almost the same as csv, but the csv version escapes special characters, if there are any.
-            print(condition)
-
-def print_procedures(cd: Path, csv_format: bool, match: str) -> NoReturn:
-    path = cd / match
-    conditions = []
-    for p in glob.glob(str(path)):
-        with open(p) as f:
-            condition = json.load(f)
-            conditions.append(
-                (condition['resourceType'],
-                 condition['performedDateTime'],
-                 condition['status'],
-                 condition['code']['text'],
-                 )
-            )
-    cs = sorted(conditions, key=lambda x: x[1])
-    for condition in cs:
-        if csv_format:
-            print_csv(condition)
-        else:
-            # Almost the same as csv, but the csv version escapes special characters, if there are any.
-            print(condition)
-
-def print_medicines(cd: Path, csv_format: bool, match: str, include_inactive: bool) -> NoReturn:
-    path = cd / match
-    conditions = []
-    for p in glob.glob(str(path)):
-        with open(p) as f:
-            condition = json.load(f)
-            is_active = not condition['status'] in ['completed', 'stopped']
-            if is_active or include_inactive:
-                d = condition['authoredOn']
-                # Line up printed columns
-                if len(d) == 10:
-                    d += 10*' '
-                conditions.append(
-                    (condition['resourceType'],
-                     d,
-                     condition['status'],
-                     condition['medicationReference']['display'],
-                     )
-                )
-    cs = sorted(conditions, key=lambda x: x[1])
-    for condition in cs:
-        if csv_format:
-            print_csv(condition)
+def in_date_range(ws: list[Observation], after: Optional[str] = None, before: Optional[str] = None) \
+        -> list[Observation]:
+    """
+    The observations dated strictly after after, and before before, either of which can be None.
+    They are found by binary search, so a few days out of years of values only looks at those few days.
+    :param ws: sorted by timestamp, like extract_all_values returns them
+    :param after: a date like '2024-01-01', like --after
+    :param before: a date like '2024-02-01', like --before
+    """
+    start = 0 if not after else bisect_right(ws, to_timestamp(after), key=lambda x: x.timestamp)
+    end = len(ws) if not before else bisect_left(ws, to_timestamp(before), key=lambda x: x.timestamp)
+    return ws[start:max(start, end)]
+
+def date_window(after: Optional[str], before: Optional[str], last_days: Optional[int]) \
+        -> tuple[Optional[str], Optional[str]]:
+    """
+    The (after, before) dates for --after, --before and --last-days. --last-days moves after up to that many days
+    ago, if it isn't already later.
+    """
+    if last_days is not None:
+        since = (datetime.now(timezone.utc) - timedelta(days=last_days)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        if not after or to_timestamp(after) < to_timestamp(since):
+            after = since
+    return after, before
+
+def observations_to_series(ws: list[Observation], name: Optional[str] = None) -> "ObservationSeries":
+    """
+    Converts a list of Observations of one stat, to columns.
+    Components are named by ValueQuantity.name, in the order they are first seen. If an observation is missing a
+    component the others have, its value is NaN, and its unit is None.
+    :param ws: Observations, like the ones from extract_all_values
+    :param name: name of the stat. Defaults to the name of the first observation, which we need if ws is empty.
+    :return: ObservationSeries, in the same order as ws.
+    """
+    import numpy as np
+    from observation_series import ObservationSeries, timestamps_to_dates
+    if name is None:
+        name = ws[0].name if ws else ""
+    values = {}
+    units = {}
+    for row, w in enumerate(ws):
+        for vq in w.data:
+            if vq.name not in values:
+                values[vq.name] = np.full(len(ws), np.nan)
+                units[vq.name] = np.full(len(ws), None, dtype=object)
+            values[vq.name][row] = vq.value
+            units[vq.name][row] = vq.unit
+    ranges = np.empty(len(ws), dtype=object)
+    ranges[:] = [w.range for w in ws]
+    filenames = np.empty(len(ws), dtype=object)
+    filenames[:] = [w.filename for w in ws]
+    return ObservationSeries(name, timestamps_to_dates([w.timestamp for w in ws]), values, units, ranges, filenames)
+
+def series_to_observations(series: "ObservationSeries") -> list[Observation]:
+    """
+    The reverse of observations_to_series. Values come back as floats, even if they were ints in the file.
+    """
+    from observation_series import format_dates
+    dates = format_dates(series.dates)
+    timestamps = series.dates.astype("int64").tolist()
+    columns = [(name, series.values[name].tolist(), series.units[name]) for name in series.components()]
+    ws = []
+    for row in range(len(series)):
+        data = [make_value_quantity(values[row], units[row], name) for name, values, units in columns
+                if units[row] is not None]
+        ws.append(Observation(series.name, dates[row], data, series.ranges[row], series.filenames[row],
+                              timestamps[row]))
+    return ws
+
+
+@dataclass
+class IndexedFile:
+    """
+    What we keep from one file in clinical-records, so that we only have to read and parse it once.
+
+    categories is in the list_categories format, (name, weight). It's None if the file has no category we understand,
+    in which case list_categories raises, just as it would have when reading the file directly.
+    For Observation files, observation_categories are the category texts extract_value_helper matches on, code is
+    code.text, and observation is the extracted value, or None if it had no numerical value (see notes).
+    For Conditions, Procedures, etc. row is the values of RESOURCE_FIELDS, None for any the file doesn't have.
+    """
+    filename: Path
+    prefix: str
+    categories: Optional[list[tuple[str, float]]]
+    observation_categories: list[str] = field(default_factory=list)
+    code: Optional[str] = None
+    observation: Optional[Observation] = None
+    notes: list[str] = field(default_factory=list)
+    row: Optional[tuple] = None
+
+
+def index_file(p: Path, *, is_observation: bool, raw: Optional[bytes] = None,
+               stats: Optional[list[StatInfo]] = None) -> Optional[IndexedFile]:
+    """
+    Reads one file, and pulls out everything the index needs from it.
+    :param p: the file to read
+    :param is_observation: True if this is an Observation file, and we should extract its value.
+    :param raw: the contents of p, if they have already been read.
+    :param stats: if given, the file is only decoded if might_contain says it could have one of these stats.
+    :return: IndexedFile, or None if it was skipped because of stats.
+    """
+    if stats is not None:
+        if raw is None:
+            raw = read_file(p)
+        if not any(might_contain(raw, [stat.name, stat.category_name]) for stat in stats):
+            profiling.count("files skipped undecoded")
+            return None
+    data = read_json(p) if raw is None else decode_json(raw)
+    if not profiling.active:
+        return index_data(p, data, is_observation=is_observation)
+    with profiling.phase("extract"):
+        return index_data(p, data, is_observation=is_observation)
+
+def index_data(p: Path, data: dict, *, is_observation: bool) -> IndexedFile:
+    """
+    The part of index_file after the file has been read and decoded.
+    """
+    try:
+        categories = get_categories(data, p)
+    except ValueError:
+        categories = None
+    path = Path(p)
+    entry = IndexedFile(path, path.stem.split("-")[0], categories)
+    if is_observation:
+        try:
+            category_info = data['category']
+            if not isinstance(category_info, list):
+                raise TypeError(F"category is a {type(category_info).__name__}, not a list")
+            observation_categories = [ci['text'] for ci in category_info]
+            code = data['code']['text']
+        except (KeyError, IndexError, TypeError) as e:
+            # Every command builds the index, so one odd file shouldn't stop them all. It's left out of -l and -s.
+            entry.notes.append(F"*** Couldn't read the category or code.text in {p}: {type(e).__name__} {e} ***")
+            return entry
+        entry.observation_categories = observation_categories
+        entry.code = code
+        entry.observation = extract_observation(filename=p, condition=data, notes=entry.notes)
+    elif entry.prefix in RESOURCE_FIELDS:
+        entry.row = project(data, RESOURCE_FIELDS[entry.prefix])
+    return entry
+
+def index_files(files: Iterable[Path], is_observation: Optional[bool],
+                stats: Optional[list[StatInfo]] = None) -> list[Optional[IndexedFile]]:
+    """
+    index_file for a batch of files.
+    :param is_observation: None means decide by the file name, like from_directory does.
+    :param stats: see index_file
+    """
+    return [index_file(p, is_observation=fnmatch(Path(p).name, "Observation*.json")
+                       if is_observation is None else is_observation, stats=stats)
+            for p in files]
+
+def pack_entry(entry: Optional[IndexedFile]) -> Optional[tuple]:
+    """
+    An IndexedFile as tuples, lists and strings, to send back from a worker. See map_files().
+    """
+    if entry is None:
+        return None
+    return (str(entry.filename), entry.prefix, entry.categories, entry.observation_categories, entry.code,
+            pack_observation(entry.observation), entry.notes, entry.row)
+
+def unpack_entry(packed: Optional[tuple]) -> Optional[IndexedFile]:
+    if packed is None:
+        return None
+    filename, prefix, categories, observation_categories, code, observation, notes, row = packed
+    return IndexedFile(Path(filename), prefix, categories, observation_categories, code,
+                       unpack_observation(observation), notes, row)
+
+def pack_reindexed(result: tuple[str, Optional[IndexedFile]]) -> tuple:
+    return result[0], pack_entry(result[1])
+
+def unpack_reindexed(packed: tuple) -> tuple[str, Optional[IndexedFile]]:
+    return packed[0], unpack_entry(packed[1])
+
+def content_hash(raw: bytes) -> str:
+    import hashlib  # Only needed when files have changed, and it loads OpenSSL.
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+def reindex_files(files: list[tuple[Path, Optional[str]]]) -> list[tuple[str, Optional[IndexedFile]]]:
+    """
+    index_files for files that are new, or whose size or modification time changed. Each file is hashed first, and
+    if its contents are the same as when it was cached, it isn't decoded again.
+    :param files: (file, the hash of it in the cache, or None if it isn't in the cache, or its size changed)
+    :return: (hash, IndexedFile), one per file. The IndexedFile is None when the hash matched.
+    """
+    results = []
+    for p, cached_hash in files:
+        raw = read_file(p)
+        digest = content_hash(raw)
+        if digest == cached_hash:
+            results.append((digest, None))
         else:
-            # Almost the same as csv, but the csv version escapes special characters, if there are any.
-            print(condition)
+            results.append((digest, index_file(p, is_observation=fnmatch(p.name, "Observation*.json"), raw=raw)))
+    return results
+
+
+class ClinicalIndex:
+    """
+    An in-memory index of the files in clinical-records. Each file is read once, when the index is built.
+    After that, any number of stats, vitals and category counts can be looked up without touching the disk.
+
+    Observations are keyed by (category, code text), which is what StatInfo describes.
+    """
+    def __init__(self):
+        self.files: dict[Path, IndexedFile] = {}
+        self.stats: dict[tuple[str, str], list[IndexedFile]] = {}
+        # The sorted values of each stat, and their notes, once extract_all_values has been asked for them.
+        self.values: dict[tuple[str, str], tuple[list[Observation], list[str]]] = {}
+
+    @classmethod
+    def from_directory(cls, dir_path: Path, jobs: int = 1) -> "ClinicalIndex":
+        """
+        Index every json file in dir_path. Only Observation files have their values extracted.
+        :param jobs: number of processes to read the files with.
+        """
+        index = cls()
+        with profiling.phase("glob"):
+            files = list(dir_path.glob("*.json"))
+        for entry in map_files(index_files, files, jobs, None, pack=pack_entry, unpack=unpack_entry):
+            index.add(entry)
+        return index
+
+    @classmethod
+    def from_files(cls, observation_files: Iterable[str], jobs: int = 1,
+                   stats: Optional[list[StatInfo]] = None) -> "ClinicalIndex":
+        """
+        Index a set of Observation files, like the ones from yield_observation_files.
+        :param jobs: number of processes to read the files with.
+        :param stats: if given, only the files that might have one of these stats are decoded and added (see
+                      might_contain), so the index is only good for these stats. Most files are skipped.
+        """
+        index = cls()
+        for entry in map_files(index_files, observation_files, jobs, True, stats,
+                               pack=pack_entry, unpack=unpack_entry):
+            if entry is not None:
+                index.add(entry)
+        return index
+
+    def add(self, entry: IndexedFile) -> None:
+        self.files[entry.filename] = entry
+        for category in entry.observation_categories:
+            self.stats.setdefault((category, entry.code), []).append(entry)
+            self.values.pop((category, entry.code), None)
+
+    def list_vitals(self, category: str) -> Counter:
+        """
+        Same as list_vitals(), the codes found in Observations with this category, and how many files have each.
+        """
+        vitals = Counter()
+        for (stat_category, code), entries in self.stats.items():
+            if stat_category == category:
+                vitals[code] += len(entries)
+        return vitals
+
+    def extract_all_values(self, stat_info: StatInfo) -> list[Observation]:
+        """
+        Same as extract_all_values(), the values for one stat, sorted by date. They are only sorted the first time,
+        so asking again, like from a menu, is quick.
+        """
+        key = (stat_info.category_name, stat_info.name)
+        if key not in self.values:
+            values, notes = self.find_values(key)
+            with profiling.phase("sort"):
+                values.sort(key=lambda x: x.timestamp)
+            self.values[key] = values, notes
+        values, notes = self.values[key]
+        for note in notes:
+            print(note)
+        return list(values)
+
+    def find_values(self, key: tuple[str, str]) -> tuple[list[Observation], list[str]]:
+        """
+        The values of the stat (category, code), and the notes of its files, in the order of the files.
+        """
+        values = []
+        notes = []
+        for entry in self.stats.get(key, []):
+            notes.extend(entry.notes)
+            if entry.observation is not None:
+                values.append(entry.observation)
+        return values, notes
+
+    def file_categories(self, wildcard: str) -> Iterable[tuple[Path, Optional[list[tuple[str, float]]]]]:
+        """
+        (file, its categories) for the files that match wildcard, in order.
+        """
+        for entry in self.files.values():
+            if fnmatch(entry.filename.name, wildcard):
+                yield entry.filename, entry.categories
+
+    def resource_rows(self, resource_types: Iterable[str]) -> Iterable[tuple[str, tuple, str]]:
+        """
+        (resourceType, row, file name) for the files of resource_types, in order. See RESOURCE_FIELDS.
+        """
+        resource_types = set(resource_types)
+        for entry in self.files.values():
+            if entry.prefix in resource_types and entry.row is not None:
+                yield entry.prefix, entry.row, str(entry.filename)
+
+    def list_categories(self, only_first, *, one_prefix) -> (list[tuple], Counter, int):
+        """
+        Same as list_categories(), but from the index.
+        """
+        counter = Counter()
+        count = 0
+        wildcard = "*.json"
+        if one_prefix:
+            wildcard = one_prefix + wildcard
+        for filename, categories in self.file_categories(wildcard):
+            count += 1
+            if categories is None:
+                raise ValueError(F"File {filename} has no category", filename)
+            categories = categories[:1] if only_first else categories
+            for name, weight in categories:
+                counter[name] += weight
+        c_sorted = sorted(counter, key=lambda x: counter[x], reverse=True)
+        return c_sorted, counter, count
+
+
+# The cache holds what index_file extracted, so bump this whenever that changes, and old caches will be rebuilt.
+CACHE_VERSION = 5
+CACHE_FILE_NAME = "clinical-records-cache.sqlite"
+CACHE_SCHEMA = """
+DROP TABLE IF EXISTS files;
+DROP TABLE IF EXISTS observations;
+DROP TABLE IF EXISTS resources;
+CREATE TABLE files (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    prefix TEXT NOT NULL,
+    categories TEXT,
+    notes TEXT NOT NULL
+);
+CREATE TABLE observations (
+    name TEXT PRIMARY KEY,
+    categories TEXT NOT NULL,
+    code TEXT NOT NULL,
+    date TEXT,
+    timestamp INTEGER,
+    data TEXT,
+    reference_range TEXT,
+    has_filename INTEGER NOT NULL
+);
+CREATE INDEX observations_code ON observations (code);
+CREATE TABLE resources (
+    name TEXT PRIMARY KEY,
+    resource_type TEXT NOT NULL,
+    row TEXT NOT NULL
+);
+"""
+
+def default_cache_path(dir_path: Path) -> Path:
+    """
+    The cache lives next to the clinical-records directory, in the export, or next to the export zip.
+    """
+    if isinstance(dir_path, ZipDir):
+        return Path(dir_path.zip_name).parent / CACHE_FILE_NAME
+    return dir_path.parent / CACHE_FILE_NAME
+
+def open_cache(cache_path: Path) -> sqlite3.Connection:
+    """
+    Opens the cache, creating it, or emptying it if it was written by a different CACHE_VERSION.
+    """
+    con = sqlite3.connect(cache_path)
+    version = con.execute("PRAGMA user_version").fetchone()[0]
+    if version != CACHE_VERSION:
+        con.executescript(CACHE_SCHEMA)
+        con.execute(F"PRAGMA user_version = {CACHE_VERSION}")
+        con.commit()
+    return con
+
+def value_quantity_to_json(vq: Optional[ValueQuantity]) -> Optional[list]:
+    return None if vq is None else [vq.value, vq.unit, vq.name]
+
+def value_quantity_from_json(vq: Optional[list]) -> Optional[ValueQuantity]:
+    return None if vq is None else make_value_quantity(*vq)
+
+def cache_rows(entry: IndexedFile, size: int, mtime_ns: int, digest: str) \
+        -> tuple[tuple, Optional[tuple], Optional[tuple]]:
+    """
+    The rows of the files, observations and resources tables for entry. Only an Observation whose code we could read
+    has an observations row, and only the resources the reports use have a resources row.
+    """
+    name = entry.filename.name
+    categories = None if entry.categories is None else json.dumps(entry.categories)
+    notes = json.dumps(entry.notes) if entry.notes else "[]"  # Most files have none.
+    file_row = (name, size, mtime_ns, digest, entry.prefix, categories, notes)
+    observation_row = resource_row = None
+    if entry.code is not None:
+        ob = entry.observation
+        date = timestamp = data = reference_range = None
+        has_filename = False
+        if ob is not None:
+            date = ob.date
+            timestamp = ob.timestamp
+            data = json.dumps([value_quantity_to_json(vq) for vq in ob.data])
+            if ob.range is not None:
+                reference_range = json.dumps({"low": value_quantity_to_json(ob.range.low),
+                                              "high": value_quantity_to_json(ob.range.high),
+                                              "text": ob.range.text})
+            has_filename = ob.filename is not None
+        observation_row = (name, json.dumps(entry.observation_categories), entry.code, date, timestamp, data,
+                           reference_range, has_filename)
+    if entry.row is not None:
+        resource_row = (name, entry.prefix, json.dumps(entry.row))
+    return file_row, observation_row, resource_row
+
+def delete_cached_files(con: sqlite3.Connection, names: list[str]) -> None:
+    for table in ["files", "observations", "resources"]:
+        con.executemany(F"DELETE FROM {table} WHERE name = ?", [(name,) for name in names])
+
+def cached_observation(p, code: str, date: str, timestamp: int, data: Optional[str], reference_range: Optional[str],
+                       has_filename: bool) -> Optional[Observation]:
+    """
+    The Observation from a row of the observations table, or None if it had no value.
+    """
+    if data is None:
+        return None
+    rr = None
+    if reference_range is not None:
+        r = json.loads(reference_range)
+        rr = make_reference_range(value_quantity_from_json(r["low"]), value_quantity_from_json(r["high"]), r["text"])
+    values = [value_quantity_from_json(vq) for vq in json.loads(data)]
+    return Observation(sys.intern(code), date, values, rr, p if has_filename else None, timestamp)
+
+def read_cached_files(con: sqlite3.Connection, dir_path: Path) -> dict[str, IndexedFile]:
+    """
+    Turns the rows in the cache back into IndexedFiles, keyed by file name.
+    """
+    entries = {}
+    query = """SELECT f.name, f.prefix, f.categories, f.notes,
+                      o.categories, o.code, o.date, o.timestamp, o.data, o.reference_range, o.has_filename, r.row
+               FROM files f
+               LEFT JOIN observations o ON o.name = f.name
+               LEFT JOIN resources r ON r.name = f.name"""
+    for (name, prefix, categories, notes,
+         ob_categories, code, date, timestamp, data, reference_range, has_filename, row) in con.execute(query):
+        p = dir_path / name
+        entry = IndexedFile(p, prefix, None if categories is None else [tuple(c) for c in json.loads(categories)])
+        entry.notes = json.loads(notes)
+        if code is not None:
+            entry.observation_categories = json.loads(ob_categories)
+            entry.code = code
+            entry.observation = cached_observation(p, code, date, timestamp, data, reference_range, has_filename)
+        if row is not None:
+            entry.row = tuple(json.loads(row))
+        entries[name] = entry
+    return entries
+
+class CachedIndex(ClinicalIndex):
+    """
+    A ClinicalIndex that asks the cache for just the rows a command needs, like the one stat for -s, rather than
+    turning every row back into an IndexedFile first. files is still there, for export, and is read the first time
+    it's used.
+
+    Rows come back in the order of names, the glob order, so the output is the same as from_directory's.
+    """
+    def __init__(self, con: sqlite3.Connection, dir_path: Path, names: list[str]):
+        self.con = con
+        self.dir_path = dir_path
+        self.position = {name: i for i, name in enumerate(names)}
+        self.values = {}
+        self._files: Optional[dict[Path, IndexedFile]] = None
+
+    @property
+    def files(self) -> dict[Path, IndexedFile]:
+        if self._files is None:
+            with profiling.phase("cache read"):
+                entries = read_cached_files(self.con, self.dir_path)
+            self._files = {self.dir_path / name: entries[name] for name in self.position}
+        return self._files
+
+    def add(self, entry: IndexedFile) -> None:
+        raise TypeError("A CachedIndex is read from its cache, it can't be added to.")
+
+    def close(self) -> None:
+        self.con.close()
+
+    def rows(self, query: str, parameters=()) -> list[tuple]:
+        """
+        The rows of query, whose first column is the file name, in glob order.
+        """
+        with profiling.phase("cache read"):
+            rows = self.con.execute(query, parameters).fetchall()
+        rows.sort(key=lambda row: self.position[row[0]])
+        return rows
+
+    def list_vitals(self, category: str) -> Counter:
+        vitals = Counter()
+        for name, categories, code in self.rows("SELECT name, categories, code FROM observations"):
+            count = json.loads(categories).count(category)
+            if count:
+                vitals[code] += count
+        return vitals
+
+    def find_values(self, key: tuple[str, str]) -> tuple[list[Observation], list[str]]:
+        category, code = key
+        values = []
+        notes = []
+        query = """SELECT o.name, o.categories, o.date, o.timestamp, o.data, o.reference_range, o.has_filename, f.notes
+                   FROM observations o JOIN files f ON f.name = o.name
+                   WHERE o.code = ?"""
+        for name, categories, date, timestamp, data, reference_range, has_filename, file_notes in \
+                self.rows(query, (code,)):
+            # Like ClinicalIndex.add(), a file is listed once for each time it has the category.
+            for _ in range(json.loads(categories).count(category)):
+                notes.extend(json.loads(file_notes))
+                observation = cached_observation(self.dir_path / name, code, date, timestamp, data, reference_range,
+                                                 has_filename)
+                if observation is not None:
+                    values.append(observation)
+        return values, notes
+
+    def file_categories(self, wildcard: str) -> Iterable[tuple[Path, Optional[list[tuple[str, float]]]]]:
+        for name, categories in self.rows("SELECT name, categories FROM files"):
+            if fnmatch(name, wildcard):
+                yield self.dir_path / name, None if categories is None else [tuple(c) for c in json.loads(categories)]
+
+    def resource_rows(self, resource_types: Iterable[str]) -> Iterable[tuple[str, tuple, str]]:
+        resource_types = list(resource_types)
+        query = (F"SELECT name, resource_type, row FROM resources "
+                 F"WHERE resource_type IN ({', '.join('?' * len(resource_types))})")
+        for name, resource_type, row in self.rows(query, resource_types):
+            yield resource_type, tuple(json.loads(row)), str(self.dir_path / name)
+
+@dataclass
+class IngestReport:
+    """
+    What update_cache() found had changed in clinical-records since the cache was last updated.
+    touched files had a new modification time, but the same size and contents, so they weren't decoded again.
+    That's almost every file, after a new export.
+    """
+    added: list[str] = field(default_factory=list)
+    changed: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+    touched: int = 0
+    unchanged: int = 0
+
+    def __str__(self):
+        return (F"{len(self.added)} added, {len(self.changed)} changed, {len(self.removed)} removed, "
+                F"{self.touched + self.unchanged} unchanged ({self.touched} of them rewritten by a new export)")
+
+def update_cache(con: sqlite3.Connection, dir_path: Path, jobs: int) -> tuple[list[str], IngestReport]:
+    """
+    Brings the cache up to date with dir_path. Only files that were added or changed are decoded, and files that are
+    gone are dropped, so after a new export, the work is in proportion to the new records, not the whole history.
+
+    A file with the same name, size and modification time as in the cache is taken to be unchanged, without reading
+    it. If only its modification time is different, as it is for almost every file in a new export, it's read and
+    hashed, and only decoded if the hash is different too. If its size is different, it has changed, so it's decoded
+    without comparing hashes.
+    :return: the names of the files in dir_path, in glob order, and what changed.
+    :raises sqlite3.OperationalError: if the cache needs updating, but can't be written, like when it's read only.
+    """
+    report = IngestReport()
+    cached = {name: (size, mtime_ns, digest) for name, size, mtime_ns, digest in
+              con.execute("SELECT name, size, mtime_ns, hash FROM files")}
+    names = []
+    stale = []
+    with profiling.phase("glob and stat"):
+        for p in dir_path.glob("*.json"):
+            st = p.stat()
+            names.append(p.name)
+            size, mtime_ns, digest = cached.get(p.name, (None, None, None))
+            if (size, mtime_ns) != (st.st_size, st.st_mtime_ns):
+                # Only a file of the same size can have the same contents, so only those are worth hashing first.
+                stale.append((p, st, size is not None, digest if size == st.st_size else None))
+    report.removed = sorted(cached.keys() - set(names))
+    report.unchanged = len(names) - len(stale)
+    touched = []
+    tables = {"files": [], "observations": [], "resources": []}
+    results = map_files(reindex_files, [(p, digest) for p, _, _, digest in stale], jobs,
+                        pack=pack_reindexed, unpack=unpack_reindexed)
+    for (p, st, was_cached, _), (digest, entry) in zip(stale, results):
+        if entry is None:
+            touched.append((st.st_size, st.st_mtime_ns, p.name))
+            continue
+        (report.changed if was_cached else report.added).append(p.name)
+        for table, row in zip(tables, cache_rows(entry, st.st_size, st.st_mtime_ns, digest)):
+            if row is not None:
+                tables[table].append(row)
+    report.touched = len(touched)
+    # All in one transaction, with a statement per table rather than per file, which is most of what writing the
+    # cache the first time used to cost.
+    with con, profiling.phase("cache write"):
+        delete_cached_files(con, report.removed + report.changed)
+        con.executemany("UPDATE files SET size = ?, mtime_ns = ? WHERE name = ?", touched)
+        for table, rows in tables.items():
+            if rows:
+                con.executemany(F"INSERT INTO {table} VALUES ({', '.join('?' * len(rows[0]))})", rows)
+    if profiling.active:
+        profiling.count("files unchanged", report.unchanged)
+        profiling.count("files same contents", report.touched)
+        profiling.count("files added or changed", len(report.added) + len(report.changed))
+    return names, report
+
+def ingest(dir_path: Path, cache_path: Optional[Path] = None, jobs: int = 1) -> IngestReport:
+    """
+    Updates the cache from a new export, without building an index. See update_cache().
+    :param dir_path: The clinical-records directory.
+    :param cache_path: Where to keep the cache. Defaults to default_cache_path(dir_path). To update from an export
+                       that was unzipped somewhere new, point this at the cache of the previous one.
+    :param jobs: number of processes to read new or changed files with.
+    """
+    if cache_path is None:
+        cache_path = default_cache_path(dir_path)
+    con = open_cache(cache_path)
+    try:
+        _, report = update_cache(con, dir_path, jobs)
+    finally:
+        con.close()
+    return report
+
+def load_index(dir_path: Path, cache_path: Optional[Path] = None, jobs: int = 1) -> ClinicalIndex:
+    """
+    Like ClinicalIndex.from_directory(), but keeps what it extracts in a SQLite file, so that later runs only read
+    files that are new or have changed. See update_cache().
+    :param dir_path: The clinical-records directory.
+    :param cache_path: Where to keep the cache. Defaults to default_cache_path(dir_path).
+    :param jobs: number of processes to read new or changed files with.
+    :return: a CachedIndex, which keeps the cache open, in the same order as from_directory would build it.
+    """
+    if cache_path is None:
+        cache_path = default_cache_path(dir_path)
+    try:
+        con = open_cache(cache_path)
+    except sqlite3.Error as e:
+        print(F"Can't use the cache {cache_path}: {e}. Reading all files.")
+        return ClinicalIndex.from_directory(dir_path, jobs)
+    try:
+        names, _ = update_cache(con, dir_path, jobs)
+    except sqlite3.OperationalError as e:
+        # Like a read only cache, which can be read, but not brought up to date.
+        con.close()
+        print(F"Can't update the cache {cache_path}: {e}. Reading all files.")
+        return ClinicalIndex.from_directory(dir_path, jobs)
+    except BaseException:
+        con.close()
+        raise
+    return CachedIndex(con, dir_path, names)
+
+
+def csv_writer():
+    """
+    A writer for printing rows as csv. Make one for all the rows, rather than one per row.
+    """
+    return csv.writer(sys.stdout, quoting=csv.QUOTE_ALL)
+
+def print_csv(data: Iterable):
+    csv_writer().writerow(data)
+
+
+# The reports -c, -a, --procedures and -m print, see resource_query.py.
+CONDITION_FIELDS = ("resourceType", "recordedDate", "clinicalStatus.coding[0].code",
+                    "verificationStatus.coding[0].code", "code.text")
+CONDITIONS = Query(("Condition",), CONDITION_FIELDS, date="recordedDate", sort=("recordedDate",))
+# An AllergyIntolerance has the same layout as a Condition.
+ALLERGIES = replace(CONDITIONS, resource_types=("AllergyIntolerance",))
+PROCEDURES = Query(("Procedure",), ("resourceType", "performedDateTime", "status", "code.text"),
+                   date="performedDateTime", sort=("performedDateTime",))
+ALL_MEDICINES = Query(("MedicationRequest",), ("resourceType", "authoredOn", "status", "medicationReference.display"),
+                      date="authoredOn", sort=("authoredOn",))
+MEDICINES = replace(ALL_MEDICINES, where=(Where("status", "not in", ("completed", "stopped")),))
+
+# What --export writes for each kind of resource, as its name, date, status and verification_status.
+EXPORT_FIELDS = {
+    "Condition": ("code.text", "recordedDate", "clinicalStatus.coding[0].code", "verificationStatus.coding[0].code"),
+    "AllergyIntolerance": ("code.text", "recordedDate", "clinicalStatus.coding[0].code",
+                           "verificationStatus.coding[0].code"),
+    "Procedure": ("code.text", "performedDateTime", "status", None),
+    "MedicationRequest": ("medicationReference.display", "authoredOn", "status", None),
+}
+
+# What the index keeps of each kind of resource: every field the reports and --export use, so they don't need to read
+# the files again. What's kept is what's in the cache, so changing it needs a new CACHE_VERSION.
+RESOURCE_FIELDS: dict[str, tuple[str, ...]] = Scan(
+    [CONDITIONS, ALLERGIES, PROCEDURES, ALL_MEDICINES, MEDICINES] +
+    [Query((resource_type,), tuple(f for f in fields if f)) for resource_type, fields in EXPORT_FIELDS.items()]).fields
+
+def project_files(files: Iterable[Path], fields: dict[str, tuple[str, ...]]) -> list[tuple[str, str, tuple]]:
+    """
+    Reads each file, and keeps only the fields for its resourceType, from its file name, like the index does.
+    :param fields: resourceType -> the fields to keep, like Scan.fields
+    :return: (resourceType, file, the values of its fields) for each file
+    """
+    rows = []
+    for p in files:
+        resource_type = Path(p).stem.split("-")[0]
+        rows.append((resource_type, str(p), project(read_json(p), fields[resource_type])))
+    return rows
+
+def run_queries(cd: Path, queries: list[Query], index: Optional["ClinicalIndex"] = None, jobs: int = 1) -> list[Result]:
+    """
+    Answers all the queries in one pass, over the index, if it has every field they need, or else over the files in
+    cd. Only the files of the resourceTypes they are about are read, and each one once, however many queries there are.
+    :param jobs: the number of processes to read the files in
+    :return: a Result for each query, in the same order
+    """
+    scan = Scan(queries)
+    if index is not None and all(set(fields) <= set(RESOURCE_FIELDS.get(resource_type, ()))
+                                 for resource_type, fields in scan.fields.items()):
+        with profiling.phase("query"):
+            for resource_type, row, name in index.resource_rows(scan.fields):
+                scan.add(resource_type, dict(zip(RESOURCE_FIELDS[resource_type], row)), name)
+    else:
+        files = (p for p in cd.glob("*.json") if Path(p).stem.split("-")[0] in scan.fields)
+        for resource_type, name, values in map_files(project_files, files, jobs, scan.fields):
+            scan.add(resource_type, dict(zip(scan.fields[resource_type], values)), name)
+    with profiling.phase("sort"):
+        return scan.results()
+
+def print_rows(rows: list[tuple], csv_format: bool) -> NoReturn:
+    writer = csv_writer() if csv_format else None
+    with profiling.phase("print"):
+        for row in rows:
+            if csv_format:
+                writer.writerow(row)
+            else:
+                # Almost the same as csv, but the csv version escapes special characters, if there are any.
+                print(row)
+
+def print_report(result: Result, csv_format: bool) -> NoReturn:
+    for note in result.notes:
+        print(note)
+    rows, query = result.rows, result.query
+    if "MedicationRequest" in query.resource_types:
+        # Line up printed columns. An authoredOn is often just a date, padded to the width of one with a time.
+        # It always has been, in csv too, so it still is.
+        i = query.fields.index(query.date)
+        rows = [row[:i] + (row[i] + 10 * " " if len(row[i]) == 10 else row[i],) + row[i + 1:] for row in rows]
+    print_rows(rows, csv_format)
+
+def print_reports(cd: Path, queries: list[Query], csv_format: bool, *, index: Optional["ClinicalIndex"] = None,
+                  jobs: int = 1) -> NoReturn:
+    """
+    Prints each query, like CONDITIONS or MEDICINES, one after the other, all from one pass, see run_queries.
+    """
+    for result in run_queries(cd, queries, index, jobs):
+        print_report(result, csv_format)
 
 def print_value(w: Observation):
     print(F"{w.name:10}: {w.date} - ", end="")
@@ -392,32 +1282,124 @@ def print_value(w: Observation):
         print(F" {value.value:6.1f} {value.unit},", end="")
     print()
 
-def print_value_csv(w: Observation):
+def print_value_csv(w: Observation, writer=None):
     fields = [w.name, w.date]
     values = w.data
     for value in values:
         fields.append(value.value)
         fields.append(value.unit)
         fields.append(value.name)
-    print_csv(fields)
+    (writer or csv_writer()).writerow(fields)
 
 def print_values(ws: list[Observation], csv_format: bool) -> NoReturn:
+    writer = csv_writer() if csv_format else None
     for w in ws:
         if csv_format:
-            print_value_csv(w)
+            print_value_csv(w, writer)
         else:
             print_value(w)
 
+# One table for everything --export writes, so it can all go in one file, and be loaded as one data frame.
+# An Observation has a row for each of its values, and a Condition, AllergyIntolerance, Procedure or MedicationRequest
+# has one row, with its text as the name.
+EXPORT_COLUMNS = [("resource_type", str), ("category", str), ("name", str), ("date", str), ("component", str),
+                  ("value", float), ("unit", str), ("status", str), ("verification_status", str), ("file", str)]
+
+def export_rows(entries: Iterable[IndexedFile], stats: Optional[list[StatInfo]] = None,
+                after: Optional[str] = None, before: Optional[str] = None) -> Iterable[tuple]:
+    """
+    The rows for --export, in EXPORT_COLUMNS order, from one pass over the entries, in the order of the files.
+    An Observation is a stat in each of its categories, like it is everywhere else, so one that is in both Lab and
+    Laboratory has its values written for each.
+    :param entries: the IndexedFiles of a ClinicalIndex, or as they are read, from index_files.
+    :param stats: only the values of these stats, and no other resources. Default is everything.
+    :param after: only the rows dated strictly after this date, like --after. A resource whose date is missing, or
+                  isn't one, is left out when there's a range, as it is from the reports.
+    :param before: only the rows dated strictly before this date.
+    """
+    wanted = None if stats is None else {(stat.category_name, stat.name) for stat in stats}
+    start = to_timestamp(after) if after else None
+    end = to_timestamp(before) if before else None
+
+    def in_range(timestamp: Optional[int]) -> bool:
+        if start is None and end is None:
+            return True
+        return timestamp is not None and (start is None or timestamp > start) and (end is None or timestamp < end)
+
+    for entry in entries:
+        name = entry.filename.name
+        ob = entry.observation
+        if ob is not None:
+            if not in_range(ob.timestamp):
+                continue
+            for category in entry.observation_categories:
+                if wanted is None or (category, entry.code) in wanted:
+                    for vq in ob.data:
+                        yield "Observation", category, entry.code, ob.date, vq.name, vq.value, vq.unit, None, None, name
+        elif entry.row is not None and wanted is None and entry.prefix in EXPORT_FIELDS:
+            values = dict(zip(RESOURCE_FIELDS[entry.prefix], entry.row))
+            text, date, status, verification = (values.get(f) for f in EXPORT_FIELDS[entry.prefix])
+            if start is not None or end is not None:
+                try:
+                    timestamp = to_timestamp(date)
+                except (TypeError, ValueError):
+                    timestamp = None
+                if not in_range(timestamp):
+                    continue
+            yield entry.prefix, None, text, date, None, None, None, status, verification, name
+
+def export(condition_path: Path, index: Optional[ClinicalIndex], stats: Optional[list[StatInfo]], file_name: str,
+           format: Optional[str] = None, jobs: int = 1, *, after: Optional[str] = None,
+           before: Optional[str] = None) -> int:
+    """
+    Writes export_rows to file_name, as they are made, dated after after and before before, if given.
+    :param index: the index to write from. If None, the files are read as they are written, and not kept, so the
+                  memory used doesn't grow with the size of the export.
+    :param format: one of row_writer.FORMATS. Default is from the extension of file_name.
+    :return: the number of rows written
+    """
+    if index is not None:
+        entries = index.files.values()
+    else:
+        entries = map_files(index_files, condition_path.glob("*.json"), jobs, None,
+                            pack=pack_entry, unpack=unpack_entry)
+    with open_writer(file_name, EXPORT_COLUMNS, format) as writer, profiling.phase("export"):
+        for row in export_rows(entries, stats, after, before):
+            writer.write(row)
+    return writer.rows
+
 
-def list_vitals(observation_files: Iterable[str], category: str) -> Counter:
+def list_vitals(observation_files: "Iterable[str] | ClinicalIndex", category: str, jobs: int = 1) -> Counter:
+    if isinstance(observation_files, ClinicalIndex):
+        return observation_files.list_vitals(category)
     vitals = Counter()
-    signs_found = filter_category(observation_files, category)
-    for observation in signs_found:
-        code_name = observation['code']['text']
+    for code_name in map_files(filter_codes, observation_files, jobs, category):
         vitals[code_name] += 1
     return vitals
 
-def print_vitals(observation_files: Iterable[str], category: str) -> NoReturn:
+def print_summary(series: "ObservationSeries", bucket: Optional[str], csv_format: bool) -> NoReturn:
+    """
+    Prints series.summarize(bucket), a line per component and bucket. As csv, the columns are the stat, component,
+    units, bucket, count, min, max, mean, median, then the percentiles, in PERCENTILES order.
+    """
+    from observation_series import PERCENTILES
+    writer = csv_writer() if csv_format else None
+    for summary in series.summarize(bucket):
+        units = ", ".join(summary.units)
+        if not csv_format:
+            print(F"{series.name}: {summary.component} ({units})")
+            print(F"  {'':10} {'count':>6} {'min':>8} {'max':>8} {'mean':>8} {'median':>8}"
+                  + "".join(F" {F'p{p}':>8}" for p in PERCENTILES))
+        for i, bucket_name in enumerate(summary.buckets):
+            numbers = [summary.min[i], summary.max[i], summary.mean[i], summary.median[i]] + \
+                      [summary.percentiles[p][i] for p in PERCENTILES]
+            if csv_format:
+                writer.writerow([series.name, summary.component, units, bucket_name, int(summary.count[i])]
+                                + [float(n) for n in numbers])
+            else:
+                print(F"  {bucket_name:10} {summary.count[i]:6}" + "".join(F" {n:8.4g}" for n in numbers))
+
+def print_vitals(observation_files: "Iterable[str] | ClinicalIndex", category: str) -> NoReturn:
     vitals = list_vitals(observation_files, category)
     print(F"Files that have a category of '{category}' were found in files. These codes were found in them.")
     v_sorted = sorted(vitals, key=lambda x: vitals[x], reverse=True)
@@ -440,7 +1422,47 @@ def print_prefixes(dir_path: Path) -> NoReturn:
     for ext, count in extensions.items():
         print(F"{count:6} {ext}")
 
-def list_categories(dir_path: Path, only_first, *, one_prefix) -> (list[tuple], Counter, int):
+def get_categories(observation_data: dict, p) -> list[tuple[str, float]]:
+    """
+    Returns the categories of one file, as (name, weight) pairs, in the order they appear in the file.
+    See list_categories for the formats we understand.
+    :param observation_data: The contents of the file.
+    :param p: The file name, for error messages.
+    :return: list of (category name, amount to count it as)
+    """
+    if "category" not in observation_data:
+        raise ValueError(F"File {p} has no category", p)
+    cat_top = observation_data["category"]
+    if isinstance(cat_top, str):
+        return [(cat_top, 0.1)]
+    elif isinstance(cat_top, dict):
+        assert 'text' in cat_top
+        assert isinstance(cat_top['text'], str)
+        return [(cat_top['text'], 1)]
+    elif isinstance(cat_top, list):
+        categories = []
+        for ci in cat_top:
+            if isinstance(ci, str):
+                categories.append((ci, 1))
+            elif isinstance(ci, dict):
+                assert 'text' in ci
+                categories.append((ci['text'], 1))
+        return categories
+    else:
+        raise ValueError(F"File {p} has no category", p)
+
+def read_categories(files: Iterable[Path]) -> list[list[tuple[str, float]]]:
+    """
+    get_categories for a batch of files.
+    """
+    categories = []
+    for p in files:
+        observation_data = read_json(p)
+        categories.append(get_categories(observation_data, p))
+    return categories
+
+def list_categories(dir_path: Path, only_first, *, one_prefix, index: Optional["ClinicalIndex"] = None,
+                    jobs: int = 1) -> (list[tuple], Counter, int):
     """
     The schema of this data is not well-designed. I have seen category expressed FOUR ways so far.
 
@@ -470,49 +1492,40 @@ def list_categories(dir_path: Path, only_first, *, one_prefix) -> (list[tuple],
     :param dir_path: Path of the directory to scan.
     :param only_first:  Only take the first category in a file. This is so we can see if there are any files without
                         categories.
+    :param index: If given, categories come from the index, and dir_path is not read.
+    :param jobs: number of processes to read the files with.
     :return: c_sorted, counter, count
     """
+    if index is not None:
+        return index.list_categories(only_first, one_prefix=one_prefix)
+
     counter = Counter()
     count = 0
     wildcard = "*.json"
     if one_prefix:
         wildcard = one_prefix + wildcard
 
-    for p in dir_path.glob(wildcard):
-        with open(p) as f:
-            count += 1
-            observation_data = json.load(f)
-            cat_top = observation_data["category"]
-            if isinstance(cat_top, str):
-                counter[cat_top] += 0.1
-            elif isinstance(cat_top, dict):
-                assert 'text' in ci
-                assert isinstance(cat_top['text'], str)
-                counter[cat_top['text']] += 1
-            elif isinstance(cat_top, list):
-                for ci in cat_top:
-                    if isinstance(ci, str):
-                        counter[ci] += 1
-                    elif isinstance(ci, dict):
-                        assert 'text' in ci
-                        counter[ci['text']] += 1
-                    if only_first:
-                        break
-            else:
-                raise ValueError(F"File {p} has no category", p)
+    # The counts are added up here, in file order, rather than in the workers, so they come out exactly the same.
+    for categories in map_files(read_categories, dir_path.glob(wildcard), jobs):
+        count += 1
+        if only_first:
+            categories = categories[:1]
+        for name, weight in categories:
+            counter[name] += weight
 
     c_sorted = sorted(counter, key=lambda x: counter[x], reverse=True)
     return c_sorted, counter, count
 
-def print_categories(dir_path: Path, only_first, *, one_prefix) -> NoReturn:
+def print_categories(dir_path: Path, only_first, *, one_prefix, index: Optional["ClinicalIndex"] = None) -> NoReturn:
     """
 
     :param dir_path:
     :param only_first:
     :param one_prefix:
+    :param index: Optional ClinicalIndex of dir_path, so we don't have to read the files again.
     :return:
     """
-    c_sorted, counter, count = list_categories(dir_path, only_first, one_prefix=one_prefix)
+    c_sorted, counter, count = list_categories(dir_path, only_first, one_prefix=one_prefix, index=index)
     print(F"Categories found in {count} files in {dir_path}")
 
     c2 = 0
@@ -526,24 +1539,82 @@ def print_categories(dir_path: Path, only_first, *, one_prefix) -> NoReturn:
     return counter
 
 
+def date_argument(text: str) -> str:
+    """
+    The type of --after and --before. It's kept as given, once we know to_timestamp can read it.
+    """
+    try:
+        to_timestamp(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(F"{text!r} isn't a date. Give one like 2024-01-01, or 2024-01-01T10:00:00Z")
+    return text
+
+def max_points_argument(text: str) -> int:
+    """
+    The type of --max-points: 0, for every point, or at least 3, since downsample.lttb always keeps the first and last.
+    """
+    points = int(text)
+    if points != 0 and points < 3:
+        raise argparse.ArgumentTypeError(F"has to be 0, for every point, or at least 3, not {text}")
+    return points
+
+def jobs_argument(text: str) -> int:
+    """
+    The type of --jobs. More processes than CPUs only adds the cost of sending the results between them, so it's
+    capped at os.cpu_count(), with a note.
+    """
+    jobs = int(text)
+    cpus = os.cpu_count() or 1
+    if jobs > cpus:
+        print(F"--jobs {jobs} is more than the {cpus} CPU{'s' if cpus > 1 else ''} here, so using {cpus}.",
+              file=sys.stderr)
+        return cpus
+    return jobs
+
 def parse_args():
     parser = argparse.ArgumentParser(description='Explore Kaiser Health Data',
                                      epilog='Example usage: python health.py -s Weight, --plot, --print')
 
     parser.add_argument('-a', '--allergy', action=argparse.BooleanOptionalAction,
                         help='Print all active allergies.')
-    parser.add_argument('--after', type=str,
-                        help='YYYY-MM-DD format date. Only include dates after this date when using --stat.')
+    parser.add_argument('--after', type=date_argument,
+                        help='YYYY-MM-DD format date. Only include dates after this date, for --stat, for '
+                             '-c, -a, --procedures and -m, and for --export.')
+    parser.add_argument('--before', type=date_argument,
+                        help='YYYY-MM-DD format date. Only include dates before this date, like --after.')
     parser.add_argument('-c', '--conditions', action=argparse.BooleanOptionalAction,
                         help='Print all active conditions.')
+    parser.add_argument('--cache', action=argparse.BooleanOptionalAction, default=True,
+                        help='Keep what was read from clinical-records in a cache file, so the next run only reads '
+                             'new or changed files. On by default.')
+    parser.add_argument('--cache-file', type=str,
+                        help=F'Where to keep the cache. Default is {CACHE_FILE_NAME} in the --source directory, or '
+                             F'next to it, for a zip.')
     parser.add_argument('--categories', action=argparse.BooleanOptionalAction,
                         help='Print all active categories.')
     parser.add_argument('--csv-format', action=argparse.BooleanOptionalAction,
                         help='Format printed output as csv')
     parser.add_argument('-d', '--document-types', action=argparse.BooleanOptionalAction,
                         help='Show the types of documents in the clinical-records directory')
-    parser.add_argument('-g', '--generic', type=str,
-                        help='Lets you specify a category and a code, like -g Vital-signs:Weight. See --categories')
+    parser.add_argument('--all-in-category', type=str, action='append',
+                        help='Every stat in a category, like --all-in-category Lab. Can be repeated. See --categories')
+    parser.add_argument('--export', type=str, metavar='FILE',
+                        help='Write every Observation value, Condition, AllergyIntolerance, Procedure and '
+                             'MedicationRequest to FILE, "-" for stdout, as one table. With -s, -g, --stats-file or '
+                             '--all-in-category, only the values of those stats.')
+    parser.add_argument('--export-format', choices=FORMATS,
+                        help='Format for --export. Default is from the extension of the file, or csv. '
+                             'parquet needs pyarrow.')
+    parser.add_argument('-g', '--generic', type=str, action='append',
+                        help='Lets you specify a category and a code, like -g "Vital Signs#Weight". See --categories. '
+                             'With just a category, lists the codes in it. Can be repeated.')
+    parser.add_argument('--ingest', action=argparse.BooleanOptionalAction,
+                        help='Update the cache from a new export in --source, only reading the files that were added '
+                             'or changed, and print what changed. For an export unzipped somewhere else, give the '
+                             'old cache with --cache-file.')
+    parser.add_argument('-j', '--jobs', type=jobs_argument, default=1,
+                        help='Number of processes to use when reading clinical-records, up to the number of CPUs. '
+                             'Default is 1.')
     parser.add_argument('-l', '--list-vitals', action=argparse.BooleanOptionalAction,
                         help='List names of all vital signs that were found.')
     parser.add_argument('-m', '--medicines', action=argparse.BooleanOptionalAction,
@@ -554,33 +1625,73 @@ def parse_args():
                         help='Plots the vital statistic selected with --stat.')
     parser.add_argument('--procedures', action=argparse.BooleanOptionalAction,
                         help='Prints the procedures found.')
+    parser.add_argument('--profile', action=argparse.BooleanOptionalAction,
+                        help='Print where the time went (by phase), files and bytes read, records matched and '
+                             'skipped, and peak memory, to stderr, at the end.')
+    parser.add_argument('--profile-file', type=str,
+                        help='Also run cProfile, and write its stats to this file. Implies --profile.')
+    parser.add_argument('--last-days', type=int, metavar='N',
+                        help='Only include the last N days, up to now. Works with --before, and with --after, '
+                             'whichever is later.')
+    parser.add_argument('--max-points', type=max_points_argument, default=PLOT_POINTS,
+                        help=F'The most points --plot draws for each line. A longer one is downsampled to this many, '
+                             F'keeping its peaks and dips, in front of a band from its lowest to highest values. '
+                             F'0 to draw every point. Default {PLOT_POINTS}.')
     parser.add_argument('--print', action=argparse.BooleanOptionalAction,
                         help='Prints the vital statistic selected with --stat.')
     parser.add_argument('--source', type=str,
-                        help='Sets the source directory for the data.', default="export/apple_health_export")
-    parser.add_argument('-s', '--stat', type=str,
+                        help='Sets the source directory for the data. Can also be the export zip, which is read '
+                             'without unzipping it.', default="export/apple_health_export")
+    parser.add_argument('--summary', nargs='?', const='all', choices=['all', 'week', 'month', 'year'],
+                        help='Print count, min, max, mean, median and percentiles of each stat, and of each part of '
+                             'it, like the two numbers of a Blood Pressure. All together, or by week, month or year, '
+                             'like --summary month. Works with --after.')
+    parser.add_argument('-s', '--stat', type=str, action='append',
         help='Print a vital statistic, like weight. Name has to match EXACTLY, ' +
             'Weight" is not "weight".\nSome examples:\n' +
             'SpO2, Weight, "Blood Pressure" (quotes are required, if the name has spaces in it).' +
-            'use the -l to get a list of stats found in your data.')
+            'use the -l to get a list of stats found in your data. Can be repeated.')
+    parser.add_argument('--stats-file', type=str,
+                        help='A file of stats, one per line, either a vital sign like -s, or category#code like -g.')
     args = parser.parse_args()
+    if args.export is not None and format_of(args.export, args.export_format) == "parquet":
+        if args.export == "-":
+            parser.error("Parquet can't be written to stdout. Give --export a file name.")
+        import importlib.util  # Only looks for pyarrow, which takes a while to import, and isn't needed yet.
+        if importlib.util.find_spec("pyarrow") is None:
+            parser.error("Writing Parquet needs pyarrow. pip install pyarrow, or use csv or jsonl.")
     active = [args.allergy, args.conditions, args.document_types, args.list_vitals, args.medicines, args.medicines_all,
-              args.categories, args.stat, args.generic, args.procedures]
-    flags = ["-a", "-c", "-d", "-l", "-m", "--medicines-all", "--categories", "-s", "-g", "--procedures"]
+              args.categories, args.stat, args.generic, args.procedures, args.stats_file, args.all_in_category,
+              args.ingest, args.export]
+    flags = ["-a", "-c", "-d", "-l", "-m", "--medicines-all", "--categories", "-s", "-g", "--procedures",
+             "--stats-file", "--all-in-category", "--ingest", "--export"]
     return args, active, flags
 
-def plot(dates, values: list[float], values2: list[float], graph_subject, data_name_1, data_name_2) -> None:
+# The most points plot() draws for each line. A plot is about this many pixels wide, so more wouldn't show.
+PLOT_POINTS = 2000
+
+def plot(dates: "np.ndarray", values: "np.ndarray", values2: Optional["np.ndarray"], graph_subject, data_name_1,
+         data_name_2, max_points: int = PLOT_POINTS) -> None:
+    """
+    :param dates: datetime64 array, like ObservationSeries.dates
+    :param values: float array, one value per date
+    :param values2: optional second float array, for stats like blood pressure
+    :param max_points: a line with more points than this is downsampled to this many, see downsample.py, and drawn
+                       without markers, in front of a band from its lowest to its highest values. 0 for no limit.
+    """
+    import numpy as np
+    import matplotlib.pyplot as plt
+    import matplotlib.dates as mdates
+
     label0 = data_name_1 if data_name_1 else ""
     label1 = data_name_2 if data_name_2 else ""
 
-    dates = [datetime.strptime(date, '%Y-%m-%dT%H:%M:%SZ') for date in dates]
-
     # Find the date range
-    min_date = min(dates)
-    max_date = max(dates)
+    min_date = dates.min()
+    max_date = dates.max()
     num_intervals = 6
 
-    date_range = max_date - min_date
+    date_range = (max_date - min_date).astype('timedelta64[s]').item()
     interval_length = date_range / num_intervals
 
     # Determine and set the locator and formatter directly
@@ -596,9 +1707,19 @@ def plot(dates, values: list[float], values2: list[float], graph_subject, data_n
 
     # Create the plot
     plt.figure(figsize=(10, 6))
-    plt.plot(dates, values, marker='o', label=label0)
-    if values2 is not None:
-        plt.plot(dates, values2, marker='x', linestyle='--', label=label1)
+    for y, marker, linestyle, label in [(values, 'o', '-', label0), (values2, 'x', '--', label1)]:
+        if y is None:
+            continue
+        if not max_points or len(dates) <= max_points:
+            plt.plot(dates, y, marker=marker, linestyle=linestyle, label=label)
+            continue
+        from downsample import lttb, envelope
+        seconds = dates.astype("datetime64[s]").astype(np.int64)
+        keep = lttb(seconds, y, max_points)
+        line, = plt.plot(dates[keep], y[keep], linestyle=linestyle, label=F"{label} ({len(keep):,} of {len(y):,})")
+        band_seconds, low, high = envelope(seconds, y, max_points // 2)
+        plt.fill_between(band_seconds.astype("datetime64[s]"), low, high, step="post", color=line.get_color(),
+                         alpha=0.2, linewidth=0)
 
     plt.legend()
     # Set the locator and formatter
@@ -612,102 +1733,202 @@ def plot(dates, values: list[float], values2: list[float], graph_subject, data_n
     plt.ylabel(graph_subject)
     plt.grid(True)
     plt.tight_layout()
-    plt.ylim(0, max(values))
+    plt.ylim(0, np.nanmax(values))
 
     plt.show()
 
 def do_vital(condition_path: Path, vital: str, after: str, print_data: bool, vplot: bool, csv_format: bool,
-             *, category_name) -> NoReturn:
-    if not print_data and not vplot:
-        print("You need to select at least one of --plot or --print with --stat")
+             *, category_name, index: Optional["ClinicalIndex"] = None, summary: Optional[str] = None,
+             max_points: int = PLOT_POINTS, before: Optional[str] = None) -> NoReturn:
+    """
+    :param after: only the values strictly after this date, like 2024-01-01. None for all of them.
+    :param before: only the values strictly before this date. None for all of them.
+    :param summary: if given, also print a summary of the values, "all" for all of them together, or by one of
+                    observation_series.BUCKETS, like "month".
+    :param max_points: the most points to plot for each line, see plot()
+    """
+    if not print_data and not vplot and not summary:
+        print("You need to select at least one of --plot, --print or --summary with --stat")
         return
 
-    ws = extract_all_values(yield_observation_files(condition_path), stat_info=StatInfo(vital, category_name))
-
-    if after:
-        ad = datetime.strptime(after, '%Y-%m-%d')
-        ws = [w for w in ws if ad < datetime.strptime(w.date, '%Y-%m-%dT%H:%M:%SZ')]
+    source = index if index is not None else yield_observation_files(condition_path)
+    ws = extract_all_values(source, stat_info=StatInfo(category_name, vital))
+    # Only plotting and summaries need the series, and numpy. Printing just needs the list.
+    series = None
+    if vplot or summary:
+        with profiling.phase("series"):
+            series = observations_to_series(ws, vital).between(to_timestamp(after) if after else None,
+                                                               to_timestamp(before) if before else None)
+    if print_data:
+        ws = in_date_range(ws, after, before)
+    found = len(ws) if print_data else len(series)
 
-    if not ws:
+    if not found:
         print(F"No numerical data was found for stat {vital} ")
-        if after:
-            print(F"In the range of values after {after}")
+        if after or before:
+            print(F"In the range of values" + (F" after {after}" if after else "") +
+                  (F" before {before}" if before else ""))
         print(F"You can use the -l argument to see what stats are in your data.")
         return
     if print_data:
-        print_values(ws, csv_format)
+        with profiling.phase("print"):
+            print_values(ws, csv_format)
+    if summary:
+        with profiling.phase("summary"):
+            print_summary(series, None if summary == "all" else summary, csv_format)
     # if print_min_max:
     #     min = min(wc,key=lambda wc: )
 
     if vplot:
-        dates = [observation.date for observation in ws]
-        # Assume lists are homogenous (all have same number and type of fields)
-        first = ws[0]
-        # Assume all valueQuantities are either list, or not list.
-        if len(first.data) == 2:
+        components = series.components()
+        if len(components) == 2:
             # The only multivalued field I have seen so far is blood pressure, with two values.
-            values_1 = [observation.data[0].value for observation in ws]
-            values_2 = [observation.data[1].value for observation in ws]
-            data_name_1 = first.data[0].name
-            data_name_2 = first.data[1].name
-        elif len(first.data) == 1:
-            values_1 = [observation.data[0].value for observation in ws]
+            values_1 = series.values[components[0]]
+            values_2 = series.values[components[1]]
+            data_name_1, data_name_2 = components
+        elif len(components) == 1:
+            values_1 = series.values[components[0]]
             values_2 = None
             data_name_1 = vital
             data_name_2 = None
         else:
-            raise ValueError(f"Unexpected number of data values. {len(first.data)}.")
+            raise ValueError(f"Unexpected number of data values. {len(components)}.")
 
-        plot(dates, values_1, values_2, vital, data_name_1, data_name_2)
+        with profiling.phase("plot"):
+            plot(series.dates, values_1, values_2, vital, data_name_1, data_name_2, max_points)
 
 
+def get_index(condition_path: Path, use_cache: bool, cache_file: Optional[str], jobs: int = 1) -> ClinicalIndex:
+    """
+    Build the index for the command line options --cache, --cache-file and --jobs.
+    """
+    if not use_cache:
+        return ClinicalIndex.from_directory(condition_path, jobs)
+    return load_index(condition_path, Path(cache_file) if cache_file else None, jobs)
+
+def do_vitals(condition_path: Path, stats: list[StatInfo], after: str, print_data: bool, vplot: bool,
+              csv_format: bool, *, index: Optional[ClinicalIndex] = None, summary: Optional[str] = None,
+              max_points: int = PLOT_POINTS, before: Optional[str] = None, jobs: int = 1) -> NoReturn:
+    """
+    do_vital for a list of stats. They all come from the same index, so the files are read once, not once per stat.
+    :param index: if None, one is built with just these stats.
+    :param jobs: number of processes to build that index with.
+    """
+    if not print_data and not vplot and not summary:
+        print("You need to select at least one of --plot, --print or --summary with --stat")
+        return
+    if index is None:
+        index = ClinicalIndex.from_files(yield_observation_files(condition_path), jobs, stats)
+    for stat in stats:
+        do_vital(condition_path, stat.name, after, print_data, vplot, csv_format,
+                 category_name=stat.category_name, index=index, summary=summary, max_points=max_points,
+                 before=before)
+
+def parse_stat(text: str, default_category: str = "Vital Signs") -> StatInfo:
+    """
+    Turns "category#code" into a StatInfo. Just "code" is in default_category, like --stat.
+    """
+    param = text.split("#", 1)
+    if len(param) == 1:
+        return StatInfo(default_category, param[0])
+    return StatInfo(param[0], param[1])
+
+def read_stats_file(file_name: str) -> list[StatInfo]:
+    """
+    Reads a file of stats for --stats-file, one per line, in the parse_stat format. Blank lines are skipped.
+    """
+    stats = []
+    with open(file_name) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                stats.append(parse_stat(line))
+    return stats
+
 def go():
     args, active, flags = parse_args()
-    base = Path("export/apple_health_export")
-    base = Path(args.source)
+    base = source_dir(args.source)
     condition_path = base / "clinical-records"
 
     if not any(active):
         print(F"Please select one of {flags} to get some output.")
         return
-
-    if args.conditions:
-        print_conditions(condition_path, args.csv_format, "Condition*.json")
-
-    if args.allergy:
-        print_conditions(condition_path, args.csv_format, "All*.json")
-
-    if args.procedures:
-        print_procedures(condition_path, args.csv_format, "Procedure*.json")
-
-    if args.medicines or args.medicines_all:
-        include_inactive = False
-        if args.medicines_all:
-            include_inactive = True
-        print_medicines(condition_path, args.csv_format, "MedicationRequest*.json", include_inactive)
-
-    if args.stat:
-        do_vital(condition_path, args.stat, args.after, args.print, args.plot, args.csv_format, category_name="Vital Signs")
+    if args.profile or args.profile_file:
+        profiling.start(args.profile_file)
+
+    # All the reports asked for come from one pass, over the index, or the files.
+    reports = [query for asked, query in [(args.conditions, CONDITIONS), (args.allergy, ALLERGIES),
+                                          (args.procedures, PROCEDURES),
+                                          (args.medicines and not args.medicines_all, MEDICINES),
+                                          (args.medicines_all, ALL_MEDICINES)] if asked]
+
+    # Everything except --document-types reads the same files, so read them once.
+    index = None
+    # --ingest only updates the cache. Anything else asked for then reads the index from the updated cache.
+    if args.ingest:
+        if not args.cache:
+            print("--ingest updates the cache, so it can't be used with --no-cache")
+            return
+        try:
+            report = ingest(condition_path, Path(args.cache_file) if args.cache_file else None, args.jobs)
+        except sqlite3.Error as e:
+            print(F"Can't update the cache: {e}")
+            sys.exit(1)
+        print(F"{condition_path}: {report}")
+    # Without the cache, --export alone reads the files as it writes them, rather than building an index first.
+    # The reports alone only read the files they are about, which is faster than reading even the cached index.
+    without_index = ["-d", "--ingest", "--export", "-a", "-c", "--procedures", "-m", "--medicines-all"]
+    # And stats alone only decode the files that might have them, see ClinicalIndex.from_files.
+    if not args.cache and not args.export:
+        without_index += ["-s", "--stats-file"] + (["-g"] if all("#" in g for g in args.generic or []) else [])
+    if any(a for a, flag in zip(active, flags) if flag not in without_index) or (args.export and args.cache):
+        index = get_index(condition_path, args.cache, args.cache_file, args.jobs)
+
+    after, before = date_window(args.after, args.before, args.last_days)
+    if reports:
+        print_reports(condition_path, [query.between(after, before) for query in reports], args.csv_format,
+                      index=index, jobs=args.jobs)
+
+    # All the stats asked for, however they were asked for, are printed together, from the one index.
+    stats = [StatInfo("Vital Signs", stat) for stat in args.stat or []]
+    stats += [parse_stat(generic) for generic in args.generic or [] if "#" in generic]
+    if args.stats_file:
+        stats += read_stats_file(args.stats_file)
+    for category in args.all_in_category or []:
+        stats += [StatInfo(category, code) for code in sorted(list_vitals(index, category))]
+    # The same stat can be asked for more than one way. Only show it once.
+    unique = {}
+    for stat in stats:
+        unique.setdefault((stat.category_name, stat.name), stat)
+    stats = list(unique.values())
+    if stats and not (args.export and not args.print and not args.plot and not args.summary):
+        do_vitals(condition_path, stats, after, args.print, args.plot, args.csv_format, index=index,
+                  summary=args.summary, max_points=args.max_points, before=before, jobs=args.jobs)
+
+    if args.export:
+        try:
+            rows = export(condition_path, index, stats or None, args.export, args.export_format, args.jobs,
+                          after=after, before=before)
+        except ImportError as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        if args.export != "-":
+            print(F"{rows:,} rows written to {args.export}")
 
     if args.list_vitals:
-        print_vitals(observation_files=yield_observation_files(condition_path), category="Vital Signs")
-
-    if args.generic:
-        param = args.generic.split("#", 1)
-        assert isinstance(param, list)
-        if len(param) == 1:
-            print_vitals(observation_files=yield_observation_files(condition_path), category=param[0])
-        elif len(param) == 2:
-            do_vital(condition_path, param[1], args.after, args.print, args.plot, args.csv_format,
-                     category_name=param[0])
-        else:
-            print("Invalid format: use -g category:code     like '-g \"Vital Signs:Blood Pressure\"")
+        print_vitals(observation_files=index, category="Vital Signs")
+
+    for generic in args.generic or []:
+        if "#" not in generic:
+            print_vitals(observation_files=index, category=generic)
 
     if args.categories:
-        print_categories(condition_path, only_first=False, one_prefix=None)
+        print_categories(condition_path, only_first=False, one_prefix=None, index=index)
 
     if args.document_types:
         print_prefixes(condition_path)
 
+    profiling.report()
+
 if __name__ == "__main__":
     go()
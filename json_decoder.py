@@ -0,0 +1,90 @@
+"""
+Decodes the json files in clinical-records, with orjson or msgspec if one is installed, and the json module if not.
+
+Once the files are read, most of the time it takes to go through clinical-records is decoding json, and orjson does it
+a few times faster than the json module. Neither is required, pip install orjson to use it. health.decode_json() calls
+loads(), and every json file that health.py reads goes through there.
+
+What's decoded has to be exactly what json.loads() gives, so:
+- Anything a faster decoder won't decode, like NaN or a byte order mark, is decoded by json.loads(), which decodes it,
+  or raises its usual error.
+- orjson decodes an integer too big for 64 bits as a float. A file with 19 digits in a row, where that can start, is
+  decoded by json.loads(). There aren't any in the exports we've seen, the ids are letters, digits and dashes.
+
+use() picks a decoder by name, for benchmark_json.py and the tests. Otherwise the first of DECODERS that is installed
+is used, in every process, since each one imports this.
+"""
+import json
+from typing import Any, Callable, Optional
+
+# Fastest first.
+DECODERS = ["orjson", "msgspec", "json"]
+
+# Enough digits in a row for an integer that doesn't fit in 64 bits. Looked for in a copy of the file with every digit
+# made a 0, and everything else a space, which takes a tenth of the time a regular expression does.
+LONG_NUMBER = b"0" * 19
+DIGITS_TO_ZEROS = bytes(ord("0") if chr(i).isdigit() and i < 128 else ord(" ") for i in range(256))
+
+
+def checked(decode: Callable[[bytes], Any], error: type[Exception]) -> Callable[[bytes], Any]:
+    """
+    decode, but with json.loads() for whatever it might decode differently, see above.
+    """
+    def loads(raw: bytes) -> Any:
+        if LONG_NUMBER not in raw.translate(DIGITS_TO_ZEROS):
+            try:
+                return decode(raw)
+            except error:
+                pass
+        return json.loads(raw)
+    return loads
+
+def make_loads(name: str) -> Callable[[bytes], Any]:
+    """
+    :param name: one of DECODERS
+    :return: a function like json.loads, for bytes
+    :raises ImportError: if it isn't installed
+    """
+    if name == "json":
+        return json.loads
+    if name == "orjson":
+        import orjson
+        return checked(orjson.loads, orjson.JSONDecodeError)
+    if name == "msgspec":
+        import msgspec.json
+        return checked(msgspec.json.decode, msgspec.DecodeError)
+    raise ValueError(F"There is no json decoder {name}. It has to be one of {', '.join(DECODERS)}.")
+
+def available() -> list[str]:
+    """
+    The DECODERS that are installed.
+    """
+    names = []
+    for name in DECODERS:
+        try:
+            make_loads(name)
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+def use(name: Optional[str] = None) -> str:
+    """
+    Decode with name from now on, or with the first of DECODERS that is installed.
+    :return: the name of the decoder
+    """
+    global decoder, loads
+    for candidate in [name] if name else DECODERS:
+        try:
+            loads = make_loads(candidate)
+        except ImportError:
+            if name:
+                raise
+            continue
+        decoder = candidate
+        return decoder
+
+
+decoder = "json"
+loads: Callable[[bytes], Any] = json.loads
+use()
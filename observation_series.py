@@ -0,0 +1,176 @@
+"""
+A column oriented version of a list of Observations for one stat.
+
+A list of Observation objects is easy to read, but every date is a string, and every value is a separate Python
+object. To filter by date, sort, or plot, we had to parse each date string again, one at a time. Here the dates are
+a single datetime64 array, and each component (like the systolic and diastolic parts of a blood pressure) is a single
+float64 array, so those operations are done by numpy on whole arrays at once.
+
+summarize() gives count, min, max, mean, median and percentiles of each component, over the whole series or by week,
+month or year, computed on the arrays for all the buckets at once.
+
+Converting to and from a list of Observations is in health.py (observations_to_series, series_to_observations),
+since that's where Observation lives.
+"""
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+# Dates are made from Observation.timestamp, which is UTC seconds. numpy's datetime64 has no time zone, so the Z is
+# put back on the way out.
+DATE_UNIT = "s"
+# For summarize(). Weeks start on Monday, and are labeled by that date. Months are labeled like 2024-02, and years
+# like 2024.
+BUCKETS = ["week", "month", "year"]
+PERCENTILES = [5, 25, 75, 95]
+
+
+def timestamps_to_dates(timestamps) -> np.ndarray:
+    """
+    Converts seconds since 1970, like Observation.timestamp, to a datetime64 array, without parsing any dates.
+    """
+    return np.asarray(timestamps, dtype=np.int64).astype(F"datetime64[{DATE_UNIT}]")
+
+def format_dates(dates: np.ndarray) -> list[str]:
+    """
+    Dates like '2024-02-15T21:00:03Z', from a datetime64 array.
+    """
+    return [d + "Z" for d in np.datetime_as_string(dates, unit=DATE_UNIT)]
+
+
+@dataclass
+class ObservationSeries:
+    """
+    All the values of one stat, as columns. Row i of every array is the same observation.
+
+    name: the stat, like "Blood Pressure"
+    dates: datetime64 array
+    values: component name -> float64 array. A stat with a single value has one component.
+    units: component name -> array of the unit for each row. Usually they are all the same, but nothing says so.
+    ranges: ReferenceRange (or None) for each row
+    filenames: the file each row came from (or None)
+    """
+    name: str
+    dates: np.ndarray
+    values: dict[str, np.ndarray]
+    units: dict[str, np.ndarray]
+    ranges: np.ndarray
+    filenames: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def components(self) -> list[str]:
+        return list(self.values.keys())
+
+    def between(self, after: Optional[int] = None, before: Optional[int] = None) -> "ObservationSeries":
+        """
+        The rows dated strictly after after, and strictly before before, either of which can be None.
+        The dates have to be sorted, as they are from extract_all_values, so the range is two binary searches, and a
+        slice of each array.
+        :param after: seconds since 1970, like Observation.timestamp
+        :param before: seconds since 1970
+        """
+        start = 0 if after is None else int(np.searchsorted(self.dates, np.datetime64(after, DATE_UNIT), "right"))
+        end = len(self) if before is None else int(np.searchsorted(self.dates, np.datetime64(before, DATE_UNIT),
+                                                                   "left"))
+        return self.select(slice(start, max(start, end)))
+
+    def select(self, rows) -> "ObservationSeries":
+        """
+        A new series with only some of the rows.
+        :param rows: a boolean mask, a slice, or an array of row numbers.
+        """
+        return ObservationSeries(self.name, self.dates[rows],
+                                 {k: v[rows] for k, v in self.values.items()},
+                                 {k: v[rows] for k, v in self.units.items()},
+                                 self.ranges[rows], self.filenames[rows])
+
+    def summarize(self, bucket: str = None, percentiles: list[float] = PERCENTILES) -> list["Summary"]:
+        """
+        count, min, max, mean, median and percentiles of each component, over all the rows, or for each week, month
+        or year. Rows where a component is NaN (missing) aren't counted for it.
+        :param bucket: None for all the rows together, or one of BUCKETS.
+        :return: a Summary per component
+        """
+        if bucket is None:
+            labels = np.array(["all"]) if len(self) else np.array([], dtype=str)
+            group = np.zeros(len(self), dtype=np.intp)
+        else:
+            starts, group = np.unique(bucket_starts(self.dates, bucket), return_inverse=True)
+            labels = np.datetime_as_string(starts)
+        summaries = []
+        for component, values in self.values.items():
+            units = [u for u in dict.fromkeys(self.units[component]) if u is not None]
+            summaries.append(Summary(component, units, labels.tolist(),
+                                     **grouped_stats(values, group, len(labels), percentiles)))
+        return summaries
+
+
+def bucket_starts(dates: np.ndarray, bucket: str) -> np.ndarray:
+    """
+    The start of the week, month or year that each date is in.
+    """
+    if bucket == "week":
+        days = dates.astype("datetime64[D]").astype(np.int64)
+        # Day 0, 1970-01-01, was a Thursday, so Monday is 3 days before a multiple of 7.
+        return (days - (days + 3) % 7).astype("datetime64[D]")
+    if bucket == "month":
+        return dates.astype("datetime64[M]")
+    if bucket == "year":
+        return dates.astype("datetime64[Y]")
+    raise ValueError(F"bucket should be one of {BUCKETS}, not {bucket}")
+
+def grouped_stats(values: np.ndarray, group: np.ndarray, groups: int, percentiles: list[float]) -> dict:
+    """
+    The statistics of values in each group, all groups at once. Sorting by (group, value) puts each group's values
+    together, in order, so min, max, the median and the percentiles are just positions in it, and the sums for the
+    means come from one bincount. A group with no values gets a count of 0, and NaN for the rest.
+    :param group: the group number, from 0 to groups - 1, of each value
+    :return: count, min, max, mean, median and percentiles (a dict of percentile -> array), each an array by group
+    """
+    keep = ~np.isnan(values)
+    values, group = values[keep], group[keep]
+    order = np.lexsort((values, group))
+    values, group = values[order], group[order]
+    count = np.bincount(group, minlength=groups)
+    first = np.cumsum(count) - count
+    has = count > 0
+    last = first + np.maximum(count, 1) - 1
+
+    def at(positions: np.ndarray) -> np.ndarray:
+        # Indexing an empty array, even for groups that won't use the result, is an error.
+        if not len(values):
+            return np.full(groups, np.nan)
+        return np.where(has, values[np.minimum(positions, len(values) - 1)], np.nan)
+
+    def percentile(p: float) -> np.ndarray:
+        # The same linear interpolation as np.percentile's default.
+        position = (np.maximum(count, 1) - 1) * p / 100
+        below = np.floor(position).astype(np.intp)
+        above = np.ceil(position).astype(np.intp)
+        low, high = at(first + below), at(first + above)
+        return low + (high - low) * (position - below)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(has, np.bincount(group, weights=values, minlength=groups) / count, np.nan)
+    return {"count": count, "min": at(first), "max": at(last), "mean": mean, "median": percentile(50),
+            "percentiles": {p: percentile(p) for p in percentiles}}
+
+
+@dataclass
+class Summary:
+    """
+    The statistics of one component of a stat, for each bucket. Every array has one entry per bucket.
+    units are the different units the component was in, usually just one.
+    """
+    component: str
+    units: list[str]
+    buckets: list[str]
+    count: np.ndarray
+    min: np.ndarray
+    max: np.ndarray
+    mean: np.ndarray
+    median: np.ndarray
+    percentiles: dict[float, np.ndarray]
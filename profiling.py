@@ -0,0 +1,131 @@
+"""
+Per-phase timing and counters, for --profile.
+
+When a query is slow, this says where the time went: globbing, reading files, decoding json, extracting values,
+sorting, printing or plotting. It also counts files and bytes read, records matched and skipped, and reports the peak
+memory of the process.
+
+    with profiling.phase("json decode"):
+        data = json.loads(raw)
+    if profiling.active:
+        profiling.count("bytes read", len(raw))
+
+Phases can be nested. The time of a phase doesn't include the phases inside it, so the phases add up to (at most)
+the total time, and whatever isn't in any phase is reported as "other".
+
+When profiling is off, which is almost always, phase() returns the same do-nothing context manager every time, and
+count() does nothing. That still costs about half a microsecond a phase, which is a few percent of reading a small
+json file, so code that runs once per file checks profiling.active once, and doesn't use phases at all when it's off.
+
+With --jobs, the work done in the worker processes isn't seen here. It shows up as "other", and only the peak memory
+of the workers is reported.
+"""
+import resource
+import sys
+import time
+from collections import Counter
+from contextlib import nullcontext
+from typing import Optional, TextIO
+
+active = False
+seconds = Counter()
+calls = Counter()
+counters = Counter()
+_stack: list[list] = []  # [name, start] for each open phase
+_started: Optional[float] = None
+_profiler = None  # a cProfile.Profile, with --profile-file
+_profile_file: Optional[str] = None
+_NO_PHASE = nullcontext()
+
+
+class Phase:
+    __slots__ = ("name",)
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        now = time.perf_counter()
+        if _stack:
+            # The enclosing phase stops counting until this one is done.
+            outer = _stack[-1]
+            seconds[outer[0]] += now - outer[1]
+        _stack.append([self.name, now])
+        return self
+
+    def __exit__(self, *exc):
+        now = time.perf_counter()
+        name, start = _stack.pop()
+        seconds[name] += now - start
+        calls[name] += 1
+        if _stack:
+            _stack[-1][1] = now
+        return False
+
+
+def phase(name: str):
+    """
+    A context manager that adds the time spent in it to the phase name.
+    """
+    if not active:
+        return _NO_PHASE
+    return Phase(name)
+
+def count(name: str, n: int = 1) -> None:
+    if active:
+        counters[name] += n
+
+def start(profile_file: Optional[str] = None) -> None:
+    """
+    Turns profiling on.
+    :param profile_file: if given, also run cProfile, and write its stats to this file, for pstats or snakeviz.
+    """
+    global active, _started, _profiler, _profile_file
+    seconds.clear()
+    calls.clear()
+    counters.clear()
+    _stack.clear()
+    active = True
+    _started = time.perf_counter()
+    _profile_file = profile_file
+    if profile_file:
+        import cProfile  # Only needed here, and it imports pstats and more, which slows down starting.
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+def peak_memory(who: int = resource.RUSAGE_SELF) -> int:
+    """
+    :return: peak resident memory in bytes
+    """
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux reports KiB, macOS reports bytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def report(file: TextIO = sys.stderr) -> None:
+    """
+    Turns profiling off, and prints what it found.
+    """
+    global active, _profiler
+    if not active:
+        return
+    total = time.perf_counter() - _started
+    active = False
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler.dump_stats(_profile_file)
+        _profiler = None
+    print(F"\n{'Profile':24} {'seconds':>9} {'%':>6} {'calls':>9}", file=file)
+    for name, s in seconds.most_common():
+        print(F"{name:24} {s:9.3f} {s / total:6.1%} {calls[name]:9,}", file=file)
+    other = total - sum(seconds.values())
+    print(F"{'other':24} {other:9.3f} {other / total:6.1%}", file=file)
+    print(F"{'total':24} {total:9.3f}", file=file)
+    for name, n in counters.items():
+        print(F"{name:24} {n:>16,}", file=file)
+    print(F"{'peak memory':24} {peak_memory() / 2**20:12.1f} MiB", file=file)
+    children = peak_memory(resource.RUSAGE_CHILDREN)
+    if children:
+        print(F"{'peak memory of workers':24} {children / 2**20:12.1f} MiB", file=file)
+    if _profile_file:
+        print(F"cProfile stats written to {_profile_file}. python -m pstats {_profile_file} to read them.",
+              file=file)
@@ -0,0 +1,302 @@
+"""
+A columnar copy of the Records in export.xml, so they only have to be parsed once.
+
+Reading export.xml takes minutes, every time. convert() streams it once, and writes the Records out, one directory per
+record type (like HKQuantityTypeIdentifierHeartRate), with one .npy file per column:
+
+    start, end: int64 seconds since 1970 UTC
+    value: float64, NaN if the value wasn't a number
+    unit, source, text: int32 indexes into the strings list in manifest.json, -1 if missing.
+        text is the value, when it wasn't a number, like HKCategoryValueSleepAnalysisInBed.
+
+manifest.json also has the number of records of each type, and of the ones skipped because they had no startDate or
+endDate. A query for one type memory-maps only that type's columns,
+so it takes about as long as reading the part of them that is actually used.
+
+Example usage:
+    python record_store.py convert export/apple_health_export/export.xml export/records
+    python record_store.py convert export.zip export/records
+    python record_store.py types export/records
+    python record_store.py query export/records HKQuantityTypeIdentifierHeartRate --after 2024-01-01
+"""
+import argparse
+import json
+import shutil
+import sys
+import tempfile
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from export_zip import is_zip, source_dir
+from health import date_argument
+from resource_query import to_timestamp
+from xml_reader import gen
+
+STORE_VERSION = 1
+MANIFEST = "manifest.json"
+COLUMNS = {"start": np.int64, "end": np.int64, "value": np.float64, "unit": np.int32, "source": np.int32,
+           "text": np.int32}
+# Records are buffered as strings, per type, and converted to arrays this many at a time.
+ROWS_PER_CHUNK = 65536
+
+
+def parse_export_dates(dates: list[str]) -> np.ndarray:
+    """
+    Converts dates like '2024-02-15 13:00:03 -0800' to int64 seconds since 1970 UTC, all at once.
+    """
+    if not dates:
+        return np.array([], dtype=np.int64)
+    local = np.array([d[:19] for d in dates]).astype("datetime64[s]").astype(np.int64)
+    # There are only ever a few different offsets, so each one is only parsed once.
+    offsets, which = np.unique([d[20:25] for d in dates], return_inverse=True)
+    seconds = np.array([(-1 if o[0] == "-" else 1) * (int(o[1:3]) * 3600 + int(o[3:5]) * 60) if o else 0
+                        for o in offsets], dtype=np.int64)
+    return local - seconds[which]
+
+def type_dir_name(record_type: str) -> str:
+    """
+    Record types are identifiers, like HKQuantityTypeIdentifierHeartRate, but don't trust that for a path.
+    Two types can have the same name here, StoreWriter.type_dir makes them different.
+    """
+    return "".join(c if c.isalnum() or c in "_-." else "_" for c in record_type)
+
+
+class StoreWriter:
+    """
+    Appends Records to the raw column files of each type, a chunk at a time, then turns them into .npy files at the
+    end, once the number of rows is known. Nothing grows with the size of the export, except the strings table.
+    """
+    def __init__(self, store_dir: Path):
+        self.store_dir = store_dir
+        self.strings: dict[str, int] = {}
+        self.buffers: dict[str, dict[str, list]] = {}
+        self.counts: dict[str, int] = {}
+        self.dirs: dict[str, Path] = {}
+        # Records with no startDate or endDate, by type. They can't go in the start and end columns.
+        self.skipped: Counter = Counter()
+
+    def type_dir(self, record_type: str) -> Path:
+        """
+        The directory for record_type's columns, with a number added to the name if another type already has it.
+        Compared ignoring case, since the file system might.
+        """
+        type_dir = self.dirs.get(record_type)
+        if type_dir is None:
+            taken = {d.name.lower() for d in self.dirs.values()}
+            name = type_dir_name(record_type)
+            n = 1
+            while (name if n == 1 else F"{name}-{n}").lower() in taken:
+                n += 1
+            type_dir = self.dirs[record_type] = self.store_dir / (name if n == 1 else F"{name}-{n}")
+        return type_dir
+
+    def code(self, s: str) -> int:
+        if s is None:
+            return -1
+        return self.strings.setdefault(s, len(self.strings))
+
+    def add(self, attrib) -> None:
+        record_type = attrib.get("type")
+        if not attrib.get("startDate") or not attrib.get("endDate"):
+            self.skipped[record_type] += 1
+            return
+        buffer = self.buffers.get(record_type)
+        if buffer is None:
+            buffer = self.buffers[record_type] = {"start": [], "end": [], "value": [], "unit": [], "source": [],
+                                                  "text": []}
+            self.counts[record_type] = 0
+        value = attrib.get("value")
+        try:
+            number = float(value)
+            text = -1
+        except (TypeError, ValueError):
+            number = np.nan
+            text = self.code(value)
+        buffer["start"].append(attrib.get("startDate"))
+        buffer["end"].append(attrib.get("endDate"))
+        buffer["value"].append(number)
+        buffer["unit"].append(self.code(attrib.get("unit")))
+        buffer["source"].append(self.code(attrib.get("sourceName")))
+        buffer["text"].append(text)
+        if len(buffer["value"]) >= ROWS_PER_CHUNK:
+            self.flush(record_type)
+
+    def flush(self, record_type: str) -> None:
+        buffer = self.buffers[record_type]
+        if not buffer["value"]:
+            return
+        type_dir = self.type_dir(record_type)
+        type_dir.mkdir(parents=True, exist_ok=True)
+        for column, dtype in COLUMNS.items():
+            if column in ("start", "end"):
+                array = parse_export_dates(buffer[column])
+            else:
+                array = np.array(buffer[column], dtype=dtype)
+            with open(type_dir / F"{column}.raw", "ab") as f:
+                array.tofile(f)
+            buffer[column].clear()
+        self.counts[record_type] += len(array)
+
+    def finish(self) -> dict:
+        types = {}
+        for record_type in self.buffers:
+            self.flush(record_type)
+            type_dir = self.type_dir(record_type)
+            count = self.counts[record_type]
+            for column, dtype in COLUMNS.items():
+                raw = type_dir / F"{column}.raw"
+                with open(type_dir / F"{column}.npy", "wb") as out, open(raw, "rb") as f:
+                    np.lib.format.write_array_header_1_0(
+                        out, {"descr": np.dtype(dtype).str, "fortran_order": False, "shape": (count,)})
+                    shutil.copyfileobj(f, out)
+                raw.unlink()
+            types[record_type] = {"dir": type_dir.name, "count": count}
+        manifest = {"version": STORE_VERSION, "types": types, "skipped": dict(self.skipped),
+                    "strings": list(self.strings)}
+        with open(self.store_dir / MANIFEST, "w") as f:
+            json.dump(manifest, f, indent=1)
+        return manifest
+
+
+def convert(xml_file, store_dir: Path) -> dict:
+    """
+    Reads every Record in export.xml, including the ones inside a Correlation, into a new store.
+
+    The store is written to a temporary directory next to store_dir, and only renamed to store_dir once it's
+    finished. So if convert is interrupted, store_dir is as it was, and not half a store with no manifest, which the
+    next convert would refuse to replace.
+    :param xml_file: export.xml, an open binary file of it, or the ZipMember of it in the export zip
+    :param store_dir: where to write the store. It has to be new, empty, or a store, which is replaced.
+    :return: the manifest
+    :raises FileExistsError: if store_dir is anything else, so a mistyped path doesn't delete, say, the export.
+    """
+    if store_dir.exists() and not (store_dir / MANIFEST).is_file():
+        if not store_dir.is_dir() or any(store_dir.iterdir()):
+            raise FileExistsError(F"{store_dir} is already there, and isn't a record store. Give a new directory, "
+                                  F"or the store to replace.")
+    store_dir.parent.mkdir(parents=True, exist_ok=True)
+    temp_dir = Path(tempfile.mkdtemp(prefix=F".{store_dir.name}-", dir=store_dir.parent))
+    try:
+        writer = StoreWriter(temp_dir)
+        for index, event, element in gen(xml_file, ["start"]):
+            if element.tag == "Record":
+                writer.add(element.attrib)
+        manifest = writer.finish()
+    except BaseException:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+    if store_dir.exists():
+        shutil.rmtree(store_dir)
+    temp_dir.rename(store_dir)
+    return manifest
+
+
+@dataclass
+class RecordColumns:
+    """
+    All the Records of one type. The arrays are memory-mapped, so only the parts that are used get read.
+    """
+    record_type: str
+    start: np.ndarray
+    end: np.ndarray
+    value: np.ndarray
+    unit: np.ndarray
+    source: np.ndarray
+    text: np.ndarray
+    strings: list[str]
+
+    def __len__(self) -> int:
+        return len(self.start)
+
+    def string(self, code: int):
+        return None if code < 0 else self.strings[code]
+
+    def start_dates(self) -> np.ndarray:
+        return self.start.astype("datetime64[s]")
+
+
+class RecordStore:
+    def __init__(self, store_dir: Path):
+        self.store_dir = store_dir
+        with open(store_dir / MANIFEST) as f:
+            manifest = json.load(f)
+        if manifest["version"] != STORE_VERSION:
+            raise ValueError(F"{store_dir} is version {manifest['version']}, expected {STORE_VERSION}. "
+                             F"Convert export.xml again.")
+        self.types: dict[str, dict] = manifest["types"]
+        self.skipped: dict[str, int] = manifest.get("skipped", {})
+        self.strings: list[str] = manifest["strings"]
+
+    def load(self, record_type: str) -> RecordColumns:
+        if record_type not in self.types:
+            raise KeyError(record_type)
+        type_dir = self.store_dir / self.types[record_type]["dir"]
+        columns = {column: np.load(type_dir / F"{column}.npy", mmap_mode="r") for column in COLUMNS}
+        return RecordColumns(record_type, strings=self.strings, **columns)
+
+
+def print_types(store: RecordStore) -> None:
+    for record_type, info in sorted(store.types.items(), key=lambda item: -item[1]["count"]):
+        print(F"{info['count']:10,} {record_type}")
+    for record_type, count in store.skipped.items():
+        print(F"*** Skipped {count:,} {record_type} records with no startDate or endDate ***")
+
+def print_query(columns: RecordColumns, after: str = None) -> None:
+    """
+    :param after: only the records that start strictly after this date, in any form to_timestamp reads.
+    """
+    start = columns.start
+    rows = slice(None)
+    if after is not None:
+        rows = start > to_timestamp(after)
+    values = columns.value[rows]
+    dates = columns.start_dates()[rows]
+    print(F"{columns.record_type}: {len(dates)} records")
+    if len(dates) == 0:
+        return
+    print(F"From {dates.min()} to {dates.max()} UTC")
+    numbers = values[~np.isnan(values)]
+    if len(numbers):
+        units = ", ".join(str(columns.string(c)) for c in np.unique(columns.unit[rows]))
+        print(F"min {numbers.min():g}  max {numbers.max():g}  mean {numbers.mean():g}  {units}")
+    codes, counts = np.unique(columns.source[rows], return_counts=True)
+    for c, n in sorted(zip(codes, counts), key=lambda item: -item[1]):
+        print(F"{n:10,} from {columns.string(c)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert export.xml once to a columnar store, and query it.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    p = commands.add_parser("convert", help="Read export.xml into a store. Takes as long as any pass over export.xml.")
+    p.add_argument("xml_file", type=str, help="export.xml, or the export zip, to read it from without unzipping.")
+    p.add_argument("store_dir", type=str)
+    p = commands.add_parser("types", help="List the record types in a store, and how many of each.")
+    p.add_argument("store_dir", type=str)
+    p = commands.add_parser("query", help="Summarize the records of one type.")
+    p.add_argument("store_dir", type=str)
+    p.add_argument("record_type", type=str)
+    p.add_argument("--after", type=date_argument, help="YYYY-MM-DD Only records after this date.")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        xml_file = source_dir(args.xml_file) / "export.xml" if is_zip(args.xml_file) else args.xml_file
+        try:
+            manifest = convert(xml_file, Path(args.store_dir))
+        except FileExistsError as e:
+            print(e)
+            sys.exit(1)
+        print(F"{sum(t['count'] for t in manifest['types'].values()):,} records of {len(manifest['types'])} types "
+              F"written to {args.store_dir} ({sum(f.stat().st_size for f in Path(args.store_dir).rglob('*') if f.is_file()):,} bytes)")
+        for record_type, count in manifest["skipped"].items():
+            print(F"*** Skipped {count:,} {record_type} records with no startDate or endDate ***")
+    elif args.command == "types":
+        print_types(RecordStore(Path(args.store_dir)))
+    elif args.command == "query":
+        store = RecordStore(Path(args.store_dir))
+        if args.record_type not in store.types:
+            print(F"No {args.record_type} in {args.store_dir}")
+            sys.exit(1)
+        print_query(store.load(args.record_type), args.after)
@@ -0,0 +1,216 @@
+"""
+Reports on the FHIR resources in clinical-records, like the list of Conditions, declared as data rather than written
+as code, so any number of them can be answered from one pass over the files.
+
+    active = Query(("Condition",), ("recordedDate", "code.text"), date="recordedDate",
+                   where=(Where("clinicalStatus.coding[0].code", "==", "active"),), sort=("recordedDate",))
+    scan = Scan([active])
+    for name, data in resources:
+        fields = scan.fields.get(data["resourceType"])
+        if fields:
+            scan.add(data["resourceType"], dict(zip(fields, project(data, fields))), name)
+    for result in scan.results():
+        print(result.rows)
+
+A field is a path into a resource's json: names separated by dots, with [n] for the nth item of a list, like
+clinicalStatus.coding[0].code. A resource that doesn't have a field a query needs is left out of that query, with a
+note. It's usually something in the data we haven't seen before, and it's better to say so than to print None.
+
+Filters are applied as each resource is added, so only what's kept is kept in memory, and it's sorted once, at the
+end. Nothing here reads files. health.run_queries does that, or answers the queries from the index.
+"""
+import operator
+import re
+from dataclasses import dataclass, replace
+from datetime import datetime, timezone
+from functools import cache, cached_property
+from typing import Any, Callable, Iterable, Optional
+
+OPERATORS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "in": lambda value, values: value in values,
+    "not in": lambda value, values: value not in values,
+}
+
+FIELD_PART = re.compile(r"([A-Za-z_][\w-]*)((?:\[-?\d+\])*)")
+
+
+def to_timestamp(date: str) -> int:
+    """
+    Seconds since 1970 for a date like '2024-02-15T21:00:03Z'. A date without a time zone, like '2024-02-15', is UTC.
+    FHIR allows a date of just a year, or a year and month, like '2019' or '2019-05', which is the first day of it.
+    It's here, rather than in health.py, which uses it for Observations, so that Query.between() can use it too.
+    :raises ValueError: if it isn't a date
+    """
+    if len(date) == 4:
+        date += "-01-01"
+    elif len(date) == 7:
+        date += "-01"
+    d = datetime.fromisoformat(date)
+    if d.tzinfo is None:
+        d = d.replace(tzinfo=timezone.utc)
+    return int(d.timestamp())
+
+
+@cache
+def parse_field(field: str) -> tuple[str | int, ...]:
+    """
+    'clinicalStatus.coding[0].code' -> ('clinicalStatus', 'coding', 0, 'code')
+    """
+    steps = []
+    for part in field.split("."):
+        match = FIELD_PART.fullmatch(part)
+        if match is None:
+            raise ValueError(F"{field!r} isn't a field. A field is names separated by dots, with [n] for the nth item "
+                             F"of a list, like clinicalStatus.coding[0].code")
+        steps.append(match[1])
+        steps.extend(int(i) for i in re.findall(r"-?\d+", match[2]))
+    return tuple(steps)
+
+def get_field(data: dict, field: str) -> Any:
+    """
+    :return: the value of field in data, or None if data doesn't have it.
+    """
+    value = data
+    for step in parse_field(field):
+        try:
+            value = value[step]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return value
+
+def project(data: dict, fields: Iterable[str]) -> tuple:
+    """
+    The value of each of fields in data, None for any it doesn't have.
+    """
+    return tuple(get_field(data, field) for field in fields)
+
+
+@dataclass(frozen=True)
+class Where:
+    """
+    Keeps the resources for which "field op value" is true, like Where("status", "not in", ("completed", "stopped")).
+    op is one of OPERATORS. If there's a parse, like to_timestamp, it's what the field is parsed with before it's
+    compared, and value is already parsed.
+    """
+    field: str
+    op: str
+    value: Any
+    parse: Optional[Callable[[Any], Any]] = None
+
+    def __post_init__(self):
+        parse_field(self.field)
+        if self.op not in OPERATORS:
+            raise ValueError(F"{self.op!r} isn't an operator. It has to be one of {', '.join(OPERATORS)}")
+
+    def test(self, value: Any) -> bool:
+        if self.parse is not None:
+            value = self.parse(value)
+        return OPERATORS[self.op](value, self.value)
+
+
+@dataclass(frozen=True)
+class Query:
+    """
+    :param resource_types: the resourceTypes it reports on, like ("Condition",)
+    :param fields: what's reported for each resource, in order
+    :param date: the field that has the resource's date, for between()
+    :param where: only the resources for which all of these are true
+    :param sort: the fields to sort by. Resources that sort the same stay in the order they were added.
+    """
+    resource_types: tuple[str, ...]
+    fields: tuple[str, ...]
+    date: Optional[str] = None
+    where: tuple[Where, ...] = ()
+    sort: tuple[str, ...] = ()
+
+    def __post_init__(self):
+        for field in [*self.fields, *self.sort, *([self.date] if self.date else [])]:
+            parse_field(field)
+
+    @cached_property
+    def needs(self) -> tuple[str, ...]:
+        """
+        Every field the query uses, in fields, where or sort, once each.
+        """
+        return tuple(dict.fromkeys([*self.fields, *(w.field for w in self.where), *self.sort]))
+
+    def between(self, after: Optional[str] = None, before: Optional[str] = None) -> "Query":
+        """
+        The same query, for only the resources dated strictly after after, and before before, either of which can be
+        None. Dates are compared as seconds since 1970, see to_timestamp, like --after and --before are for -s, so a
+        time zone offset counts, and '2024-01-01T10:00:00Z' is after '2024-01-01'.
+        :raises ValueError: if after or before isn't a date
+        """
+        where = list(self.where)
+        for date, op in [(after, ">"), (before, "<")]:
+            if date:
+                assert self.date is not None, F"A query on {self.resource_types} has no date to compare with {date}"
+                where.append(Where(self.date, op, to_timestamp(date), to_timestamp))
+        return replace(self, where=tuple(where))
+
+
+@dataclass
+class Result:
+    """
+    The rows a query found, in the order of its fields, sorted, and a note for each resource that was left out.
+    """
+    query: Query
+    rows: list[tuple]
+    notes: list[str]
+
+
+class Scan:
+    """
+    Answers a list of queries from one pass over the resources. add() each resource, then get the results().
+    """
+    def __init__(self, queries: Iterable[Query]):
+        self.queries = list(queries)
+        self.kept: list[list[tuple]] = [[] for _ in self.queries]
+        self.notes: list[list[str]] = [[] for _ in self.queries]
+        self.by_type: dict[str, list[int]] = {}
+        for i, query in enumerate(self.queries):
+            for resource_type in query.resource_types:
+                self.by_type.setdefault(resource_type, []).append(i)
+        # resourceType -> every field the queries on it need, which is what add() has to be given.
+        self.fields: dict[str, tuple[str, ...]] = {
+            resource_type: tuple(dict.fromkeys(field for i in queries for field in self.queries[i].needs))
+            for resource_type, queries in self.by_type.items()}
+
+    def add(self, resource_type: str, values: dict[str, Any], name: str) -> None:
+        """
+        :param values: field -> value, for at least the fields of resource_type. None if the resource doesn't have it.
+        :param name: the file it's from, for notes
+        """
+        for i in self.by_type.get(resource_type, ()):
+            query = self.queries[i]
+            row = tuple(values[field] for field in query.needs)
+            if None in row:
+                missing = query.needs[row.index(None)]
+                self.notes[i].append(F"*** No {missing!r} found in {name} ***")
+                continue
+            try:
+                if all(where.test(values[where.field]) for where in query.where):
+                    self.kept[i].append(row)
+            except (TypeError, ValueError) as e:
+                # A Where with a parse, on a value it can't parse, like a date that isn't one.
+                self.notes[i].append(F"*** Can't compare {name}: {e} ***")
+
+    def results(self) -> list[Result]:
+        """
+        A Result for each query, in the order they were given.
+        """
+        results = []
+        for query, kept, notes in zip(self.queries, self.kept, self.notes):
+            position = {field: i for i, field in enumerate(query.needs)}
+            if query.sort:
+                sort = [position[field] for field in query.sort]
+                kept.sort(key=lambda row: [row[i] for i in sort])
+            fields = [position[field] for field in query.fields]
+            results.append(Result(query, [tuple(row[i] for i in fields) for row in kept], notes))
+        return results
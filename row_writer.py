@@ -0,0 +1,158 @@
+"""
+Writes rows to a file, or stdout, as CSV, JSON Lines or Parquet, for --export.
+
+Rows are written as they come, through one buffered file, so a dump of everything takes about as long as it takes to
+produce the rows, and the memory it uses doesn't grow with the number of rows. Parquet needs pyarrow, which is only
+imported when Parquet is asked for. Its rows are buffered ROWS_PER_BATCH at a time, and each batch is written as a row
+group.
+
+    with open_writer("values.csv", [("name", str), ("value", float)]) as writer:
+        for row in rows:
+            writer.write(row)
+
+A column's type is str or float, and any value can be None.
+"""
+import csv
+import json
+import sys
+from abc import ABC, abstractmethod
+from pathlib import PurePath
+from typing import Optional, TextIO
+
+FORMATS = ["csv", "jsonl", "parquet"]
+BUFFER_BYTES = 1 << 20
+ROWS_PER_BATCH = 65536
+
+
+class RowWriter(ABC):
+    """
+    Writes rows, which are tuples in the order of columns. There's a subclass for each of FORMATS.
+    """
+    def __init__(self, file_name: str, columns: list[tuple[str, type]]):
+        self.file_name = file_name
+        self.columns = columns
+        self.rows = 0
+
+    @abstractmethod
+    def write(self, row: tuple) -> None:
+        ...
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def open_text(self) -> TextIO:
+        """
+        The file, with a large buffer, rather than a flush per line. Or stdout, if file_name is "-".
+        """
+        if self.file_name == "-":
+            return sys.stdout
+        return open(self.file_name, "w", buffering=BUFFER_BYTES, newline="", encoding="utf-8")
+
+    def close_text(self, file: TextIO) -> None:
+        if file is sys.stdout:
+            file.flush()
+        else:
+            file.close()
+
+
+class CsvRowWriter(RowWriter):
+    """
+    A header line of the column names, then a line per row. None is written as an empty field.
+    """
+    def __init__(self, file_name: str, columns: list[tuple[str, type]]):
+        super().__init__(file_name, columns)
+        self.file = self.open_text()
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([name for name, _ in columns])
+
+    def write(self, row: tuple) -> None:
+        self.writer.writerow(row)
+        self.rows += 1
+
+    def close(self) -> None:
+        self.close_text(self.file)
+
+
+class JsonLinesRowWriter(RowWriter):
+    """
+    A json object per line, with the column names as keys.
+    """
+    def __init__(self, file_name: str, columns: list[tuple[str, type]]):
+        super().__init__(file_name, columns)
+        self.file = self.open_text()
+        self.names = [name for name, _ in columns]
+
+    def write(self, row: tuple) -> None:
+        self.file.write(json.dumps(dict(zip(self.names, row)), ensure_ascii=False))
+        self.file.write("\n")
+        self.rows += 1
+
+    def close(self) -> None:
+        self.close_text(self.file)
+
+
+class ParquetRowWriter(RowWriter):
+    def __init__(self, file_name: str, columns: list[tuple[str, type]]):
+        super().__init__(file_name, columns)
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ImportError("Writing Parquet needs pyarrow. pip install pyarrow, or use csv or jsonl.") from e
+        if file_name == "-":
+            raise ValueError("Parquet can't be written to stdout. Give a file name.")
+        self.pa = pyarrow
+        types = {str: pyarrow.string(), float: pyarrow.float64()}
+        self.schema = pyarrow.schema([(name, types[t]) for name, t in columns])
+        self.writer = pyarrow.parquet.ParquetWriter(file_name, self.schema)
+        self.batch: list[list] = [[] for _ in columns]
+
+    def write(self, row: tuple) -> None:
+        for column, value in zip(self.batch, row):
+            column.append(value)
+        self.rows += 1
+        if len(self.batch[0]) >= ROWS_PER_BATCH:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.batch[0]:
+            self.writer.write_batch(self.pa.record_batch(self.batch, schema=self.schema))
+            for column in self.batch:
+                column.clear()
+
+    def close(self) -> None:
+        self.flush()
+        self.writer.close()
+
+
+WRITERS = {
+    "csv": CsvRowWriter,
+    "jsonl": JsonLinesRowWriter,
+    "parquet": ParquetRowWriter,
+}
+
+EXTENSIONS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".json": "jsonl", ".parquet": "parquet",
+              ".pq": "parquet"}
+
+def format_of(file_name: str, format: Optional[str] = None) -> str:
+    """
+    The format asked for, or else the one that matches the file's extension, or else csv.
+    """
+    if format is not None:
+        return format
+    return EXTENSIONS.get(PurePath(file_name).suffix.lower(), "csv")
+
+def open_writer(file_name: str, columns: list[tuple[str, type]], format: Optional[str] = None) -> RowWriter:
+    """
+    :param file_name: where to write, or "-" for stdout
+    :param columns: (name, type) of each column, where type is str or float
+    :param format: one of FORMATS. Default is from the extension of file_name, see format_of.
+    """
+    return WRITERS[format_of(file_name, format)](file_name, columns)
@@ -8,8 +8,9 @@ you can use a fixed value for the upper and lower limit of the value.True
     Date range should be from the lowest date of any  test,  to the highest date of any test.test_categories()
 Need to figure out how to scale each sparkline separately
 could also maybe use pygal, which sounds cool. But let's use matplotlib for now.
+Or --svg, which writes the sparklines as inline SVG, without matplotlib. See svg_sparkline.py.
 
-TODO: Need to match the date range across all sparklines, if I'm going to line them up.
+All the sparklines on a page share one date range, PNG or SVG, so their years line up.
 
 TODO: I need normal range for every test we want to plot (I guess it's not required, just nice to have).
       It looks like what I want is in Observation-*.json files,
@@ -17,28 +18,39 @@ TODO: I need normal range for every test we want to plot (I guess it's not requi
 
 TODO: This file has a test name of "---": Observation-7881B1CD-55FD-42BD-8FFB-CE98D13C88CD.json, fix it.
 """
+import argparse
 import base64
-from datetime import datetime
 from io import BytesIO
 from pathlib import Path
 from typing import TextIO
 
-from matplotlib import pyplot as plt
-import matplotlib.dates as mdates
+from health import extract_all_values, yield_observation_files, Observation, StatInfo, print_vitals, list_vitals, \
+    load_index, max_points_argument
+from svg_sparkline import svg_sparkline, date_range
 
-from health import extract_all_values, yield_observation_files, Observation, StatInfo, print_vitals, list_vitals
+# matplotlib is only imported when a PNG sparkline is drawn, since the SVG ones don't need it.
 
+# A sparkline is about 400 pixels wide, so a stat with more values than this is downsampled to this many.
+SPARKLINE_POINTS = 400
 
-def sparkline(data_x_str: list[str], data_y: list[float], graph_y_min, graph_y_max, normal_min, normal_max):
+
+def draw_sparkline(axes, data_x: list[int], data_y: list[float], graph_y_min, graph_y_max, normal_min, normal_max,
+                   x_range: tuple[int, int] = None):
+    """
+    :param data_x: the dates, as seconds since 1970, like Observation.timestamp
+    :param x_range: (first, last) date, in seconds, for the x axis, see svg_sparkline.date_range. Default is the
+                    range of data_x.
+    """
     # We assumed that normal would be horizontal lines. We have found some tests that have a referenceRange
     # for some values, and not for others. I think there is a way to shade between curves. Try that.
-    data_x = [datetime.strptime(date, '%Y-%m-%dT%H:%M:%SZ') for date in data_x_str]
+    import matplotlib.dates as mdates
+    import numpy as np
+    data_x = np.asarray(data_x, dtype=np.int64).astype("datetime64[s]")
 
-    fig, axes = plt.subplots(1, 1, figsize=(4, 1))
     # axes.axis('off')
     if normal_max is not None:
         assert normal_min is not None
-        plt.axhspan(normal_min, normal_max, color='green', alpha=0.3)
+        axes.axhspan(normal_min, normal_max, color='green', alpha=0.3)
     else:
         normal_max = graph_y_max
     axes.set_ylim([graph_y_min, max(graph_y_max, normal_max)])
@@ -47,31 +59,115 @@ def sparkline(data_x_str: list[str], data_y: list[float], graph_y_min, graph_y_m
         axes.plot(data_x, data_y, 'o', markeredgecolor = 'r')
     else:
         axes.plot(data_x, data_y,)
+    if x_range is not None:
+        x_min, x_max = x_range
+        if x_max == x_min:
+            # A single date goes in the middle, like in svg_sparkline.
+            x_min, x_max = x_min - 86400, x_max + 86400
+        axes.set_xlim(np.datetime64(int(x_min), "s"), np.datetime64(int(x_max), "s"))
 
     # Calculate major ticks for x-axis
     years = mdates.YearLocator()
-    plt.gca().xaxis.set_major_locator(years)
-    plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%Y'))
+    axes.xaxis.set_major_locator(years)
+    axes.xaxis.set_major_formatter(mdates.DateFormatter('%Y'))
 
+def img_tag(fig) -> str:
     img = BytesIO()
-    plt.savefig(img)
-    img.seek(0)
-    plt.close()
-    return '<img src="data:image/png;base64,{}"/>'.format(base64.b64encode(img.read()).decode())
+    fig.savefig(img)
+    return '<img src="data:image/png;base64,{}"/>'.format(base64.b64encode(img.getvalue()).decode())
+
+def sparkline(data_x: list[int], data_y: list[float], graph_y_min, graph_y_max, normal_min, normal_max,
+              x_range: tuple[int, int] = None):
+    from matplotlib import pyplot as plt
+    fig, axes = plt.subplots(1, 1, figsize=(4, 1))
+    draw_sparkline(axes, data_x, data_y, graph_y_min, graph_y_max, normal_min, normal_max, x_range)
+    tag = img_tag(fig)
+    plt.close(fig)
+    return tag
 
-def sparklines(incoming: list[list[Observation]]) -> list[tuple[str, str]]:
+
+class SparklineRenderer:
+    """
+    Draws one sparkline after another on the same figure. Making a new figure and axes, and tearing them down
+    again, takes a good part of the time, so the axes are reused, and only what was drawn on them is removed.
+    The figure isn't made with pyplot, so it isn't registered anywhere, and doesn't have to be closed.
     """
-    Generate a list of sparklines.
+    def __init__(self):
+        from matplotlib.figure import Figure
+        self.fig = Figure(figsize=(4, 1))
+        self.axes = self.fig.subplots(1, 1)
+
+    def render(self, args: tuple) -> str:
+        """
+        :param args: the arguments of sparkline()
+        :return: the img tag
+        """
+        # Axes.clear() would rebuild all the ticks, and keeps the last sparkline's date limits anyway. Removing what
+        # was drawn, and forgetting its data limits, leaves the axes the same as new ones. Turning autoscaling back
+        # on undoes the last one's x_range too.
+        for artist in [*self.axes.lines, *self.axes.patches]:
+            artist.remove()
+        self.axes.relim()
+        self.axes.set_autoscale_on(True)
+        self.axes.set_prop_cycle(None)  # Or each line would be the next color.
+        draw_sparkline(self.axes, *args)
+        return img_tag(self.fig)
+
+
+# Each worker process makes its own renderer, the first time it's used.
+worker_renderer = None
+
+def render_in_worker(args: tuple) -> str:
+    global worker_renderer
+    if worker_renderer is None:
+        worker_renderer = SparklineRenderer()
+    return worker_renderer.render(args)
+
+def render_sparklines(all_args: list[tuple], jobs: int = 1) -> list[str]:
+    """
+    :param all_args: the arguments of sparkline(), for each sparkline
+    :param jobs: the number of processes to draw in
+    :return: the img tags, in the same order
+    """
+    if jobs <= 1 or len(all_args) <= 1:
+        renderer = SparklineRenderer()
+        return [renderer.render(args) for args in all_args]
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(jobs) as executor:
+        return list(executor.map(render_in_worker, all_args, chunksize=max(1, len(all_args) // (jobs * 4))))
+
+def downsample_dates(data_x: list[int], data_y: list[float], max_points: int) -> tuple[list[int], list[float]]:
+    """
+    At most max_points of the values, picked by LTTB to keep the shape of the line. See downsample.py.
+    :param data_x: the dates, as seconds since 1970
+    """
+    if not max_points or len(data_x) <= max_points:
+        return data_x, data_y
+    import numpy as np
+    from downsample import lttb
+    seconds = np.asarray(data_x, dtype=np.int64)
+    order = np.argsort(seconds, kind="stable")
+    keep = order[lttb(seconds[order], np.array(data_y, dtype=float)[order], max_points)]
+    return [data_x[i] for i in keep], [data_y[i] for i in keep]
+
+def sparklines(incoming: list[list[Observation]], jobs: int = 1, svg: bool = False,
+               max_points: int = SPARKLINE_POINTS) -> list[tuple[str, str, int]]:
+    """
+    Generate a list of sparklines. They all share the same date range, so their years line up.
     :param incoming: a list of lists of Observations.
-    :return: a list of (image tag, stat name) tuples
+    :param jobs: the number of processes to draw them in.
+    :param svg: SVG sparklines instead of PNG.
+    :param max_points: the most points to draw in each sparkline. 0 for all of them.
+    :return: a list of (image tag, stat name, number of values) tuples
     """
-    outgoing = []
+    all_args = []
+    names = []
     for index in range(0, len(incoming)):
         one_ob_list = incoming[index]
         if len(one_ob_list) == 0:
             continue
 
-        data_x = [x.date for x in one_ob_list]
+        data_x = [x.timestamp for x in one_ob_list]
         data_y = [x.data[0].value for x in one_ob_list]  # TODO handle blood pressure and other multi-values stats.
         if one_ob_list[0].range is not None:
             check_for_messy_data = False
@@ -99,22 +195,32 @@ def sparklines(incoming: list[list[Observation]]) -> list[tuple[str, str]]:
             baseline = min(data_y)
         graph_y_min = 0
         graph_y_max = max(data_y)
-        img_info = sparkline(data_x, data_y, graph_y_min, graph_y_max, normal_min, normal_max)
-        outgoing.append((img_info, one_ob_list[0].name, len(one_ob_list)))
+        data_x, data_y = downsample_dates(data_x, data_y, max_points)
+        all_args.append((data_x, data_y, graph_y_min, graph_y_max, normal_min, normal_max))
+        names.append((one_ob_list[0].name, len(one_ob_list)))
 
-    return outgoing
+    x_range = date_range([args[0] for args in all_args])
+    all_args = [args + (x_range,) for args in all_args]
+    if svg:
+        images = [svg_sparkline(*args) for args in all_args]
+    else:
+        images = render_sparklines(all_args, jobs)
+    return [(img_info, name, count) for img_info, (name, count) in zip(images, names)]
 
 
-def html_page(f: TextIO, incoming):
+def html_page(f: TextIO, incoming, jobs: int = 1, svg: bool = False, max_points: int = SPARKLINE_POINTS):
     """
     Generate HTML page for the sparklines
     :param f:
     :param incoming:
+    :param jobs: the number of processes to draw the sparklines in.
+    :param svg: SVG sparklines instead of PNG.
+    :param max_points: the most points to draw in each sparkline. 0 for all of them.
     :return:
     """
     print("""<!DOCTYPE html><html><head><meta charset="utf-8" /><body>""", file=f)
     print("<h1>Sparklines</H1>", file=f)
-    sparks = sparklines(incoming)
+    sparks = sparklines(incoming, jobs, svg, max_points)
     print("<table>", file=f)
     for imgtag, stat_name, count in sparks:
         print("<tr>", file=f)
@@ -128,6 +234,14 @@ def html_page(f: TextIO, incoming):
     print("""</body></html>""", file=f)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write sparklines.html and sparklines_all.html.")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Draw the sparklines in this many processes.")
+    parser.add_argument("--svg", action="store_true", help="Draw the sparklines as SVG, which is much faster, "
+                                                          "and makes a much smaller page.")
+    parser.add_argument("--max-points", type=max_points_argument, default=SPARKLINE_POINTS,
+                        help=F"The most points to draw in each sparkline. Longer ones are downsampled, keeping their "
+                             F"peaks and dips. 0 for all of them. Default {SPARKLINE_POINTS}.")
+    args = parser.parse_args()
     base = Path("export/apple_health_export")
     condition_path = base / "clinical-records"
 
@@ -149,15 +263,17 @@ if __name__ == "__main__":
     # category_name = 'Vital Signs'
     # stats = [StatInfo("Lab", "PSA"), StatInfo("Lab", "PROSTATE SPECIFIC ANTIGEN (PSA)")]
     # stats = [StatInfo("Lab", "PSA"), StatInfo("Lab", "PROSTATE SPECIFIC ANTIGEN (PSA)")]
+    # One pass over the files, for all the sparklines on both pages.
+    index = load_index(condition_path)
     stats_to_graph = []
     for vital in stats:
-        ws = extract_all_values(yield_observation_files(condition_path), stat_info=vital)
+        ws = extract_all_values(index, stat_info=vital)
         stats_to_graph.append(ws)
 
     with open("sparklines.html", "w") as fff:
-        html_page(fff, stats_to_graph)
+        html_page(fff, stats_to_graph, args.jobs, args.svg, args.max_points)
 
-    l = list_vitals(yield_observation_files(condition_path), "Lab")
+    l = list_vitals(index, "Lab")
     print(l)
 
     stats = [StatInfo("Lab", x) for x in l]
@@ -165,8 +281,8 @@ if __name__ == "__main__":
 
     stats_to_graph = []
     for vital in stats:
-        ws = extract_all_values(yield_observation_files(condition_path), stat_info=vital)
+        ws = extract_all_values(index, stat_info=vital)
         stats_to_graph.append(ws)
 
     with open("sparklines_all.html", "w") as fff:
-        html_page(fff, stats_to_graph)
+        html_page(fff, stats_to_graph, args.jobs, args.svg, args.max_points)
@@ -0,0 +1,98 @@
+"""
+Sparklines as small inline SVG, written directly from the dates and values, without matplotlib.
+
+A PNG sparkline from matplotlib takes tens of milliseconds to draw, and is several KB of base64 in the page. An SVG
+one is a polyline with a point per observation, so a page of hundreds of them is quick to write and small to load.
+
+It draws the same things as sparklines.sparkline: the line (or a marker, for a single point), the normal range as a
+green band, and years along the bottom. All the sparklines on a page can share one date range, so the years line up.
+"""
+from datetime import datetime, timezone
+
+WIDTH = 400
+HEIGHT = 100
+# Room for the labels on the left and bottom
+LEFT = 32
+RIGHT = 8
+TOP = 6
+BOTTOM = 18
+MAX_YEAR_LABELS = 12
+
+
+def date_range(all_dates: list[list[float]]):
+    """
+    :param all_dates: the dates of each sparkline, in seconds
+    :return: the (first, last) date of all the sparklines, in seconds, to share between them. None if there are none.
+    """
+    seconds = [s for dates in all_dates for s in dates]
+    if not seconds:
+        return None
+    return min(seconds), max(seconds)
+
+def year_ticks(x_min: float, x_max: float) -> list[tuple[float, int]]:
+    """
+    :return: (seconds, year) for each January 1st in the range. If there are too many to label, every other one,
+    or every third, and so on.
+    """
+    first = datetime.fromtimestamp(x_min, timezone.utc).year + 1
+    last = datetime.fromtimestamp(x_max, timezone.utc).year
+    years = list(range(first, last + 1))
+    step = max(1, -(-len(years) // MAX_YEAR_LABELS))
+    return [(datetime(year, 1, 1, tzinfo=timezone.utc).timestamp(), year) for year in years[::step]]
+
+def number(value: float) -> str:
+    return F"{value:.1f}".rstrip("0").rstrip(".")
+
+def svg_sparkline(xs: list[float], data_y: list[float], graph_y_min, graph_y_max, normal_min, normal_max,
+                  x_range: tuple[float, float] = None) -> str:
+    """
+    Takes the same arguments as sparklines.sparkline.
+    :param xs: the dates, in seconds, like Observation.timestamp
+    :param x_range: (first, last) date, in seconds, for the x axis. Default is the range of xs.
+    :return: an svg element
+    """
+    x_min, x_max = x_range if x_range is not None else (min(xs), max(xs))
+    if x_max == x_min:
+        # A single date goes in the middle.
+        x_min, x_max = x_min - 86400, x_max + 86400
+    y_min = graph_y_min
+    y_max = graph_y_max if normal_max is None else max(graph_y_max, normal_max)
+    if y_max <= y_min:
+        y_max = y_min + 1
+    plot_width = WIDTH - LEFT - RIGHT
+    plot_height = HEIGHT - TOP - BOTTOM
+
+    def px(x: float) -> str:
+        return number(LEFT + (x - x_min) / (x_max - x_min) * plot_width)
+
+    def py(y: float) -> str:
+        return number(TOP + (y_max - y) / (y_max - y_min) * plot_height)
+
+    parts = [F'<svg xmlns="http://www.w3.org/2000/svg" width="{WIDTH}" height="{HEIGHT}" '
+             F'viewBox="0 0 {WIDTH} {HEIGHT}" font-family="sans-serif" font-size="10">']
+    if normal_max is not None:
+        assert normal_min is not None
+        top, bottom = min(normal_max, y_max), max(normal_min, y_min)
+        if top > bottom:
+            parts.append(F'<rect x="{LEFT}" y="{py(top)}" width="{plot_width}" '
+                         F'height="{number((top - bottom) / (y_max - y_min) * plot_height)}" '
+                         F'fill="green" fill-opacity="0.3"/>')
+    if len(xs) == 1:
+        # Single points are invisible, so make it more obvious.
+        parts.append(F'<circle cx="{px(xs[0])}" cy="{py(data_y[0])}" r="3" fill="#1f77b4" stroke="red"/>')
+    else:
+        points = " ".join(F"{px(x)},{py(y)}" for x, y in zip(xs, data_y))
+        parts.append(F'<polyline points="{points}" fill="none" stroke="#1f77b4" stroke-width="1.5"/>')
+    parts.append(F'<rect x="{LEFT}" y="{TOP}" width="{plot_width}" height="{plot_height}" fill="none" '
+                 F'stroke="black" stroke-width="0.8"/>')
+    parts.append(F'<text x="{LEFT - 3}" y="{TOP + 8}" text-anchor="end">{number(y_max)}</text>')
+    parts.append(F'<text x="{LEFT - 3}" y="{TOP + plot_height}" text-anchor="end">{number(y_min)}</text>')
+    ticks = year_ticks(x_min, x_max)
+    if ticks:
+        # All the tick marks are one path, and the labels share their attributes, since this is most of the svg.
+        marks = "".join(F"M{px(x)} {TOP + plot_height}v3" for x, _ in ticks)
+        labels = "".join(F'<text x="{px(x)}">{year}</text>' for x, year in ticks)
+        parts.append(F'<path d="{marks}" stroke="black"/>'
+                     F'<g text-anchor="middle" transform="translate(0 {HEIGHT - 3})">{labels}</g>')
+    parts.append("</svg>")
+    return "".join(parts)
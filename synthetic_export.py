@@ -0,0 +1,328 @@
+"""
+Generates a fake export: clinical-records files (Observation, Condition, AllergyIntolerance, Procedure and
+MedicationRequest), and export.xml and export_cda.xml files, in the same shapes as the ones in a real export, so we can
+measure how long things take on an export much bigger than test_data, without needing anyone's real health data.
+
+The values are random, but repeatable for a given seed.
+
+Example usage: python synthetic_export.py --observations 50000 /tmp/synthetic
+               python synthetic_export.py --export-xml-mb 2048 /tmp/synthetic
+That writes the same layout as a real export: /tmp/synthetic/clinical-records/*.json, /tmp/synthetic/export.xml
+and /tmp/synthetic/export_cda.xml. See benchmark.py, which uses it at several scales.
+"""
+import argparse
+import json
+import random
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# (category, code text, unit, typical value, spread, reference range low, high)
+# A range of None means the file has no referenceRange.
+VITALS = [
+    ("Vital Signs", "Pulse", "/min", 70, 10, None, None),
+    ("Vital Signs", "Weight", "kg", 80, 5, None, None),
+    ("Vital Signs", "Temperature", "Cel", 36.8, 0.4, None, None),
+    ("Vital Signs", "SpO2", "%", 97, 1.5, None, None),
+    ("Vital Signs", "Respirations", "/min", 16, 2, None, None),
+]
+LABS = [
+    ("Lab", "Potassium", "mmol/L", 4.2, 0.4, 3.5, 5.3),
+    ("Lab", "Platelet Count", "K/uL", 250, 50, 140, 400),
+    ("Lab", "Bilirubin, total", "mg/dL", 0.8, 0.3, 0.2, 1.2),
+    ("Lab", "Hemoglobin A1c", "%", 5.6, 0.4, None, None),
+    ("Lab", "Creatinine", "mg/dL", 0.9, 0.15, 0.6, 1.3),
+]
+# Labs whose referenceRange only has text, like "<200"
+TEXT_RANGE_LABS = [
+    ("Lab", "Cholesterol", "mg/dL", 180, 25, "<200"),
+    ("Lab", "Triglycerides", "mg/dL", 120, 40, "<=150"),
+]
+BLOOD_PRESSURE = ("Vital Signs", "Blood Pressure")
+
+
+def fhir_category(name: str) -> dict:
+    return {
+        "text": name,
+        "coding": [{"system": "http://terminology.hl7.org/CodeSystem/observation-category",
+                    "display": name, "code": name.lower().replace(" ", "-")}]
+    }
+
+def value_quantity(value: float, unit: str) -> dict:
+    return {"code": unit, "value": value, "system": "http://unitsofmeasure.org", "unit": unit}
+
+def random_date(rng: random.Random, start: datetime, days: int) -> str:
+    d = start + timedelta(seconds=rng.randrange(days * 24 * 3600))
+    return d.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def observation(rng: random.Random, start: datetime, days: int) -> dict:
+    """
+    One random Observation, shaped like the ones health.extract_observation reads.
+    """
+    kind = rng.random()
+    data = {"resourceType": "Observation", "effectiveDateTime": random_date(rng, start, days)}
+    if kind < 0.15:
+        category, name = BLOOD_PRESSURE
+        data["category"] = [fhir_category(category)]
+        data["code"] = {"text": name}
+        data["component"] = [
+            {"valueQuantity": value_quantity(round(rng.gauss(125, 12)), "mm[Hg]"),
+             "code": {"text": "Systolic blood pressure"}},
+            {"valueQuantity": value_quantity(round(rng.gauss(80, 8)), "mm[Hg]"),
+             "code": {"text": "Diastolic blood pressure"}},
+        ]
+        return data
+    if kind < 0.45:
+        category, name, unit, typical, spread, low, high = rng.choice(VITALS)
+        data["category"] = [fhir_category(category)]
+    elif kind < 0.9:
+        category, name, unit, typical, spread, low, high = rng.choice(LABS)
+        # Labs usually come with both categories.
+        data["category"] = [fhir_category("Laboratory"), fhir_category(category)]
+        if low is not None:
+            data["referenceRange"] = [{"low": value_quantity(low, unit), "high": value_quantity(high, unit),
+                                       "text": F"{low} - {high} {unit}"}]
+    elif kind < 0.97:
+        category, name, unit, typical, spread, text = rng.choice(TEXT_RANGE_LABS)
+        data["category"] = [fhir_category("Laboratory"), fhir_category(category)]
+        data["referenceRange"] = [{"text": text}]
+    else:
+        data["category"] = [fhir_category("Laboratory"), fhir_category("Lab")]
+        data["code"] = {"text": "Urine Color"}
+        data["valueString"] = rng.choice(["YELLOW", "STRAW", "AMBER"])
+        data["referenceRange"] = [{"text": "YELLOW"}]
+        return data
+    data["code"] = {"text": name}
+    data["valueQuantity"] = value_quantity(round(rng.gauss(typical, spread), 2), unit)
+    return data
+
+CONDITIONS = ["Essential hypertension", "Hyperlipidemia", "Seasonal allergic rhinitis", "Low back pain",
+              "Prediabetes", "Osteoarthritis of knee", "Gastroesophageal reflux disease", "Vitamin D deficiency"]
+ALLERGIES = ["Penicillins", "Sulfa (Sulfonamide Antibiotics)", "Peanut", "Latex", "Shellfish"]
+PROCEDURES = ["COLONOSCOPY", "XR CHEST 2 VIEWS", "ECHOCARDIOGRAM COMPLETE", "MRI KNEE WITHOUT CONTRAST",
+              "INFLUENZA VACCINE", "TDAP VACCINE", "CT ABDOMEN W CONTRAST"]
+MEDICINES = ["Cephalexin 500 mg Cap", "Lisinopril 10 mg Tab", "Atorvastatin 20 mg Tab", "Omeprazole 20 mg Cap",
+             "Metformin 500 mg Tab", "Fluticasone 50 mcg/actuation Nasal Spray", "Ibuprofen 800 mg Tab"]
+
+
+def coded(text: str, code: str, system: str) -> dict:
+    return {"text": text, "coding": [{"system": system, "code": code, "display": text}]}
+
+def condition(rng: random.Random, start: datetime, days: int, resource_type: str = "Condition") -> dict:
+    """
+    A Condition, or an AllergyIntolerance, which has the same fields, the ones health.CONDITIONS reports.
+    """
+    names = CONDITIONS if resource_type == "Condition" else ALLERGIES
+    status = rng.choice(["active", "active", "resolved", "inactive"])
+    return {
+        "resourceType": resource_type,
+        "recordedDate": random_date(rng, start, days)[:10],
+        "clinicalStatus": coded(status.title(), status, "http://terminology.hl7.org/CodeSystem/condition-clinical"),
+        "verificationStatus": coded("Confirmed", "confirmed",
+                                    "http://terminology.hl7.org/CodeSystem/condition-ver-status"),
+        "category": [coded("Problem List Item", "problem-list-item",
+                           "http://terminology.hl7.org/CodeSystem/condition-category")],
+        "code": {"text": rng.choice(names)},
+    }
+
+def procedure(rng: random.Random, start: datetime, days: int) -> dict:
+    return {
+        "resourceType": "Procedure",
+        "performedDateTime": random_date(rng, start, days),
+        "status": rng.choice(["completed", "completed", "completed", "not-done"]),
+        # Procedure has a single category, not a list, the third of the ways list_categories understands.
+        "category": coded("Surgical History", "387713003", "http://snomed.info/sct"),
+        "code": {"text": rng.choice(PROCEDURES)},
+    }
+
+def medication_request(rng: random.Random, start: datetime, days: int) -> dict:
+    """
+    Like test_data/list_prefixes_test_dir/MedicationRequest-test.json. authoredOn is sometimes only a date, which
+    health.print_report pads.
+    """
+    authored = random_date(rng, start, days)
+    return {
+        "resourceType": "MedicationRequest",
+        "authoredOn": authored[:10] if rng.random() < 0.3 else authored,
+        "status": rng.choice(["active", "completed", "stopped"]),
+        "intent": "order",
+        "category": [coded("Community", "community",
+                           "http://terminology.hl7.org/CodeSystem/medicationrequest-category")],
+        "medicationReference": {"display": rng.choice(MEDICINES), "reference": "Medication/ABCDEFG"},
+    }
+
+def write_resources(dir_path: Path, prefix: str, make, count: int, rng: random.Random, start: datetime,
+                    days: int) -> list[Path]:
+    """
+    Writes count <prefix>-<uuid>.json files into dir_path, each from make(rng, start, days).
+    :return: the files written
+    """
+    dir_path.mkdir(parents=True, exist_ok=True)
+    files = []
+    for _ in range(count):
+        p = dir_path / F"{prefix}-{uuid.UUID(int=rng.getrandbits(128))}.json"
+        with open(p, "w") as f:
+            json.dump(make(rng, start, days), f, indent=2, separators=(",", " : "))
+        files.append(p)
+    return files
+
+def write_observations(dir_path: Path, count: int, *, seed: int = 0, start: datetime = datetime(2010, 1, 1),
+                       days: int = 15 * 365) -> list[Path]:
+    """
+    Writes count Observation-<uuid>.json files into dir_path.
+    :return: the files written
+    """
+    return write_resources(dir_path, "Observation", observation, count, random.Random(seed), start, days)
+
+def write_clinical_records(dir_path: Path, *, observations: int, conditions: int = 0, allergies: int = 0,
+                           procedures: int = 0, medication_requests: int = 0, seed: int = 0,
+                           start: datetime = datetime(2010, 1, 1), days: int = 15 * 365) -> list[Path]:
+    """
+    Writes a clinical-records directory with this many of each kind of file.
+    :return: the files written
+    """
+    files = write_observations(dir_path, observations, seed=seed, start=start, days=days)
+    kinds = [("Condition", condition, conditions),
+             ("AllergyIntolerance", lambda rng, s, d: condition(rng, s, d, "AllergyIntolerance"), allergies),
+             ("Procedure", procedure, procedures),
+             ("MedicationRequest", medication_request, medication_requests)]
+    for prefix, make, count in kinds:
+        # A separate stream for each kind, so the Observations are the same whatever else is asked for.
+        files += write_resources(dir_path, prefix, make, count, random.Random(F"{seed}-{prefix}"), start, days)
+    return files
+
+
+# (type, unit, source, typical value, spread) for Records in export.xml
+XML_RECORDS = [
+    ("HKQuantityTypeIdentifierHeartRate", "count/min", "Apple Watch", 72, 12),
+    ("HKQuantityTypeIdentifierStepCount", "count", "iPhone", 400, 300),
+    ("HKQuantityTypeIdentifierActiveEnergyBurned", "Cal", "Apple Watch", 5, 3),
+    ("HKQuantityTypeIdentifierOxygenSaturation", "%", "EMAY Oximeter", 0.97, 0.01),
+    ("HKQuantityTypeIdentifierBodyMass", "lb", "Withings", 180, 5),
+]
+
+def xml_date(d: datetime) -> str:
+    return d.strftime("%Y-%m-%d %H:%M:%S -0800")
+
+def export_xml_items(rng: random.Random, start: datetime):
+    """
+    Yields the top level elements of export.xml, as text, forever. Mostly Records, with some blood pressure
+    Correlations (which have Records inside them), Workouts, and ActivitySummaries.
+    """
+    d = start
+    while True:
+        d += timedelta(seconds=rng.randrange(1, 600))
+        kind = rng.random()
+        if kind < 0.02:
+            sys_bp, dia_bp = round(rng.gauss(125, 12)), round(rng.gauss(80, 8))
+            dates = F'creationDate="{xml_date(d)}" startDate="{xml_date(d)}" endDate="{xml_date(d)}"'
+            yield (F' <Correlation type="HKCorrelationTypeIdentifierBloodPressure" sourceName="Omron" {dates}>\n'
+                   F'  <Record type="HKQuantityTypeIdentifierBloodPressureSystolic" sourceName="Omron" '
+                   F'unit="mmHg" {dates} value="{sys_bp}"/>\n'
+                   F'  <Record type="HKQuantityTypeIdentifierBloodPressureDiastolic" sourceName="Omron" '
+                   F'unit="mmHg" {dates} value="{dia_bp}"/>\n'
+                   F' </Correlation>\n')
+        elif kind < 0.03:
+            end = d + timedelta(minutes=30)
+            yield (F' <Workout workoutActivityType="HKWorkoutActivityTypeWalking" duration="30" durationUnit="min" '
+                   F'sourceName="Apple Watch" creationDate="{xml_date(end)}" startDate="{xml_date(d)}" '
+                   F'endDate="{xml_date(end)}">\n'
+                   F'  <WorkoutStatistics type="HKQuantityTypeIdentifierActiveEnergyBurned" startDate="{xml_date(d)}" '
+                   F'endDate="{xml_date(end)}" sum="{rng.randrange(50, 300)}" unit="Cal"/>\n'
+                   F' </Workout>\n')
+        elif kind < 0.035:
+            yield (F' <ActivitySummary dateComponents="{d:%Y-%m-%d}" activeEnergyBurned="{rng.randrange(100, 900)}" '
+                   F'activeEnergyBurnedGoal="500" activeEnergyBurnedUnit="Cal"/>\n')
+        else:
+            record_type, unit, source, typical, spread = rng.choice(XML_RECORDS)
+            value = round(rng.gauss(typical, spread), 2)
+            end = d + timedelta(seconds=60)
+            record = (F' <Record type="{record_type}" sourceName="{source}" sourceVersion="10.3" unit="{unit}" '
+                      F'creationDate="{xml_date(end)}" startDate="{xml_date(d)}" endDate="{xml_date(end)}" '
+                      F'value="{value}"')
+            if record_type == "HKQuantityTypeIdentifierHeartRate":
+                yield (record + '>\n  <MetadataEntry key="HKMetadataKeyHeartRateMotionContext" value="0"/>\n'
+                                ' </Record>\n')
+            else:
+                yield record + '/>\n'
+
+def write_export_xml(file_name: Path, *, megabytes: float = None, items: int = None, seed: int = 0) -> int:
+    """
+    Writes a synthetic export.xml, stopping after megabytes of output, or after items top level elements.
+    :return: the number of top level elements written, after ExportDate and Me.
+    """
+    rng = random.Random(seed)
+    limit = None if megabytes is None else megabytes * 2**20
+    count = 0
+    size = 0
+    with open(file_name, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<HealthData locale="en_US">\n'
+                ' <ExportDate value="2024-03-29 10:42:17 -0700"/>\n'
+                ' <Me HKCharacteristicTypeIdentifierBiologicalSex="HKBiologicalSexNotSet"/>\n')
+        for item in export_xml_items(rng, datetime(2015, 1, 1)):
+            if (limit is not None and size >= limit) or (items is not None and count >= items):
+                break
+            f.write(item)
+            size += len(item)
+            count += 1
+        f.write('</HealthData>\n')
+    return count
+
+def write_export_cda_xml(file_name: Path, *, megabytes: float = None, items: int = None, seed: int = 0) -> int:
+    """
+    Writes a synthetic export_cda.xml, in the layout find_display_names and get_test_results read.
+    One entry per observation, stopping after megabytes of output, or after items entries.
+    :return: the number of observations written.
+    """
+    rng = random.Random(seed)
+    limit = None if megabytes is None else megabytes * 2**20
+    count = 0
+    size = 0
+    d = datetime(2015, 1, 1)
+    names = {"HKQuantityTypeIdentifierHeartRate": "Heart rate", "HKQuantityTypeIdentifierStepCount": "Step count",
+             "HKQuantityTypeIdentifierActiveEnergyBurned": "Active energy burned",
+             "HKQuantityTypeIdentifierOxygenSaturation": "Oxygen saturation",
+             "HKQuantityTypeIdentifierBodyMass": "Body weight"}
+    with open(file_name, "w") as f:
+        f.write('<?xml version="1.0"?>\n<ClinicalDocument xmlns="urn:hl7-org:v3">\n')
+        while (limit is None or size < limit) and (items is None or count < items):
+            record_type, unit, source, typical, spread = rng.choice(XML_RECORDS)
+            d += timedelta(seconds=rng.randrange(1, 600))
+            stamp = d.strftime("%Y%m%d%H%M%S-0800")
+            entry = (F' <entry typeCode="DRIV">\n  <organizer classCode="CLUSTER" moodCode="EVN">\n'
+                     F'   <code code="46680005" displayName="Vital signs"/>\n'
+                     F'   <component>\n    <observation classCode="OBS" moodCode="EVN">\n'
+                     F'     <code code="8867-4" displayName="{names[record_type]}"/>\n'
+                     F'     <text>\n      <sourceName>{source}</sourceName>\n'
+                     F'      <sourceVersion>1.1.5</sourceVersion>\n'
+                     F'      <value>{round(rng.gauss(typical, spread), 2)}</value>\n'
+                     F'      <type>{record_type}</type>\n      <unit>{unit}</unit>\n     </text>\n'
+                     F'     <effectiveTime>\n      <low value="{stamp}"/>\n      <high value="{stamp}"/>\n'
+                     F'     </effectiveTime>\n    </observation>\n   </component>\n  </organizer>\n </entry>\n')
+            f.write(entry)
+            size += len(entry)
+            count += 1
+        f.write('</ClinicalDocument>\n')
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic export: a clinical-records directory, "
+                                                 "and optionally export.xml and export_cda.xml files.")
+    parser.add_argument("dir", type=str, help="Directory to write the export into, like export/apple_health_export.")
+    parser.add_argument("--observations", type=int, default=1000, help="Number of Observation files.")
+    parser.add_argument("--conditions", type=int, default=0, help="Number of Condition files.")
+    parser.add_argument("--allergies", type=int, default=0, help="Number of AllergyIntolerance files.")
+    parser.add_argument("--procedures", type=int, default=0, help="Number of Procedure files.")
+    parser.add_argument("--medication-requests", type=int, default=0, help="Number of MedicationRequest files.")
+    parser.add_argument("--export-xml-mb", type=float, help="Also write export.xml, of about this many MB.")
+    parser.add_argument("--export-cda-mb", type=float, help="Also write export_cda.xml, of about this many MB.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_clinical_records(Path(args.dir) / "clinical-records", observations=args.observations,
+                           conditions=args.conditions, allergies=args.allergies, procedures=args.procedures,
+                           medication_requests=args.medication_requests, seed=args.seed)
+    if args.export_xml_mb:
+        write_export_xml(Path(args.dir) / "export.xml", megabytes=args.export_xml_mb, seed=args.seed)
+    if args.export_cda_mb:
+        write_export_cda_xml(Path(args.dir) / "export_cda.xml", megabytes=args.export_cda_mb, seed=args.seed)
@@ -0,0 +1,60 @@
+import argparse
+from unittest import TestCase
+
+import numpy as np
+
+from downsample import lttb, envelope
+from health import max_points_argument, to_timestamp
+from sparklines import downsample_dates
+
+
+class Test(TestCase):
+    def test_lttb(self):
+        x = np.arange(10_000, dtype=np.int64) * 60
+        rng = np.random.default_rng(5)
+        y = rng.normal(70, 2, len(x))
+        y[4321] = 180  # One spike, that taking every nth point would likely miss.
+        y[7000] = np.nan
+
+        keep = lttb(x, y, 200)
+        self.assertEqual(200, len(keep))
+        self.assertEqual(0, keep[0])
+        self.assertEqual(len(x) - 1, keep[-1])
+        self.assertTrue(np.all(np.diff(keep) > 0))
+        self.assertIn(4321, keep)
+        self.assertNotIn(7000, keep)
+
+        # Under the budget, everything but NaN is kept.
+        self.assertEqual(list(range(5)), list(lttb(x[:5], y[:5], 200)))
+        self.assertEqual(len(x) - 1, len(lttb(x, y, len(x))))
+        with self.assertRaises(ValueError):
+            lttb(x, y, 2)
+
+    def test_max_points_argument(self):
+        self.assertEqual([0, 3, 2000], [max_points_argument(text) for text in ["0", "3", "2000"]])
+        for bad in ["1", "2", "-5"]:
+            with self.assertRaises(argparse.ArgumentTypeError):
+                max_points_argument(bad)
+
+    def test_envelope(self):
+        x = np.arange(10, dtype=np.float64)
+        y = np.array([3, 1, 2, 9, np.nan, 4, 5, 0, 7, 6], dtype=np.float64)
+        starts, lows, highs = envelope(x, y, 3)
+        self.assertEqual([0, 3, 7], list(starts))
+        self.assertEqual([1, 4, 0], list(lows))
+        self.assertEqual([3, 9, 7], list(highs))
+        # Never more buckets than points.
+        starts, lows, highs = envelope(x[:2], y[:2], 10)
+        self.assertEqual([3, 1], list(lows))
+        self.assertEqual([3, 1], list(highs))
+
+    def test_downsample_dates(self):
+        dates = [to_timestamp(F"20{year:02}-0{month}-01T00:00:00Z") for year in range(10, 20) for month in range(1, 10)]
+        values = [float(i % 7) for i in range(len(dates))]
+        self.assertEqual((dates, values), downsample_dates(dates, values, 0))
+        # Out of order, since the files aren't read in date order. What's kept comes back in date order.
+        few_dates, few_values = downsample_dates(dates[::-1], values[::-1], 20)
+        self.assertEqual(20, len(few_dates))
+        self.assertEqual(sorted(few_dates), few_dates)
+        self.assertEqual([dates[0], dates[-1]], [few_dates[0], few_dates[-1]])
+        self.assertEqual(few_values, [values[dates.index(d)] for d in few_dates])
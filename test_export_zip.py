@@ -0,0 +1,65 @@
+import contextlib
+import io
+import tempfile
+import zipfile
+from pathlib import Path
+from unittest import TestCase
+
+import xml_reader
+from export_zip import ZipDir, ZipMember, source_dir
+from health import ClinicalIndex, list_categories, list_prefixes, load_index, print_reports, \
+    yield_observation_files, CONDITIONS
+from synthetic_export import write_clinical_records, write_export_xml, write_export_cda_xml
+
+
+class Test(TestCase):
+    def test_zip_matches_directory(self):
+        with tempfile.TemporaryDirectory() as temp:
+            base = Path(temp) / "apple_health_export"
+            write_clinical_records(base / "clinical-records", observations=100, conditions=5, allergies=2,
+                                   procedures=3, medication_requests=4, seed=3)
+            write_export_xml(base / "export.xml", items=300)
+            write_export_cda_xml(base / "export_cda.xml", items=100)
+            zip_name = str(Path(temp) / "export.zip")
+            with zipfile.ZipFile(zip_name, "w", zipfile.ZIP_DEFLATED) as z:
+                for p in sorted(base.rglob("*")):
+                    z.write(p, p.relative_to(temp))
+
+            zipped = source_dir(zip_name)
+            self.assertEqual(ZipDir(zip_name, "apple_health_export"), zipped)
+            self.assertEqual(base, source_dir(str(base)))
+            cr, zipped_cr = base / "clinical-records", zipped / "clinical-records"
+
+            self.assertEqual(sorted(p.name for p in yield_observation_files(cr)),
+                             sorted(p.name for p in yield_observation_files(zipped_cr)))
+            self.assertEqual(list_prefixes(cr), list_prefixes(zipped_cr))
+            self.assertEqual(list_categories(cr, False, one_prefix=None)[1:],
+                             list_categories(zipped_cr, False, one_prefix=None)[1:])
+
+            def by_name(index):
+                return {p.name: (e.categories, e.code, e.observation and e.observation.data, e.row)
+                        for p, e in index.files.items()}
+            expected = by_name(ClinicalIndex.from_directory(cr))
+            self.assertEqual(expected, by_name(ClinicalIndex.from_directory(zipped_cr)))
+            self.assertEqual(expected, by_name(ClinicalIndex.from_directory(zipped_cr, jobs=2)))
+            # The cache can't go in the zip, so it goes next to it.
+            self.assertEqual(expected, by_name(load_index(zipped_cr)))
+            self.assertTrue((Path(temp) / "clinical-records-cache.sqlite").exists())
+            self.assertEqual(expected, by_name(load_index(zipped_cr)))
+
+            def printed(dir_path):
+                with contextlib.redirect_stdout(io.StringIO()) as out:
+                    print_reports(dir_path, [CONDITIONS], False)
+                return out.getvalue()
+            self.assertEqual(printed(cr), printed(zipped_cr))
+
+            # xml streams from the zip, and --jobs falls back to one process.
+            xml_member = zipped / "export.xml"
+            self.assertIsInstance(xml_member, ZipMember)
+            self.assertEqual([(event, element.tag) for _, event, element in xml_reader.gen(str(base / "export.xml"),
+                                                                                          ["start", "end"])],
+                             [(event, element.tag) for _, event, element in xml_reader.gen(xml_member,
+                                                                                          ["start", "end"])])
+            pattern = ["component", "observation", "code"]
+            self.assertEqual(xml_reader.find_display_names(str(base / "export_cda.xml"), pattern)[0],
+                             xml_reader.find_display_names(zipped / "export_cda.xml", pattern, jobs=2)[0])
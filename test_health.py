@@ -1,10 +1,21 @@
+import argparse
+import contextlib
+import io
 import json
+import os
+import shutil
+import sqlite3
 import sys
+import tempfile
+from dataclasses import replace
 from pathlib import Path
 from typing import NoReturn
-from unittest import TestCase
-from health import extract_value, list_vitals, list_prefixes, list_categories, get_value_quantity, get_reference_range, \
-    StatInfo, ValueQuantity, ReferenceRange
+from unittest import TestCase, mock
+from health import extract_value, might_contain, list_vitals, list_prefixes, list_categories, get_value_quantity, get_reference_range, \
+    StatInfo, ValueQuantity, ReferenceRange, ClinicalIndex, extract_all_values, yield_observation_files, load_index, \
+    parse_stat, ingest, Observation, to_timestamp, in_date_range, date_window, date_argument, jobs_argument, CONDITIONS, \
+    run_queries, MEDICINES, ALL_MEDICINES
+from synthetic_export import write_clinical_records
 
 
 class Test(TestCase):
@@ -20,6 +31,46 @@ class Test(TestCase):
         self.assertEqual(observation.data[1].unit, 'mm[Hg]')
         self.assertEqual(observation.data[1].name, 'Diastolic blood pressure')
 
+    def test_might_contain(self):
+        raw = b'{"code" : {"text" : "Blood Pressure"}, "category" : [{"text" : "Vital Signs"}]}'
+        self.assertTrue(might_contain(raw, ["Blood Pressure", "Vital Signs"]))
+        self.assertFalse(might_contain(raw, ["Weight", "Vital Signs"]))
+        self.assertFalse(might_contain(raw, ["Blood", "Vital Signs"]))  # Only whole strings match
+        # With escapes, we can't tell from the bytes, so it has to say it might.
+        escaped = b'{"code" : {"text" : "\\u0042lood Pressure"}}'
+        self.assertTrue(might_contain(escaped, ["Blood Pressure"]))
+        self.assertTrue(might_contain('{"text" : "Température"}'.encode("utf-8"), ["Température"]))
+
+    def test_index_some_stats(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            data_dir = Path(tmp) / "clinical-records"
+            write_clinical_records(data_dir, observations=200, seed=3)
+            stats = [StatInfo("Vital Signs", "Blood Pressure"), StatInfo("Vital Signs", "Pulse")]
+            index = ClinicalIndex.from_files(yield_observation_files(data_dir), stats=stats)
+            everything = ClinicalIndex.from_files(yield_observation_files(data_dir))
+            # Only the files that might have the stats are decoded, but they have all the values.
+            self.assertLess(len(index.files), len(everything.files) / 2)
+            self.assertEqual(set(index.stats), {(stat.category_name, stat.name) for stat in stats})
+            for stat in stats:
+                self.assertEqual(extract_all_values(everything, stat_info=stat),
+                                 extract_all_values(index, stat_info=stat))
+            self.assertEqual(index.files, ClinicalIndex.from_files(yield_observation_files(data_dir), 2, stats).files)
+
+    def test_extract_value_escaped(self):
+        with open("test_data/Observation-test-bp.json") as f:
+            data = json.load(f)
+        with tempfile.TemporaryDirectory() as tmp:
+            escaped = Path(tmp) / "Observation-escaped.json"
+            with open(escaped, "w") as f:
+                json.dump(data, f, ensure_ascii=True)
+            with open(escaped) as f:
+                text = f.read()
+            with open(escaped, "w") as f:
+                f.write(text.replace("Blood Pressure", "\\u0042lood Pressure"))
+            observation = extract_value(escaped, StatInfo("Vital Signs", "Blood Pressure"))
+            self.assertEqual(130, observation.data[0].value)
+        self.assertIsNone(extract_value("test_data/Observation-test-bp.json", StatInfo("Vital Signs", "Weight")))
+
     def test_list_available(self):
         test_file = "test_data/Observation-test-bp.json"
         vitals = list_vitals([test_file], "Vital Signs")
@@ -43,6 +94,265 @@ class Test(TestCase):
         self.assertFalse("Community" in category_counter)
         self.assertEqual(2, category_counter["Vital Signs"])
 
+    def test_index_matches_files(self):
+        data_dir = Path("test_data/list_prefixes_test_dir")
+        index = ClinicalIndex.from_directory(data_dir)
+        self.assertEqual(3, len(index.files))
+
+        stat = StatInfo("Vital Signs", "Blood Pressure")
+        from_files = extract_all_values(yield_observation_files(data_dir), stat_info=stat)
+        from_index = extract_all_values(index, stat_info=stat)
+        self.assertEqual(2, len(from_index))
+        self.assertEqual([o.date for o in from_files], [o.date for o in from_index])
+        self.assertEqual(from_files[0].data, from_index[0].data)
+
+        self.assertEqual(list_vitals(yield_observation_files(data_dir), "Vital Signs"),
+                         list_vitals(index, "Vital Signs"))
+        self.assertEqual(0, len(list_vitals(index, "Lab")))
+
+        for one_prefix in [None, "Observation", "Medication"]:
+            self.assertEqual(list_categories(data_dir, False, one_prefix=one_prefix),
+                             list_categories(data_dir, False, one_prefix=one_prefix, index=index))
+
+    def test_jobs(self):
+        data_dir = Path("test_data/list_prefixes_test_dir")
+        stat = StatInfo("Vital Signs", "Blood Pressure")
+        self.assertEqual(extract_all_values(yield_observation_files(data_dir), stat_info=stat),
+                         extract_all_values(yield_observation_files(data_dir), stat_info=stat, jobs=2))
+        self.assertEqual(list_categories(data_dir, False, one_prefix=None),
+                         list_categories(data_dir, False, one_prefix=None, jobs=2))
+        self.assertEqual(list_vitals(yield_observation_files(data_dir), "Vital Signs"),
+                         list_vitals(yield_observation_files(data_dir), "Vital Signs", jobs=2))
+        self.assertEqual(ClinicalIndex.from_directory(data_dir).files, ClinicalIndex.from_directory(data_dir, 2).files)
+
+    def test_load_index(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            data_dir = Path(tmp) / "clinical-records"
+            shutil.copytree("test_data/list_prefixes_test_dir", data_dir)
+            with open("test_data/ref_range.json") as f:
+                data = json.load(f)
+            data["code"] = {"text": "Platelet Count"}
+            data["effectiveDateTime"] = "2012-06-19T17:11:00Z"
+            with open(data_dir / "Observation-ref-range.json", "w") as f:
+                json.dump(data, f)
+            cache = Path(tmp) / "cache.sqlite"
+            stat = StatInfo("Lab", "Platelet Count")
+
+            cold = load_index(data_dir, cache)
+            self.assertTrue(cache.exists())
+            warm = load_index(data_dir, cache)
+            expected = ClinicalIndex.from_directory(data_dir)
+            for index in [cold, warm]:
+                self.assertEqual(list(expected.files), list(index.files))
+                self.assertEqual(expected.files, index.files)
+                self.assertEqual(extract_all_values(expected, stat_info=stat), extract_all_values(index, stat_info=stat))
+            self.assertEqual(400, extract_all_values(warm, stat_info=stat)[0].range.high.value)
+
+            # Change one file, and remove another. Only those should be different.
+            changed = data_dir / "Observation-test-bp.json"
+            with open(changed) as f:
+                data = json.load(f)
+            data["code"]["text"] = "Changed Pressure"
+            with open(changed, "w") as f:
+                json.dump(data, f)
+            os.utime(changed, ns=(0, 0))
+            os.remove(data_dir / "Observation-test-bp2.json")
+            index = load_index(data_dir, cache)
+            self.assertEqual(ClinicalIndex.from_directory(data_dir).files, index.files)
+            self.assertEqual(1, list_vitals(index, "Vital Signs")["Changed Pressure"])
+            self.assertFalse("Blood Pressure" in list_vitals(index, "Vital Signs"))
+
+    def test_index_unreadable_values(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            data_dir = Path(tmp) / "clinical-records"
+            shutil.copytree("test_data/list_prefixes_test_dir", data_dir)
+            with open("test_data/Observation-test-bp.json") as f:
+                data = json.load(f)
+            period = dict(data)
+            del period["effectiveDateTime"]
+            period["effectivePeriod"] = {"start": "2024-02-15T21:00:03Z", "end": "2024-02-15T21:05:00Z"}
+            with open(data_dir / "Observation-period.json", "w") as f:
+                json.dump(period, f)
+            partial = dict(data, effectiveDateTime="2019-05")
+            with open(data_dir / "Observation-partial.json", "w") as f:
+                json.dump(partial, f)
+            no_code = dict(data, code={"coding": []})
+            with open(data_dir / "Observation-no-code.json", "w") as f:
+                json.dump(no_code, f)
+            bad_date = dict(data, effectiveDateTime="sometime")
+            with open(data_dir / "Observation-bad-date.json", "w") as f:
+                json.dump(bad_date, f)
+            data["component"][1] = {"code": {"text": "Position"}, "valueString": "Sitting"}
+            with open(data_dir / "Observation-string.json", "w") as f:
+                json.dump(data, f)
+
+            index = ClinicalIndex.from_directory(data_dir)
+            for name in ["Observation-period.json", "Observation-string.json", "Observation-bad-date.json"]:
+                entry = index.files[data_dir / name]
+                self.assertIsNone(entry.observation)
+                self.assertEqual(1, len(entry.notes))
+                self.assertTrue(entry.notes[0].startswith("*** Couldn't read the value in"), entry.notes)
+            entry = index.files[data_dir / "Observation-no-code.json"]
+            self.assertEqual((None, [], None), (entry.code, entry.observation_categories, entry.observation))
+            self.assertTrue(entry.notes[0].startswith("*** Couldn't read the category or code.text in"), entry.notes)
+            # A date of just a year and month is the first of the month.
+            partial = index.files[data_dir / "Observation-partial.json"].observation
+            self.assertEqual(to_timestamp("2019-05-01"), partial.timestamp)
+            # They're still listed, and the files we can read still are.
+            self.assertEqual(6, list_vitals(index, "Vital Signs")["Blood Pressure"])
+            self.assertEqual(list_categories(data_dir, False, one_prefix=None),
+                             list_categories(data_dir, False, one_prefix=None, index=index))
+            stat = StatInfo("Vital Signs", "Blood Pressure")
+            self.assertEqual(3, len(extract_all_values(index, stat_info=stat)))
+            self.assertEqual(extract_all_values(yield_observation_files(data_dir), stat_info=stat),
+                             extract_all_values(index, stat_info=stat))
+            # And the cache keeps the notes.
+            self.assertEqual(index.files, load_index(data_dir, Path(tmp) / "cache.sqlite").files)
+            self.assertEqual(index.files, load_index(data_dir, Path(tmp) / "cache.sqlite").files)
+
+    def test_jobs_argument(self):
+        cpus = os.cpu_count() or 1
+        self.assertEqual(1, jobs_argument("1"))
+        self.assertEqual(cpus, jobs_argument(str(cpus)))
+        with contextlib.redirect_stderr(io.StringIO()) as err:
+            self.assertEqual(cpus, jobs_argument(str(cpus + 1)))
+        self.assertIn(F"using {cpus}", err.getvalue())
+
+    def test_index_values_kept(self):
+        index = ClinicalIndex.from_directory(Path("test_data/list_prefixes_test_dir"))
+        stat = StatInfo("Vital Signs", "Blood Pressure")
+        values = extract_all_values(index, stat_info=stat)
+        self.assertEqual(2, len(values))
+        self.assertEqual(values, extract_all_values(index, stat_info=stat))
+        # Changing what's returned doesn't change what's kept.
+        values.clear()
+        self.assertEqual(2, len(extract_all_values(index, stat_info=stat)))
+        # Nor does adding a file leave the old values there.
+        entry = next(e for e in index.files.values() if e.code == "Blood Pressure")
+        index.add(replace(entry, filename=Path("Observation-copy.json")))
+        self.assertEqual(3, len(extract_all_values(index, stat_info=stat)))
+
+    def test_cached_index(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            data_dir = Path(tmp) / "clinical-records"
+            write_clinical_records(data_dir, observations=200, conditions=10, medication_requests=10, seed=2)
+            index = ClinicalIndex.from_directory(data_dir)
+            # The first run writes the cache, the second one only reads it.
+            for _ in range(2):
+                cached = load_index(data_dir, Path(tmp) / "cache.sqlite")
+                try:
+                    for category in ["Vital Signs", "Laboratory", "Nothing"]:
+                        vitals = list_vitals(index, category)
+                        self.assertEqual(list(vitals.items()), list(list_vitals(cached, category).items()))
+                        for code in vitals:
+                            stat = StatInfo(category, code)
+                            self.assertEqual(extract_all_values(index, stat_info=stat),
+                                             extract_all_values(cached, stat_info=stat))
+                    for only_first, one_prefix in [(False, None), (True, None), (False, "Condition")]:
+                        self.assertEqual(list_categories(data_dir, only_first, one_prefix=one_prefix, index=index),
+                                         list_categories(data_dir, only_first, one_prefix=one_prefix, index=cached))
+                    reports = [CONDITIONS, MEDICINES, ALL_MEDICINES]
+                    self.assertEqual(run_queries(data_dir, reports, index), run_queries(data_dir, reports, cached))
+                    self.assertEqual(list(index.files.items()), list(cached.files.items()))
+                    with self.assertRaises(TypeError):
+                        cached.add(next(iter(index.files.values())))
+                finally:
+                    cached.close()
+
+    def test_ingest(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            data_dir = Path(tmp) / "clinical-records"
+            shutil.copytree("test_data/list_prefixes_test_dir", data_dir)
+            cache = Path(tmp) / "cache.sqlite"
+            report = ingest(data_dir, cache)
+            self.assertEqual(len(list(data_dir.glob("*.json"))), len(report.added))
+
+            # A new export: every file is written again, so they all have new modification times, but only one is
+            # really different, one is new, and one is gone.
+            for p in data_dir.glob("*.json"):
+                os.utime(p, ns=(0, 12345))
+            changed = data_dir / "Observation-test-bp.json"
+            with open(changed) as f:
+                data = json.load(f)
+            data["code"]["text"] = "Changed Pressure"
+            with open(changed, "w") as f:
+                json.dump(data, f)
+            shutil.copy(data_dir / "Observation-test-bp2.json", data_dir / "Observation-test-bp3.json")
+            os.remove(data_dir / "Observation-test-bp2.json")
+            # The same size, but different, which only the hash can tell.
+            medicine = data_dir / "MedicationRequest-test.json"
+            medicine.write_text(medicine.read_text().replace("Cephalexin", "Penicillin"))
+            os.utime(medicine, ns=(0, 12345))
+
+            report = ingest(data_dir, cache)
+            index = load_index(data_dir, cache)
+            self.assertEqual(["Observation-test-bp3.json"], report.added)
+            self.assertEqual(["MedicationRequest-test.json", "Observation-test-bp.json"], sorted(report.changed))
+            self.assertEqual(["Observation-test-bp2.json"], report.removed)
+            self.assertEqual(len(index.files) - 3, report.touched)
+            self.assertEqual(0, report.unchanged)
+            self.assertEqual(ClinicalIndex.from_directory(data_dir).files, index.files)
+
+            # Nothing has changed since, so nothing is read.
+            report = ingest(data_dir, cache)
+            self.assertEqual(([], [], [], 0), (report.added, report.changed, report.removed, report.touched))
+            self.assertEqual(len(index.files), report.unchanged)
+
+    def test_read_only_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            data_dir = Path(tmp) / "clinical-records"
+            shutil.copytree("test_data/list_prefixes_test_dir", data_dir)
+            cache = Path(tmp) / "cache.sqlite"
+            ingest(data_dir, cache)
+            shutil.copy(data_dir / "Observation-test-bp2.json", data_dir / "Observation-test-bp3.json")
+
+            def read_only(cache_path):
+                return sqlite3.connect(F"file:{cache_path}?mode=ro", uri=True)
+            # The cache can't be brought up to date, so every file is read instead.
+            with mock.patch("health.open_cache", read_only), \
+                    contextlib.redirect_stdout(io.StringIO()) as out:
+                index = load_index(data_dir, cache)
+            self.assertIn("Can't update the cache", out.getvalue())
+            self.assertEqual(ClinicalIndex.from_directory(data_dir).files, index.files)
+
+    def test_date_range(self):
+        self.assertEqual(1708030803, to_timestamp('2024-02-15T21:00:03Z'))
+        self.assertEqual(to_timestamp('2024-02-15T00:00:00Z'), to_timestamp('2024-02-15'))
+        self.assertEqual(to_timestamp('2024-02-15T21:00:03Z'), to_timestamp('2024-02-15T13:00:03-08:00'))
+        self.assertEqual(to_timestamp('2019-01-01'), to_timestamp('2019'))
+        self.assertEqual(to_timestamp('2019-05-01'), to_timestamp('2019-05'))
+        for bad in ['', '2019-5', 'yesterday']:
+            with self.assertRaises(ValueError):
+                to_timestamp(bad)
+            with self.assertRaises(argparse.ArgumentTypeError):
+                date_argument(bad)
+        self.assertEqual('2024-02-15T13:00:03-08:00', date_argument('2024-02-15T13:00:03-08:00'))
+        ws = [Observation("Weight", F"2024-0{month}-01T00:00:00Z", [ValueQuantity(170 + month, "lb", "Weight")])
+              for month in range(1, 10)]
+        self.assertEqual(to_timestamp(ws[0].date), ws[0].timestamp)
+
+        def months(after, before):
+            return [int(w.date[5:7]) for w in in_date_range(ws, after, before)]
+        self.assertEqual(list(range(1, 10)), months(None, None))
+        # Strictly after, and strictly before, like --after always was.
+        self.assertEqual([4, 5, 6], months("2024-03-01", "2024-07-01"))
+        self.assertEqual([3, 4], months("2024-02-15", "2024-04-15"))
+        self.assertEqual([8, 9], months("2024-07-01T12:00:00Z", None))
+        self.assertEqual([1], months(None, "2024-01-02"))
+        self.assertEqual([], months("2024-05-01", "2024-04-01"))
+        self.assertEqual([], months("2025-01-01", None))
+
+        self.assertEqual(("2024-01-01", None), date_window("2024-01-01", None, None))
+        after, before = date_window("2024-01-01", "2030-01-01", 30)
+        self.assertGreater(to_timestamp(after), to_timestamp("2024-01-01"))
+        self.assertEqual("2030-01-01", before)
+        self.assertEqual(("2999-01-01", None), date_window("2999-01-01", None, 30))
+
+    def test_parse_stat(self):
+        self.assertEqual(StatInfo("Vital Signs", "Weight"), parse_stat("Weight"))
+        self.assertEqual(StatInfo("Lab", "Potassium"), parse_stat("Lab#Potassium"))
+        self.assertEqual(StatInfo("Lab", "A#B"), parse_stat("Lab#A#B"))
+
     def test_get_value_quantity(self):
         test_file = "test_data/ref_range.json"
         with open(test_file) as f:
@@ -85,6 +395,19 @@ class Test(TestCase):
 
         self.assertEqual("140 - 400 K/uL", rr.text)
 
+    def test_shared_reference_ranges(self):
+        with open("test_data/ref_range.json") as f:
+            record = json.load(f)
+        with open("test_data/ref_range.json") as f:
+            record2 = json.load(f)
+        rr = get_reference_range(record['referenceRange'])
+        rr2 = get_reference_range(record2['referenceRange'])
+        self.assertIs(rr, rr2)
+        vq = get_value_quantity(record["valueQuantity"], "test")
+        vq2 = get_value_quantity(record2["valueQuantity"], "test")
+        self.assertIs(vq.unit, vq2.unit)
+        self.assertFalse(hasattr(vq, "__dict__"))
+
     def check_range(self, text:str, expect_low, expect_high) -> None:
         test = ReferenceRange(None, None, text )
         self.assertIsNone(test.low)
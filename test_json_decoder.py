@@ -0,0 +1,43 @@
+import json
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+import json_decoder
+from synthetic_export import write_clinical_records
+
+
+class Test(TestCase):
+    def tearDown(self):
+        json_decoder.use()
+
+    def test_same_as_json(self):
+        cases = [b'{"a": [1, 2.5, -0.0, 1e-7, true, false, null], "b": {"c": "d"}}',
+                 b'{"big": 123456789012345678901234567890, "small": -9223372036854775809}',
+                 b'{"price": 1.1000000000000001, "id": "1234567890123456789012"}',
+                 b'{"a": NaN, "b": Infinity, "c": 1e400}',
+                 b'\xef\xbb\xbf{"bom": 1}',
+                 '{"text": "café \\u00e9 \\ud83d\\ude00 \\n"}'.encode("utf-8"),
+                 b'{"a": 1, "a": 2}']
+        with tempfile.TemporaryDirectory() as temp:
+            cr = Path(temp) / "clinical-records"
+            write_clinical_records(cr, observations=50, conditions=5, allergies=2, procedures=3,
+                                   medication_requests=4, seed=9)
+            cases.extend(p.read_bytes() for p in sorted(cr.glob("*.json")))
+        for name in json_decoder.available():
+            loads = json_decoder.make_loads(name)
+            for raw in cases:
+                expected = json.loads(raw)
+                # NaN isn't equal to itself, so compare what they encode to.
+                self.assertEqual(json.dumps(expected), json.dumps(loads(raw)), F"{name}: {raw[:60]}")
+                self.assertEqual(type(expected), type(loads(raw)))
+            with self.assertRaises(json.JSONDecodeError):
+                loads(b'{"a": }')
+
+    def test_use(self):
+        self.assertEqual(json_decoder.available()[0], json_decoder.decoder)
+        self.assertIn("json", json_decoder.available())
+        self.assertEqual("json", json_decoder.use("json"))
+        self.assertIs(json.loads, json_decoder.loads)
+        with self.assertRaises(ValueError):
+            json_decoder.use("yaml")
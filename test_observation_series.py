@@ -0,0 +1,92 @@
+from pathlib import Path
+from unittest import TestCase
+
+import numpy as np
+
+from health import extract_all_values, yield_observation_files, observations_to_series, series_to_observations, \
+    StatInfo, Observation, ValueQuantity, to_timestamp, in_date_range
+from observation_series import timestamps_to_dates, format_dates, bucket_starts, grouped_stats
+
+
+class Test(TestCase):
+    def test_dates(self):
+        dates = ['2024-02-15T21:00:03Z', '2023-01-01T00:00:00Z']
+        converted = timestamps_to_dates([to_timestamp(d) for d in dates])
+        self.assertEqual(np.datetime64('2024-02-15T21:00:03'), converted[0])
+        self.assertEqual(dates, format_dates(converted))
+        self.assertEqual(0, len(timestamps_to_dates([])))
+
+    def test_round_trip(self):
+        ws = extract_all_values(yield_observation_files(Path("test_data/list_prefixes_test_dir")),
+                                stat_info=StatInfo("Vital Signs", "Blood Pressure"))
+        series = observations_to_series(ws)
+        self.assertEqual(2, len(series))
+        self.assertEqual(["Systolic blood pressure", "Diastolic blood pressure"], series.components())
+        self.assertEqual([130, 131], series.values["Systolic blood pressure"].tolist())
+        self.assertEqual([88, 89], series.values["Diastolic blood pressure"].tolist())
+        self.assertEqual(ws, series_to_observations(series))
+
+    def test_between(self):
+        ws = [Observation("Weight", F"2024-0{month}-01T00:00:00Z", [ValueQuantity(170 + month, "lb", "Weight")])
+              for month in range(1, 10)]
+        series = observations_to_series(ws)
+        for after, before in [(None, None), ("2024-03-01", None), (None, "2024-03-01"), ("2024-02-15", "2024-06-01"),
+                              ("2024-06-01", "2024-02-15"), ("2025-01-01", None), (None, "2023-01-01")]:
+            between = series.between(to_timestamp(after) if after else None, to_timestamp(before) if before else None)
+            self.assertEqual(in_date_range(ws, after, before), series_to_observations(between), (after, before))
+
+    def test_missing_component(self):
+        ws = [Observation("BP", '2024-03-01T00:00:00Z', [ValueQuantity(120, "mm", "Sys"), ValueQuantity(80, "mm", "Dia")]),
+              Observation("BP", '2024-03-02T00:00:00Z', [ValueQuantity(121, "mm", "Sys")])]
+        series = observations_to_series(ws)
+        self.assertTrue(np.isnan(series.values["Dia"][1]))
+        self.assertEqual(ws, series_to_observations(series))
+
+    def test_bucket_starts(self):
+        dates = timestamps_to_dates([to_timestamp(d) for d in ['2024-02-11T23:00:00Z', '2024-02-12T00:00:00Z',
+                                                               '2024-02-18T23:59:59Z', '1969-12-31T12:00:00Z']])
+        # 2024-02-12 was a Monday, and so was 1969-12-29.
+        self.assertEqual(['2024-02-05', '2024-02-12', '2024-02-12', '1969-12-29'],
+                         np.datetime_as_string(bucket_starts(dates, "week")).tolist())
+        self.assertEqual(['2024-02', '2024-02', '2024-02', '1969-12'],
+                         np.datetime_as_string(bucket_starts(dates, "month")).tolist())
+        self.assertEqual(['2024', '2024', '2024', '1969'], np.datetime_as_string(bucket_starts(dates, "year")).tolist())
+
+    def test_grouped_stats(self):
+        rng = np.random.default_rng(3)
+        values = rng.normal(size=500)
+        values[::7] = np.nan
+        group = rng.integers(0, 9, size=500)
+        # Group 9 has no values.
+        stats = grouped_stats(values, group, 10, [10, 90])
+        for g in range(10):
+            x = values[(group == g) & ~np.isnan(values)]
+            self.assertEqual(len(x), stats["count"][g])
+            if not len(x):
+                self.assertTrue(np.isnan(stats["median"][g]))
+                continue
+            self.assertAlmostEqual(x.min(), stats["min"][g])
+            self.assertAlmostEqual(x.max(), stats["max"][g])
+            self.assertAlmostEqual(x.mean(), stats["mean"][g])
+            self.assertAlmostEqual(np.median(x), stats["median"][g])
+            self.assertAlmostEqual(np.percentile(x, 10), stats["percentiles"][10][g])
+            self.assertAlmostEqual(np.percentile(x, 90), stats["percentiles"][90][g])
+
+    def test_summarize(self):
+        def bp(date, systolic, diastolic=None):
+            data = [ValueQuantity(systolic, "mm[Hg]", "Systolic")]
+            if diastolic is not None:
+                data.append(ValueQuantity(diastolic, "mm[Hg]", "Diastolic"))
+            return Observation("Blood Pressure", date, data)
+        series = observations_to_series([bp('2023-03-01T00:00:00Z', 120, 80), bp('2024-01-01T00:00:00Z', 130, 90),
+                                         bp('2024-06-01T00:00:00Z', 140)])
+        systolic, diastolic = series.summarize()
+        self.assertEqual((["all"], [3], [130], ["mm[Hg]"]),
+                         (systolic.buckets, systolic.count.tolist(), systolic.median.tolist(), systolic.units))
+        # The missing diastolic isn't counted.
+        self.assertEqual(([2], [85]), (diastolic.count.tolist(), diastolic.mean.tolist()))
+        systolic, diastolic = series.summarize("year")
+        self.assertEqual(["2023", "2024"], systolic.buckets)
+        self.assertEqual([120, 135], systolic.mean.tolist())
+        self.assertEqual([1, 1], diastolic.count.tolist())
+        self.assertEqual([], observations_to_series([], "Weight").summarize())
@@ -0,0 +1,49 @@
+import io
+from unittest import TestCase, mock
+
+import profiling
+
+
+class Test(TestCase):
+    def tearDown(self):
+        profiling.report(io.StringIO())
+
+    def test_inactive(self):
+        self.assertFalse(profiling.active)
+        with profiling.phase("read"):
+            profiling.count("files read")
+        self.assertIs(profiling.phase("read"), profiling.phase("other"))
+        self.assertEqual(0, profiling.counters["files read"])
+
+    def test_nested(self):
+        # A clock that only moves when the test says, so the times are exact, however busy the machine is.
+        now = [100.0]
+        with mock.patch("profiling.time.perf_counter", lambda: now[0]):
+            profiling.start()
+            with profiling.phase("outer"):
+                now[0] += 2
+                with profiling.phase("inner"):
+                    now[0] += 5
+                with profiling.phase("inner"):
+                    now[0] += 1
+                now[0] += 3
+            now[0] += 4
+            profiling.count("files read")
+            profiling.count("bytes read", 100)
+            # The inner phase's time isn't also counted in the outer one.
+            self.assertEqual(6, profiling.seconds["inner"])
+            self.assertEqual(5, profiling.seconds["outer"])
+            self.assertEqual(2, profiling.calls["inner"])
+            self.assertEqual(1, profiling.calls["outer"])
+            self.assertEqual(1, profiling.counters["files read"])
+            self.assertEqual(100, profiling.counters["bytes read"])
+
+            out = io.StringIO()
+            profiling.report(out)
+        self.assertFalse(profiling.active)
+        report = out.getvalue()
+        for line in ["inner", "outer", "other", "total", "bytes read", "peak memory"]:
+            self.assertIn(line, report)
+        # What's in no phase is other, and the total is all of it.
+        seconds = {line.split()[0]: line.split()[1] for line in report.splitlines() if line.split()}
+        self.assertEqual(("4.000", "15.000"), (seconds["other"], seconds["total"]))
@@ -0,0 +1,123 @@
+import contextlib
+import io
+import tempfile
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from unittest import TestCase, mock
+
+import numpy as np
+
+import record_store
+from record_store import convert, parse_export_dates, print_query, RecordStore
+from synthetic_export import write_export_xml
+
+
+class Test(TestCase):
+    def test_parse_export_dates(self):
+        seconds = parse_export_dates(["2024-02-15 13:00:03 -0800", "2024-02-15 21:00:03 +0000",
+                                      "2024-02-16 02:30:03 +0530"])
+        expected = np.datetime64("2024-02-15T21:00:03", "s").astype(np.int64)
+        self.assertEqual([expected] * 3, list(seconds))
+        self.assertEqual(0, len(parse_export_dates([])))
+
+    def test_convert(self):
+        with tempfile.TemporaryDirectory() as temp:
+            xml_file = Path(temp) / "export.xml"
+            write_export_xml(xml_file, items=500)
+            # Small chunks, so that appending more than one chunk is tested.
+            record_store.ROWS_PER_CHUNK = 50
+            try:
+                manifest = convert(xml_file, Path(temp) / "store")
+            finally:
+                record_store.ROWS_PER_CHUNK = 65536
+            records = [e.attrib for e in ET.parse(xml_file).iter("Record")]
+            self.assertEqual(len(records), sum(t["count"] for t in manifest["types"].values()))
+
+            store = RecordStore(Path(temp) / "store")
+            heart = store.load("HKQuantityTypeIdentifierHeartRate")
+            expected = [r for r in records if r["type"] == "HKQuantityTypeIdentifierHeartRate"]
+            self.assertEqual(len(expected), len(heart))
+            self.assertGreater(len(heart), 50)
+            self.assertIsInstance(heart.value, np.memmap)
+            self.assertEqual([float(r["value"]) for r in expected], list(heart.value))
+            self.assertEqual(list(parse_export_dates([r["startDate"] for r in expected])), list(heart.start))
+            self.assertEqual({"count/min"}, {heart.string(c) for c in heart.unit})
+            self.assertEqual({"Apple Watch"}, {heart.string(c) for c in heart.source})
+            self.assertEqual({-1}, set(heart.text))
+            # Records inside a blood pressure Correlation are there too.
+            self.assertIn("HKQuantityTypeIdentifierBloodPressureSystolic", store.types)
+
+    def test_convert_replaces_only_a_store(self):
+        with tempfile.TemporaryDirectory() as temp:
+            xml_file = Path(temp) / "export.xml"
+            write_export_xml(xml_file, items=20)
+            store_dir = Path(temp) / "store"
+            first = convert(xml_file, store_dir)
+            self.assertEqual(first, convert(xml_file, store_dir))
+            # Not a store, like the export directory given by mistake, so it's left alone.
+            export_dir = Path(temp) / "export"
+            export_dir.mkdir()
+            (export_dir / "export.xml").write_text("<HealthData/>")
+            for not_a_store in [export_dir, xml_file]:
+                with self.assertRaises(FileExistsError):
+                    convert(xml_file, not_a_store)
+            self.assertTrue((export_dir / "export.xml").exists())
+            empty = Path(temp) / "empty"
+            empty.mkdir()
+            self.assertEqual(first, convert(xml_file, empty))
+
+    def test_convert_interrupted(self):
+        with tempfile.TemporaryDirectory() as temp:
+            xml_file = Path(temp) / "export.xml"
+            write_export_xml(xml_file, items=20)
+            store_dir = Path(temp) / "store"
+            first = convert(xml_file, store_dir)
+
+            gen = record_store.gen
+
+            def interrupted(*args):
+                yield from gen(*args)
+                raise KeyboardInterrupt
+            with mock.patch("record_store.gen", interrupted), self.assertRaises(KeyboardInterrupt):
+                convert(xml_file, store_dir)
+            # The store that was there is still there, whole, and nothing else is left behind.
+            self.assertEqual([store_dir], list(Path(temp).glob("*store*")))
+            self.assertEqual(first["types"], RecordStore(store_dir).types)
+            self.assertEqual(first, convert(xml_file, store_dir))
+
+    def test_missing_dates(self):
+        with tempfile.TemporaryDirectory() as temp:
+            xml_file = Path(temp) / "export.xml"
+            xml_file.write_text("""<HealthData>
+ <Record type="A" value="1" startDate="2024-01-01 10:00:00 +0000" endDate="2024-01-01 10:00:00 +0000"/>
+ <Record type="A" value="2" endDate="2024-01-01 10:00:00 +0000"/>
+ <Record type="B" value="3" startDate="2024-01-01 10:00:00 +0000"/>
+ <Record type="A" value="4" startDate="2024-03-01 10:00:00 -0800" endDate="2024-03-01 10:00:00 -0800"/>
+</HealthData>""")
+            manifest = convert(xml_file, Path(temp) / "store")
+            self.assertEqual({"A": 1, "B": 1}, manifest["skipped"])
+            store = RecordStore(Path(temp) / "store")
+            self.assertEqual(["A"], list(store.types))
+            self.assertEqual([1.0, 4.0], list(store.load("A").value))
+
+            def queried(after):
+                with contextlib.redirect_stdout(io.StringIO()) as out:
+                    print_query(store.load("A"), after)
+                return out.getvalue().splitlines()[0]
+            self.assertEqual("A: 2 records", queried(None))
+            self.assertEqual("A: 1 records", queried("2024-01-01T10:00:00Z"))
+            # The second one is 18:00 UTC.
+            self.assertEqual("A: 0 records", queried("2024-03-01T11:00:00-07:00"))
+
+    def test_type_dirs(self):
+        with tempfile.TemporaryDirectory() as temp:
+            xml_file = Path(temp) / "export.xml"
+            xml_file.write_text("""<HealthData>
+ <Record type="A/B" value="1" startDate="2024-01-01 10:00:00 +0000" endDate="2024-01-01 10:00:00 +0000"/>
+ <Record type="A_B" value="2" startDate="2024-01-01 10:00:00 +0000" endDate="2024-01-01 10:00:00 +0000"/>
+ <Record type="a_b" value="3" startDate="2024-01-01 10:00:00 +0000" endDate="2024-01-01 10:00:00 +0000"/>
+</HealthData>""")
+            manifest = convert(xml_file, Path(temp) / "store")
+            self.assertEqual(["A_B", "A_B-2", "a_b-3"], [t["dir"] for t in manifest["types"].values()])
+            store = RecordStore(Path(temp) / "store")
+            self.assertEqual([1.0, 2.0, 3.0], [store.load(t).value[0] for t in ["A/B", "A_B", "a_b"]])
@@ -0,0 +1,104 @@
+import contextlib
+import io
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from health import ClinicalIndex, print_report, run_queries, CONDITIONS, ALLERGIES, PROCEDURES, MEDICINES, ALL_MEDICINES
+from resource_query import Query, Result, Scan, Where, get_field, parse_field, project, to_timestamp
+from synthetic_export import write_clinical_records
+
+
+class Test(TestCase):
+    def test_fields(self):
+        self.assertEqual(("clinicalStatus", "coding", 0, "code"), parse_field("clinicalStatus.coding[0].code"))
+        self.assertEqual(("a", 1, -1, "b"), parse_field("a[1][-1].b"))
+        for bad in ["", "a..b", "a[x]", "a.[0]", "a b"]:
+            with self.assertRaises(ValueError):
+                parse_field(bad)
+        data = {"clinicalStatus": {"coding": [{"code": "active"}]}, "text": "x"}
+        self.assertEqual("active", get_field(data, "clinicalStatus.coding[0].code"))
+        self.assertEqual(("x", None, None, None), project(data, ["text", "clinicalStatus.coding[1].code",
+                                                                 "text.more", "missing"]))
+
+    def test_scan(self):
+        query = Query(("Condition",), ("date", "text"), date="date",
+                      where=(Where("status", "in", ("active", "recurrence")),), sort=("date",))
+        other = Query(("Condition", "AllergyIntolerance"), ("text",), sort=("text",))
+        scan = Scan([query, other])
+        self.assertEqual({"Condition": ("date", "text", "status"), "AllergyIntolerance": ("text",)}, scan.fields)
+        resources = [("Condition", {"date": "2021", "text": "b", "status": "active"}),
+                     ("Condition", {"date": "2020", "text": "a", "status": "resolved"}),
+                     ("AllergyIntolerance", {"text": "Latex"}),
+                     ("Condition", {"date": "2019", "text": "c", "status": None}),
+                     ("Condition", {"date": "2021", "text": "a", "status": "recurrence"})]
+        for i, (resource_type, values) in enumerate(resources):
+            scan.add(resource_type, values, F"file{i}")
+        found, everything = scan.results()
+        # Sorted by date, and the two from 2021 stay in the order they were added.
+        self.assertEqual([("2021", "b"), ("2021", "a")], found.rows)
+        self.assertEqual(["*** No 'status' found in file3 ***"], found.notes)
+        self.assertEqual([("Latex",), ("a",), ("a",), ("b",), ("c",)], everything.rows)
+        self.assertEqual([], everything.notes)
+
+        self.assertEqual((Where("date", ">", to_timestamp("2020"), to_timestamp),
+                          Where("date", "<", to_timestamp("2022"), to_timestamp)),
+                         query.between("2020", "2022").where[1:])
+        self.assertEqual(query, query.between(None, None))
+        with self.assertRaises(ValueError):
+            query.between("2020-13-01")
+
+    def test_between(self):
+        # Dates are compared as times, not as text, so an offset counts, the same as it does for -s.
+        query = Query(("Condition",), ("text",), date="date").between("2020-01-01", "2020-02-01")
+        scan = Scan([query])
+        resources = [("a", "2020-01-01T01:00:00+05:00"),  # 2019-12-31T20:00:00Z
+                     ("b", "2020-01-01T01:00:00-05:00"),
+                     ("c", "2020-01"),
+                     ("d", "2020-01-31T23:00:00-05:00"),  # 2020-02-01T04:00:00Z
+                     ("e", "2020-01-15"),
+                     ("f", "not a date")]
+        for text, date in resources:
+            scan.add("Condition", {"text": text, "date": date}, F"{text}.json")
+        [result] = scan.results()
+        self.assertEqual([("b",), ("e",)], result.rows)
+        self.assertEqual(1, len(result.notes))
+        self.assertTrue(result.notes[0].startswith("*** Can't compare f.json:"), result.notes)
+        with self.assertRaises(ValueError):
+            Where("status", "like", "a%")
+
+    def test_run_queries(self):
+        with tempfile.TemporaryDirectory() as temp:
+            cr = Path(temp) / "clinical-records"
+            write_clinical_records(cr, observations=100, conditions=20, allergies=5, procedures=10,
+                                   medication_requests=30, seed=4)
+            reports = [CONDITIONS, ALLERGIES, PROCEDURES, MEDICINES, ALL_MEDICINES.between("2015-01-01")]
+            from_files = run_queries(cr, reports)
+            self.assertEqual([20, 5, 10], [len(result.rows) for result in from_files[:3]])
+            self.assertTrue(all(row[2] not in ("completed", "stopped") for row in from_files[3].rows))
+            self.assertTrue(all(row[1] > "2015-01-01" for row in from_files[4].rows))
+            dates = [row[1] for row in from_files[0].rows]
+            self.assertEqual(sorted(dates), dates)
+
+            index = ClinicalIndex.from_directory(cr)
+            self.assertEqual(from_files, run_queries(cr, reports, index))
+            self.assertEqual(from_files, run_queries(cr, reports, jobs=2))
+            # A field the index doesn't keep is read from the files.
+            categories = Query(("Condition",), ("category[0].coding[0].code",))
+            self.assertEqual([("problem-list-item",)] * 20, run_queries(cr, [categories], index)[0].rows)
+
+    def test_print_report(self):
+        def printed(query, rows, csv_format=False):
+            with contextlib.redirect_stdout(io.StringIO()) as out:
+                print_report(Result(query, rows, ["*** A note ***"]), csv_format)
+            return out.getvalue().splitlines()
+        conditions = [("Condition", "2020-01-01", "active", "confirmed", "Asthma"),
+                      ("Condition", "2021-03-04T10:00:00Z", "active", "confirmed", "Flu")]
+        self.assertEqual(["*** A note ***"] + [str(row) for row in conditions], printed(CONDITIONS, conditions))
+        # Medicines pad a date without a time, as they always have, in csv too.
+        medicines = [("MedicationRequest", "2020-01-01", "active", "Aspirin"),
+                     ("MedicationRequest", "2021-03-04T10:00:00Z", "active", "Ibuprofen")]
+        self.assertEqual(["*** A note ***", "('MedicationRequest', '2020-01-01          ', 'active', 'Aspirin')",
+                          str(medicines[1])], printed(MEDICINES, medicines))
+        self.assertEqual('"MedicationRequest","2020-01-01          ","active","Aspirin"',
+                         printed(MEDICINES, medicines, True)[1])
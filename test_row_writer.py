@@ -0,0 +1,81 @@
+import contextlib
+import csv
+import io
+import json
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import TestCase
+
+from row_writer import RowWriter, format_of, open_writer
+
+COLUMNS = [("name", str), ("value", float)]
+ROWS = [("Weight", 170.5), ("Pulse, resting", None), ('"Quoted"', 3.0)]
+
+
+class Test(TestCase):
+    def test_format_of(self):
+        self.assertEqual("csv", format_of("out.csv"))
+        self.assertEqual("jsonl", format_of("out.JSONL"))
+        self.assertEqual("parquet", format_of("out.parquet"))
+        self.assertEqual("csv", format_of("-"))
+        self.assertEqual("jsonl", format_of("out.csv", "jsonl"))
+
+    def test_write_is_abstract(self):
+        class NoWrite(RowWriter):
+            pass
+        with self.assertRaises(TypeError):
+            NoWrite("-", COLUMNS)
+
+    def test_parquet_not_to_stdout(self):
+        result = subprocess.run([sys.executable, "health.py", "--export", "-", "--export-format", "parquet"],
+                                capture_output=True, text=True)
+        self.assertEqual(2, result.returncode)
+        self.assertIn("Parquet can't be written to stdout", result.stderr)
+        self.assertNotIn("Traceback", result.stderr)
+
+    def test_parquet_needs_pyarrow(self):
+        try:
+            import pyarrow
+            raise unittest.SkipTest("pyarrow is installed")
+        except ImportError:
+            pass
+        result = subprocess.run([sys.executable, "health.py", "--export", "out.parquet"], capture_output=True,
+                                text=True)
+        self.assertEqual(2, result.returncode)
+        self.assertIn("Writing Parquet needs pyarrow", result.stderr)
+
+    def test_csv(self):
+        with tempfile.TemporaryDirectory() as temp:
+            file_name = str(Path(temp) / "out.csv")
+            with open_writer(file_name, COLUMNS) as writer:
+                for row in ROWS:
+                    writer.write(row)
+            self.assertEqual(3, writer.rows)
+            with open(file_name, newline="") as f:
+                self.assertEqual([["name", "value"], ["Weight", "170.5"], ["Pulse, resting", ""], ['"Quoted"', "3.0"]],
+                                 list(csv.reader(f)))
+
+    def test_jsonl_stdout(self):
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            with open_writer("-", COLUMNS, "jsonl") as writer:
+                for row in ROWS:
+                    writer.write(row)
+        self.assertEqual([dict(zip(["name", "value"], row)) for row in ROWS],
+                         [json.loads(line) for line in out.getvalue().splitlines()])
+
+    def test_parquet(self):
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            raise unittest.SkipTest("pyarrow is not installed")
+        with tempfile.TemporaryDirectory() as temp:
+            file_name = str(Path(temp) / "out.parquet")
+            with open_writer(file_name, COLUMNS) as writer:
+                for row in ROWS:
+                    writer.write(row)
+            table = pyarrow.parquet.read_table(file_name)
+            self.assertEqual([r[0] for r in ROWS], table.column("name").to_pylist())
+            self.assertEqual([r[1] for r in ROWS], table.column("value").to_pylist())
@@ -0,0 +1,76 @@
+import xml.etree.ElementTree as ET
+from unittest import TestCase
+
+import sparklines
+from benchmark_sparklines import synthetic_stats
+from health import to_timestamp
+from svg_sparkline import svg_sparkline, year_ticks
+
+
+class Test(TestCase):
+    def test_reused_figure(self):
+        # The first has a single point, and the others are a mix of with and without a normal range.
+        stats = synthetic_stats(6, 10, seed=1)
+        all_args = []
+        render_sparklines = sparklines.render_sparklines
+        sparklines.render_sparklines = lambda args, jobs: all_args.extend(args) or [""] * len(args)
+        try:
+            sparklines.sparklines(stats)
+        finally:
+            sparklines.render_sparklines = render_sparklines
+        self.assertEqual(6, len(all_args))
+        expected = [sparklines.sparkline(*args) for args in all_args]
+        self.assertEqual(expected, sparklines.render_sparklines(all_args))
+        self.assertEqual(expected, sparklines.render_sparklines(all_args, jobs=2))
+
+    def test_shared_date_range(self):
+        stats = synthetic_stats(4, 10, seed=2)
+        all_args = []
+        render_sparklines = sparklines.render_sparklines
+        sparklines.render_sparklines = lambda args, jobs: all_args.extend(args) or [""] * len(args)
+        try:
+            sparklines.sparklines(stats)
+        finally:
+            sparklines.render_sparklines = render_sparklines
+        x_range = (min(w.timestamp for ws in stats for w in ws), max(w.timestamp for ws in stats for w in ws))
+        self.assertEqual([x_range] * 4, [args[-1] for args in all_args])
+        # Every PNG has the same x axis, and it isn't left over for the next one, without a range.
+        renderer = sparklines.SparklineRenderer()
+        limits = []
+        for args in all_args:
+            renderer.render(args)
+            limits.append(renderer.axes.get_xlim())
+        self.assertEqual([limits[0]] * 4, limits)
+        renderer.render(all_args[1][:-1])
+        self.assertNotEqual(limits[0], renderer.axes.get_xlim())
+
+    def test_svg_sparkline(self):
+        svg = "{http://www.w3.org/2000/svg}"
+        dates = ["2019-06-01T00:00:00Z", "2020-03-01T12:00:00Z", "2022-01-01T00:00:00Z"]
+        root = ET.fromstring(svg_sparkline([to_timestamp(d) for d in dates], [1.0, 4.0, 2.0], 0, 4.0, 1.0, 3.0))
+        points = root.find(F"{svg}polyline").attrib["points"].split()
+        self.assertEqual(3, len(points))
+        # The highest value is at the top of the plot, and the last date at the right.
+        self.assertEqual("6", points[1].split(",")[1])
+        self.assertEqual("392", points[2].split(",")[0])
+        band = root.find(F"{svg}rect")
+        self.assertEqual("green", band.attrib["fill"])
+        years = [t.text for t in root.iter(F"{svg}text")][2:]
+        self.assertEqual(["2020", "2021", "2022"], years)
+
+        root = ET.fromstring(svg_sparkline([to_timestamp(dates[0])], [1.0], 0, 1.0, None, None))
+        self.assertIsNone(root.find(F"{svg}polyline"))
+        self.assertEqual("red", root.find(F"{svg}circle").attrib["stroke"])
+        self.assertEqual(1, len(root.findall(F"{svg}rect")))
+
+        x_min, x_max = to_timestamp("2000-01-01T00:00:00Z"), to_timestamp("2030-01-01T00:00:00Z")
+        ticks = year_ticks(x_min, x_max)
+        self.assertEqual([2001, 2004, 2007], [year for _, year in ticks[:3]])
+
+    def test_svg_page(self):
+        stats = synthetic_stats(4, 10, seed=1)
+        png = sparklines.sparklines(stats)
+        svg = sparklines.sparklines(stats, svg=True)
+        self.assertEqual([(name, count) for _, name, count in png], [(name, count) for _, name, count in svg])
+        for image, _, _ in svg:
+            self.assertTrue(image.startswith("<svg "))
@@ -0,0 +1,43 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from benchmark_startup import import_times
+from synthetic_export import write_clinical_records
+
+
+class Test(TestCase):
+    def test_no_matplotlib(self):
+        # Only plotting, and PNG sparklines, need matplotlib.
+        for module in ["health", "text_ui", "xml_reader", "sparklines", "svg_sparkline", "record_store"]:
+            times = import_times(F"import {module}")
+            self.assertIn(module, times)
+            self.assertNotIn("matplotlib", times, F"import {module} imports matplotlib")
+
+    def test_health_startup(self):
+        times = import_times("import health")
+        # numpy is only needed once there are values, and the process pool for --jobs.
+        self.assertNotIn("numpy", times)
+        self.assertNotIn("concurrent.futures.process", times)
+        # Not an absolute time, which would depend on the machine, but compared to numpy, in the same process.
+        # health is several times faster than numpy to import, so this only fails if something big is added.
+        times = import_times("import health; import numpy")
+        self.assertLess(times["health"], times["numpy"])
+
+    def test_cli_startup(self):
+        times = import_times("import sys, runpy; sys.argv = ['health.py', '--help']\n"
+                             "try:\n    runpy.run_path('health.py', run_name='__main__')\n"
+                             "except SystemExit:\n    pass")
+        self.assertNotIn("matplotlib", times)
+        self.assertNotIn("numpy", times)
+
+    def test_print_without_numpy(self):
+        # Printing a stat doesn't need the series, or numpy, with or without the cache.
+        with tempfile.TemporaryDirectory() as tmp:
+            write_clinical_records(Path(tmp) / "clinical-records", observations=50, seed=1)
+            for cache in ["--cache", "--no-cache"]:
+                times = import_times(F"import sys, runpy; sys.argv = ['health.py', '--source', {tmp!r}, "
+                                     F"'-s', 'Blood Pressure', '--print', '{cache}']\n"
+                                     F"runpy.run_path('health.py', run_name='__main__')")
+                self.assertIn("resource_query", times)
+                self.assertNotIn("numpy", times, cache)
@@ -0,0 +1,64 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from health import ClinicalIndex, list_categories, extract_all_values, StatInfo, export_rows, to_timestamp, \
+    EXPORT_COLUMNS
+from synthetic_export import write_clinical_records
+
+
+class Test(TestCase):
+    def test_clinical_records(self):
+        with tempfile.TemporaryDirectory() as temp:
+            cr = Path(temp) / "clinical-records"
+            files = write_clinical_records(cr, observations=200, conditions=5, allergies=3, procedures=4,
+                                           medication_requests=6, seed=2)
+            self.assertEqual(218, len(files))
+            # Same Observations, whatever else is written.
+            with tempfile.TemporaryDirectory() as temp2:
+                only = write_clinical_records(Path(temp2), observations=200, seed=2)
+                self.assertEqual([p.name for p in files[:200]], [p.name for p in only])
+
+            index = ClinicalIndex.from_directory(cr)
+            rows = {}
+            for entry in index.files.values():
+                self.assertEqual([], [n for n in entry.notes if n.startswith("*** No")], entry.filename)
+                if entry.row is not None:
+                    rows.setdefault(entry.prefix, []).append(entry.row)
+            self.assertEqual({"Condition": 5, "AllergyIntolerance": 3, "Procedure": 4, "MedicationRequest": 6},
+                             {prefix: len(r) for prefix, r in rows.items()})
+
+            _, counter, count = list_categories(cr, False, one_prefix=None)
+            self.assertEqual(218, count)
+            self.assertEqual(4, counter["Surgical History"])
+            bp = extract_all_values(index, stat_info=StatInfo("Vital Signs", "Blood Pressure"))
+            self.assertGreater(len(bp), 0)
+            self.assertEqual(["Systolic blood pressure", "Diastolic blood pressure"], [v.name for v in bp[0].data])
+
+    def test_export_rows(self):
+        with tempfile.TemporaryDirectory() as temp:
+            cr = Path(temp) / "clinical-records"
+            write_clinical_records(cr, observations=200, conditions=5, allergies=3, procedures=4,
+                                   medication_requests=6, seed=2)
+            index = ClinicalIndex.from_directory(cr)
+            rows = list(export_rows(index.files.values()))
+            self.assertTrue(all(len(row) == len(EXPORT_COLUMNS) for row in rows))
+            kinds = {}
+            for row in rows:
+                kinds[row[0]] = kinds.get(row[0], 0) + 1
+            self.assertEqual({"Condition": 5, "AllergyIntolerance": 3, "Procedure": 4, "MedicationRequest": 6},
+                             {k: n for k, n in kinds.items() if k != "Observation"})
+            # The same values as extract_all_values, for each stat.
+            bp = StatInfo("Vital Signs", "Blood Pressure")
+            expected = [(ob.date, vq.name, vq.value) for ob in extract_all_values(index, stat_info=bp) for vq in ob.data]
+            rows = list(export_rows(index.files.values(), [bp]))
+            self.assertEqual(sorted(expected), sorted((row[3], row[4], row[5]) for row in rows))
+
+            # Only the rows in the date range, for Observations and the other resources alike.
+            after, before = "2015-01-01", "2020-01-01"
+            everything = list(export_rows(index.files.values()))
+            in_range = list(export_rows(index.files.values(), after=after, before=before))
+            self.assertEqual([row for row in everything if row[3] and after < row[3] < before], in_range)
+            self.assertLess(len(in_range), len(everything))
+            self.assertTrue(all(to_timestamp(after) < to_timestamp(row[3]) < to_timestamp(before)
+                                for row in in_range))
@@ -0,0 +1,48 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+from argparse import Namespace
+from pathlib import Path
+from unittest import TestCase
+
+from health import print_reports, MEDICINES
+from synthetic_export import write_clinical_records
+from text_ui import Session, report_queries
+
+
+class Test(TestCase):
+    def test_session(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            data_dir = Path(tmp) / "clinical-records"
+            shutil.copytree("test_data/list_prefixes_test_dir", data_dir)
+            args = Namespace(cache=True, cache_file=str(Path(tmp) / "cache.sqlite"), jobs=1)
+            session = Session(data_dir, args)
+            index = session.index
+            self.assertEqual(2, session.vitals("Vital Signs")["Blood Pressure"])
+            categories = session.categories()
+            self.assertIs(categories, session.categories())
+
+            # Nothing changed, so nothing is built again.
+            session.refresh()
+            self.assertIs(index, session.index)
+            self.assertIs(categories, session.categories())
+
+            os.remove(data_dir / "Observation-test-bp2.json")
+            session.refresh()
+            self.assertIsNot(index, session.index)
+            self.assertEqual(1, session.vitals("Vital Signs")["Blood Pressure"])
+
+    def test_report_dates(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            data_dir = Path(tmp) / "clinical-records"
+            write_clinical_records(data_dir, observations=10, conditions=40, seed=2)
+            args = Namespace(after="2013-01-01", before="2016-01-01", last_days=None)
+            with contextlib.redirect_stdout(io.StringIO()) as out:
+                print_reports(data_dir, report_queries("Condition", args), True)
+            dates = [line.split(",")[1].strip('"') for line in out.getvalue().splitlines()]
+            self.assertTrue(dates)
+            self.assertTrue(all("2013-01-01" < d < "2016-01-01" for d in dates), dates)
+            self.assertEqual([MEDICINES], report_queries("MedicationRequest", Namespace(after=None, before=None,
+                                                                                        last_days=None)))
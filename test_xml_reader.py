@@ -1,6 +1,16 @@
+import random
+import tempfile
+from collections import Counter
+from pathlib import Path
 from unittest import TestCase
 
-from xml_reader import find, trim, find_display_names, gen
+import xml_reader
+from synthetic_export import write_export_xml, write_export_cda_xml
+from xml_reader import find, trim, find_display_names, gen, TagMatcher, map_chunks, read_header, chunk_boundaries
+
+
+def count_tags(file) -> Counter:
+    return Counter(element.tag for _, _, element in gen(file, ["start"]))
 
 
 class Test(TestCase):
@@ -50,3 +60,66 @@ class Test(TestCase):
 
 
 
+
+    def test_gen_clears(self):
+        root = None
+        ends = 0
+        for index, event, element in gen("test_data/test_find_display_names.xml", ["start", "end"]):
+            if root is None:
+                root = element
+            if event == "end":
+                ends += 1
+                # Children are removed once they have ended, so only the open one is left.
+                self.assertEqual(0, len(element))
+        self.assertGreater(ends, 1)
+        self.assertEqual(0, len(root))
+
+    def test_tag_matcher(self):
+        patterns = {"a": ["component", "observation", "code"], "b": ["observation", "code"], "c": ["code"],
+                    "d": ["text", "value"], "e": ["text", "text"], "f": ["value", "text", "value"]}
+        matcher = TagMatcher(patterns)
+        tags = ["component", "observation", "code", "text", "value"]
+        rng = random.Random(0)
+        stack = []
+        for _ in range(5000):
+            if stack and (len(stack) > 8 or rng.random() < 0.4):
+                expected = {name for name, pattern in patterns.items() if find(stack, pattern)}
+                self.assertEqual(expected, matcher.end())
+                stack.pop()
+            else:
+                stack.append(rng.choice(tags))
+                expected = {name for name, pattern in patterns.items() if find(stack, pattern)}
+                self.assertEqual(expected, matcher.start("{urn:hl7-org:v3}" + stack[-1]))
+            self.assertEqual(stack, matcher.tags)
+
+    def test_map_chunks(self):
+        with tempfile.TemporaryDirectory() as temp:
+            export = str(Path(temp) / "export.xml")
+            write_export_xml(Path(export), items=2000)
+            header, footer = read_header(export)
+            self.assertTrue(header.endswith(b'<HealthData locale="en_US">\n '))
+            self.assertEqual(b"</HealthData>", footer)
+            points = chunk_boundaries(export, 8, len(header))
+            self.assertEqual(9, len(points))
+            with open(export, "rb") as f:
+                data = f.read()
+            for p in points[1:-1]:
+                self.assertRegex(data[p:p + 10], b"^ <(Record|Workout)")
+
+            counts = map_chunks(count_tags, export, 2)
+            self.assertEqual(2 * xml_reader.CHUNKS_PER_JOB, len(counts))
+            total = Counter()
+            for c in counts:
+                # Every chunk is parsed inside its own HealthData.
+                self.assertEqual(1, c["HealthData"])
+                total.update(c)
+            total["HealthData"] = 1
+            self.assertEqual(count_tags(export), total)
+
+            cda = str(Path(temp) / "export_cda.xml")
+            write_export_cda_xml(Path(cda), items=500)
+            pattern = ["component", "observation", "code"]
+            names, _ = find_display_names(cda, pattern)
+            names_parallel, _ = find_display_names(cda, pattern, jobs=3)
+            self.assertEqual(500, names.total())
+            self.assertEqual(list(names.items()), list(names_parallel.items()))
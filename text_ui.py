@@ -1,11 +1,15 @@
+from collections import Counter
 from pathlib import Path
 import argparse
+import os
 
-from health import yield_observation_files, \
-    list_categories, list_vitals, do_vital, list_prefixes, print_medicines, print_conditions, print_procedures
+import profiling
+from resource_query import Query
+from health import list_categories, list_vitals, do_vital, do_vitals, list_prefixes, print_reports, StatInfo, \
+    get_index, date_argument, date_window, jobs_argument, CACHE_FILE_NAME, CONDITIONS, ALLERGIES, PROCEDURES, \
+    MEDICINES, ALL_MEDICINES
 
 # TODO maybe add a back option to menus (which is what q does, then q can be quit)
-# add option to print min/max/ave.
 #  TODO I have 199 items on the laboratory category. Step 1 sort them alphabetically, to make them easier to find.
 #           maybe allow the user to sort by alpha, or by date
 # TODO I have 199 items. Maybe split into submenus. Maybe automatically (a-h, i-k, l-z).
@@ -13,26 +17,90 @@ from health import yield_observation_files, \
 # TODO Should I forget the interactive UI and make a django version?
 # TODO For interactive mode, I need to be consistent about print, plot, and active/inactive.
 # TODO like medicines, conditions should have an option to print inactive.
-# TODO Do we want to have an option to process multiple or all stats in one run?
 # TODO Should be able to graph anything with a value quantity and a date.
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Explore Kaiser Health Data - Text Menu',
                                      epilog='Example usage: python text_ui.py')
 
-    parser.add_argument('--after', type=str,
-                        help='YYYY-MM-DD format date. Only include dates after this date when using --stat.')
+    parser.add_argument('--after', type=date_argument,
+                        help='YYYY-MM-DD format date. Only include dates after this date, in the observation menus '
+                             'and in the medicine, condition, allergy and procedure lists.')
+    parser.add_argument('--before', type=date_argument,
+                        help='YYYY-MM-DD format date. Only include dates before this date, like --after.')
+    parser.add_argument('--last-days', type=int, metavar='N',
+                        help='Only include the last N days, up to now. Works with --before, and with --after, '
+                             'whichever is later.')
     parser.add_argument('--plot',  action=argparse.BooleanOptionalAction,
                         help='Plots the vital statistic selected with --stat.')
     parser.add_argument('--print', action=argparse.BooleanOptionalAction,
                         help='Prints the vital statistic selected with --stat.')
     parser.add_argument('--csv-format', action=argparse.BooleanOptionalAction,
                         help='Format printed output as csv')
+    parser.add_argument('--cache', action=argparse.BooleanOptionalAction, default=True,
+                        help='Keep what was read from clinical-records in a cache file, so the next run only reads '
+                             'new or changed files. On by default.')
+    parser.add_argument('--cache-file', type=str,
+                        help=F'Where to keep the cache. Default is {CACHE_FILE_NAME} in the export directory.')
+    parser.add_argument('-j', '--jobs', type=jobs_argument, default=1,
+                        help='Number of processes to use when reading clinical-records, up to the number of CPUs. '
+                             'Default is 1.')
+    parser.add_argument('--profile', action=argparse.BooleanOptionalAction,
+                        help='When quitting, print where the time went, and peak memory, to stderr.')
+    parser.add_argument('--profile-file', type=str,
+                        help='Also run cProfile, and write its stats to this file. Implies --profile.')
 
     args = parser.parse_args()
     return args
 
 
+class Session:
+    """
+    Everything the menus show comes from one index of clinical-records, built when the session starts, and kept for
+    all of it. So do the category and code lists, which are only counted the first time a menu needs them.
+
+    Before each menu, the directory is checked, and if it has changed, the index is built again. With the cache,
+    only the files that changed are read. The check is the directory's own modification time, which changes when
+    files are added, removed or renamed, or the directory is replaced, like by unzipping a new export. It's one
+    stat, where checking every file would take a noticeable time, for each menu. A file that is edited in place isn't
+    noticed until the next session.
+    """
+    def __init__(self, condition_path: Path, args):
+        self.condition_path = condition_path
+        self.args = args
+        self.signature = None
+        self.index = None
+        self.refresh()
+
+    def directory_signature(self) -> tuple[int, int]:
+        st = os.stat(self.condition_path)
+        return st.st_ino, st.st_mtime_ns
+
+    def refresh(self) -> None:
+        """
+        Builds the index again, if the directory has changed since it was built.
+        """
+        signature = self.directory_signature()
+        if signature == self.signature:
+            return
+        if self.index is not None:
+            print(F"{self.condition_path} has changed. Reading it again.")
+        self.index = get_index(self.condition_path, self.args.cache, self.args.cache_file, self.args.jobs)
+        self.signature = signature
+        self._categories = None
+        self._vitals: dict[str, Counter] = {}
+
+    def categories(self) -> list[str]:
+        if self._categories is None:
+            self._categories, _, _ = list_categories(self.condition_path, False, one_prefix=None, index=self.index)
+        return self._categories
+
+    def vitals(self, category: str) -> Counter:
+        if category not in self._vitals:
+            self._vitals[category] = list_vitals(self.index, category)
+        return self._vitals[category]
+
+
 def menu_show(choices: list[str]):
     option = -1
     while option < 1 or option > len(choices):
@@ -46,56 +114,71 @@ def menu_show(choices: list[str]):
         option = int(c)
     return option - 1, choices[option - 1]
 
-def menu_observation(data_dir: Path, args):
+def menu_observation(session: Session):
     """
     Observations are anything measured. Test results, measurements of height or weight, etc.
 
-    :param data_dir:
-    :param args:
+    :param session: the index of the data, and what's been counted from it, so the menus don't read the files again.
     :return:
     """
-    list_cat, dict_cat, file_count = list_categories(data_dir, False, one_prefix=None)
-    while (option := menu_show(list_cat))[0] != -1:
+    data_dir, args = session.condition_path, session.args
+    while (option := menu_show(session.categories()))[0] != -1:
         option_number, category = option
-        vitals = list_vitals(yield_observation_files(data_dir), category)
-        vital_list = [k for k in vitals.keys()]
-        while (choices := menu_show(vital_list))[0] != -1:
+        session.refresh()
+        vital_list = [k for k in session.vitals(category).keys()]
+        while (choices := menu_show(vital_list + ["Print all of them", "Summary of all of them"]))[0] != -1:
             choice_number, choice_string = choices
-            do_vital(data_dir, choice_string, args.after, True, True, args.csv_format,
-                     category_name=category)
+            session.refresh()
+            after, before = date_window(args.after, args.before, args.last_days)
+            if choice_number >= len(vital_list):
+                # Plotting all of them would be one window per stat, so only print, or summarize.
+                print_all = choice_number == len(vital_list)
+                do_vitals(data_dir, [StatInfo(category, vital) for vital in vital_list], after, print_all, False,
+                          args.csv_format, index=session.index, summary=None if print_all else "all", before=before)
+                continue
+            do_vital(data_dir, choice_string, after, True, True, args.csv_format,
+                     category_name=category, index=session.index, before=before)
         print("You want information about ", option[1])
         # print("Would you like to print or plot this?")
     return
 
-def menu_main(condition_path: Path, args) -> None:
+def report_queries(resource_type: str, args, include_inactive: bool = False) -> list[Query]:
+    """
+    The report the menu for resource_type prints, for the dates in --after, --before and --last-days. Worked out each
+    time, since --last-days is up to now.
+    """
+    after, before = date_window(args.after, args.before, args.last_days)
+    query = {"MedicationRequest": ALL_MEDICINES if include_inactive else MEDICINES, "Condition": CONDITIONS,
+             "AllergyIntolerance": ALLERGIES, "Procedure": PROCEDURES}[resource_type]
+    return [query.between(after, before)]
+
+def menu_main(session: Session) -> None:
     """
     display menus on the command line
 
-    :param args:
-    :param condition_path:
+    :param session: the index of the data, shared by all the menus.
     :return: No Return
     """
     print()
+    condition_path, args = session.condition_path, session.args
     options = list(list_prefixes(condition_path).keys())
     while (var := menu_show(options))[0] != len(options):
         value = var[1]
+        session.refresh()
+        index = session.index
         match value:
             case "quit":
                 return
             case "Observation":
-                menu_observation(condition_path, args)
+                menu_observation(session)
             case "MedicationRequest":
                 include_inactive, v = menu_show(["Active Medicines", "All Medicines"])
-                include_inactive = bool(include_inactive)
-                print_medicines(condition_path, args.csv_format, "MedicationRequest*.json", include_inactive)
+                print_reports(condition_path, report_queries(value, args, bool(include_inactive)), args.csv_format,
+                              index=index)
             case "DocumentReference":
                 print("I don't know anything about DocumentReferences, yet.")
-            case "Condition":
-                print_conditions(condition_path, args.csv_format, "Condition*.json")
-            case "AllergyIntolerance":
-                print_conditions(condition_path, args.csv_format, "AllergyIntolerance*.json")
-            case "Procedure":
-                print_procedures(condition_path, args.csv_format, "Procedure*.json")
+            case "Condition" | "AllergyIntolerance" | "Procedure":
+                print_reports(condition_path, report_queries(value, args), args.csv_format, index=index)
             case _:
                 print("I don't know anything about " + value + " files, yet.")
     return
@@ -106,7 +189,14 @@ def go():
     base = Path("export/apple_health_export")
     condition_path = base / "clinical-records"
 
-    menu_main(condition_path, args)
+    if args.profile or args.profile_file:
+        profiling.start(args.profile_file)
+    session = Session(condition_path, args)
+    try:
+        menu_main(session)
+    finally:
+        # Time spent waiting at a menu for input shows up as "other".
+        profiling.report()
     return
 
 if __name__ == "__main__":
@@ -23,16 +23,48 @@ All tags from export_cda.xml:
 
 Using https://realpython.com/python-xml-parser/#xmletreeelementtree-a-lightweight-pythonic-alternative
 
+export.xml can be several GB. gen() streams it, and throws away each element once it has been seen, so memory use
+stays the same however big the file is. If lxml is installed, it's used instead of ElementTree, because it's faster.
+
+Parsing is still bound to one core, so map_chunks() splits a file into byte ranges at top level elements, and parses
+each range in its own process. See --jobs.
+
+Both files can also be read straight from the export zip, see --source. They are decompressed as they are read, so
+they stream the same way, but a compressed file can't be split into ranges, so --jobs doesn't help then.
+
 # TODO Add plotting
 
 """
 import argparse
+import os
+import re
 import unicodedata
+import xml.parsers.expat
+from functools import cache
 import xml.etree.ElementTree as ET
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
 from dataclasses import dataclass
 from collections import Counter
+from itertools import repeat
 from math import log10
-from health import Observation
+
+import profiling
+from export_zip import ZipMember, source_dir
+
+
+@dataclass
+class TestResult:
+    """
+    One observation from export_cda.xml, as get_test_results finds it. The fields are filled in as the
+    tags are read.
+    """
+    name: str
+    value: str = None
+    unit: str = None
+    sourceName: str = None
 
 
 def find(stack: list[str], target: list[str]) -> bool:
@@ -59,56 +91,301 @@ def trim(tag:str) -> str:
         return tag
     return tag[tag.find("}")+1:]
 
+@cache
 def clean_tag(tag:str) -> str:
+    """
+    There are only a few dozen different tags, but millions of elements, so each one is only cleaned once.
+    """
     tag = unicodedata.normalize("NFKD", trim(tag))
     return tag
 
+
+class TagMatcher:
+    """
+    Matches several tag paths at once, like find() does for one, as elements open and close.
+
+    The patterns are compiled into an Aho-Corasick automaton over tags: each open element has a state, which
+    says which patterns end at it, and the state of a new child only depends on its parent's state and its own tag.
+    Those transitions are worked out the first time they are needed and then looked up, so each start or end event
+    costs a dict lookup, however many patterns there are.
+
+    matcher = TagMatcher({"code": ["component", "observation", "code"], "unit": ["unit"]})
+    matcher.start(element.tag) on a start event, matcher.end() on an end event. Both return the names of the patterns
+    that match the element.
+    """
+    def __init__(self, patterns: dict[str, list[str]]):
+        # The trie of the patterns. Node 0 is the root.
+        children: list[dict[str, int]] = [{}]
+        outputs: list[set[str]] = [set()]
+        for name, pattern in patterns.items():
+            node = 0
+            for tag in pattern:
+                if tag not in children[node]:
+                    children.append({})
+                    outputs.append(set())
+                    children[node][tag] = len(children) - 1
+                node = children[node][tag]
+            outputs[node].add(name)
+        # Failure links, breadth first, so a node's parent's link is done before it.
+        fail = [0] * len(children)
+        queue = list(children[0].values())
+        for node in queue:
+            for tag, child in children[node].items():
+                f = fail[node]
+                while f and tag not in children[f]:
+                    f = fail[f]
+                fail[child] = children[f].get(tag, 0)
+                outputs[child] |= outputs[fail[child]]
+                queue.append(child)
+        self.children = children
+        self.fail = fail
+        self.outputs = [frozenset(o) for o in outputs]
+        self.transitions: dict[tuple[int, str], int] = {}
+        self.states = [0]
+        self.tags: list[str] = []
+
+    def step(self, state: int, tag: str) -> int:
+        key = (state, tag)
+        next_state = self.transitions.get(key)
+        if next_state is None:
+            s = state
+            while s and tag not in self.children[s]:
+                s = self.fail[s]
+            next_state = self.transitions[key] = self.children[s].get(tag, 0)
+        return next_state
+
+    def start(self, tag: str) -> frozenset[str]:
+        """
+        :param tag: the element's tag, as it is in the file. It is cleaned here.
+        :return: the names of the patterns that end at this element
+        """
+        tag = clean_tag(tag)
+        self.tags.append(tag)
+        state = self.step(self.states[-1], tag)
+        self.states.append(state)
+        return self.outputs[state]
+
+    def end(self) -> frozenset[str]:
+        """
+        :return: the names of the patterns that matched the element that is closing
+        """
+        self.tags.pop()
+        return self.outputs[self.states.pop()]
+
+def iterparse(source, events):
+    """
+    ET.iterparse, or lxml's, if it's installed. They yield the same (event, element) pairs.
+    """
+    if lxml_etree is not None:
+        return lxml_etree.iterparse(source, events=events, huge_tree=True)
+    return ET.iterparse(source, events=events)
+
 def gen(file_name: str, events):
-    for index, i in enumerate(ET.iterparse(file_name, events=events)):
-        event, element = i
-        yield index, event, element
+    """
+    Streams the elements of an xml file, like iterparse, but without keeping them.
+
+    iterparse builds the whole tree as it goes, so by the end of export.xml, all of it is in memory. Here, once the
+    caller has seen an element's "end" event (or its "start" event, if it didn't ask for "end"), the element is
+    cleared, and removed from its parent, so nothing holds on to it. Each element's ancestors are still there, but
+    they only ever have the one child that is currently open.
+
+    Anything the caller needs from an element has to be taken before asking for the next event.
+    :param file_name: the file to read. Can also be an open binary file, or a ZipMember.
+    :param events: a list of events to report, from "start" and "end"
+    :return: yields index, event, element. index counts the events that were reported.
+    """
+    open_elements = []
+    index = 0
+    source = file_name.open() if isinstance(file_name, ZipMember) else file_name
+    try:
+        for event, element in iterparse(source, ("start", "end")):
+            if event in events:
+                yield index, event, element
+                index += 1
+            if event == "start":
+                open_elements.append(element)
+            else:
+                open_elements.pop()
+                element.clear()
+                if open_elements:
+                    open_elements[-1].remove(element)
+    finally:
+        # Counted once at the end, rather than per element, so it costs nothing when profiling is off.
+        profiling.count("xml events reported", index)
+        if source is not file_name:
+            source.close()
+
+# Where a chunk can start: a newline, one space, and the start tag of a top level Record or Workout (export.xml) or
+# entry (export_cda.xml). Apple indents the children of the root element by one space, and anything deeper by more,
+# so this only matches top level elements. The Records inside a Correlation, for instance, have two spaces.
+CHUNK_START = re.compile(rb"\n <(?:Record|Workout|entry)[\s>/]")
+SCAN_BYTES = 1 << 20
+# More chunks than jobs, so that a slow chunk doesn't leave the other processes waiting at the end.
+CHUNKS_PER_JOB = 4
+
+
+def read_header(file_name: str) -> tuple[bytes, bytes]:
+    """
+    :return: the bytes before the root element's first child (the xml declaration, any DOCTYPE, and the root's
+    start tag, with its namespace declarations), and the root's end tag. Every chunk is parsed between these two.
+    """
+    parser = xml.parsers.expat.ParserCreate()
+    found = {}
+
+    def start_element(name, attributes):
+        if "root" not in found:
+            found["root"] = name
+        else:
+            found["child"] = parser.CurrentByteIndex
+            raise StopIteration
+
+    parser.StartElementHandler = start_element
+    with open(file_name, "rb") as f:
+        read = 0
+        try:
+            while block := f.read(SCAN_BYTES):
+                read += len(block)
+                parser.Parse(block, False)
+        except StopIteration:
+            pass
+        if "child" not in found:
+            # No children, so there's nothing to split.
+            return b"", b""
+        f.seek(0)
+        header = f.read(found["child"])
+    return header, F"</{found['root']}>".encode()
+
+def next_chunk_start(f, offset: int):
+    """
+    :return: the offset of the first top level element at or after offset, or None if there isn't one.
+    """
+    f.seek(offset)
+    carry = b""
+    position = offset
+    while block := f.read(SCAN_BYTES):
+        data = carry + block
+        match = CHUNK_START.search(data)
+        if match:
+            # The chunk starts after the newline.
+            return position - len(carry) + match.start() + 1
+        carry = data[-16:]
+        position += len(block)
+    return None
+
+def chunk_boundaries(file_name: str, chunks: int, header_size: int) -> list[int]:
+    """
+    Splits a file into about chunks byte ranges of about the same size, each starting at a top level element.
+    :return: the offsets where the chunks start, and the file size, at the end.
+    """
+    size = os.path.getsize(file_name)
+    points = [0]
+    with open(file_name, "rb") as f:
+        for i in range(1, chunks):
+            start = next_chunk_start(f, max(size * i // chunks, points[-1] + 1, header_size))
+            if start is None:
+                break
+            if start > points[-1]:
+                points.append(start)
+    points.append(size)
+    return points
+
+
+class ChunkFile:
+    """
+    A read only file, for the parser, of one chunk of an xml file: the header, the bytes of the chunk, and the root
+    element's end tag. The first chunk already has the header, and the last one already has the end tag.
+    """
+    def __init__(self, file_name: str, start: int, end: int, header: bytes, footer: bytes):
+        self.file = open(file_name, "rb")
+        self.file.seek(start)
+        self.remaining = end - start
+        self.before = header if start > 0 else b""
+        self.after = footer if end < os.path.getsize(file_name) else b""
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0:
+            size = len(self.before) + self.remaining + len(self.after)
+        data = self.before[:size]
+        self.before = self.before[len(data):]
+        if len(data) < size and self.remaining:
+            block = self.file.read(min(size - len(data), self.remaining))
+            self.remaining -= len(block)
+            data += block
+        if len(data) < size and not self.remaining:
+            end = self.after[:size - len(data)]
+            self.after = self.after[len(end):]
+            data += end
+        if not data:
+            self.file.close()
+        return data
+
+
+def parse_chunk(function, chunk: tuple, args: tuple):
+    return function(ChunkFile(*chunk), *args)
+
+def map_chunks(function, file_name: str, jobs: int, *args) -> list:
+    """
+    Calls function(file, *args) on each chunk of file_name, in a pool of jobs processes. function reads the chunk
+    like a whole file, with gen() for instance.
+
+    The chunks are in file order, and so are the results, so merging them in order gives the same result as
+    function(file_name, *args), as long as function doesn't care what happened in an earlier top level element.
+    :return: the list of results, one per chunk. With one job, there's just one chunk, the whole file.
+    """
+    if jobs <= 1 or isinstance(file_name, ZipMember):
+        # A member of a zip is compressed, so the only way to get to the middle of it is to read up to there.
+        return [function(file_name, *args)]
+    header, footer = read_header(file_name)
+    if not header:
+        return [function(file_name, *args)]
+    points = chunk_boundaries(file_name, jobs * CHUNKS_PER_JOB, len(header))
+    chunks = [(file_name, start, end, header, footer) for start, end in zip(points, points[1:])]
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(jobs) as executor:
+        return list(executor.map(parse_chunk, repeat(function), chunks, repeat(args)))
+
 
-def find_display_names(file_name: str, pattern: list[str]):
-    element_stack = []
+def find_display_names(file_name: str, pattern: list[str], jobs: int = 1):
+    if jobs > 1:
+        display_names = Counter()
+        for names, _ in map_chunks(find_display_names, file_name, jobs, pattern):
+            display_names.update(names)
+        return display_names, []
+    matcher = TagMatcher({"name": pattern})
     display_names = Counter()
     for index, event, element in gen(file_name, ["start", "end"]):
-        tag = clean_tag(element.tag)
         if event == "start":
-            element_stack.append(tag)
-            if find(element_stack, target=pattern):
+            if matcher.start(element.tag):
                 display_names[element.attrib['displayName']] += 1
         elif event == "end":
-            element_stack.pop()
-    return display_names, element_stack  # Only returning element_stack for test.
+            matcher.end()
+    return display_names, matcher.tags  # Only returning element_stack for test.
 
 
-def get_test_results():
+def get_test_results(file_name="export/apple_health_export/export_cda.xml"):
     tags = set()
-    element_stack = []
+    matcher = TagMatcher({"name": ["component", "observation", "code"], "value": ["text", "value"],
+                          "unit": ["unit"], "source": ["text", "sourceName"]})
     # file_name = "test_data/export_cda_fraction.xml"
-    file_name = "export/apple_health_export/export_cda.xml"
     # file_name = "test_data/export_cda_1000.xml"
     count = 0
     count_sources = 0
     none_count = 0
-    for index, i in enumerate(ET.iterparse(file_name, events=("start", "end"))):
-        event, element = i
-        tag = unicodedata.normalize("NFKD", trim(element.tag))
-        tags.add(tag)
+    for index, event, element in gen(file_name, ("start", "end")):
         if event == "start":
-            # print(tag, element.attrib, element_stack)
-            element_stack.append(tag)
+            matches = matcher.start(element.tag)
+            tags.add(matcher.tags[-1])
             # print(element, element.attrib, element.text)
-            if find(element_stack, ["component", "observation", "code"]):
-                ob = Observation(element.attrib['displayName'])
-            elif find(element_stack, ["text", "value"]):
+            if "name" in matches:
+                ob = TestResult(element.attrib['displayName'])
+            elif "value" in matches:
                 ob.value = element.text
-            elif tag == "unit":
+            elif "unit" in matches:
                 ob.unit = element.text
                 count += 1
                 print(F"{index:7}: {count_sources}: {ob}")
         elif event == "end":
-            if find(element_stack, ["text", "sourceName"]):
+            if "source" in matcher.end():
                 count_sources += 1
                 if element.text is None:
                     # print("None")
@@ -116,7 +393,6 @@ def get_test_results():
                     ob.sourceName = "None"
                 else:
                     ob.sourceName = unicodedata.normalize("NFKD", element.text)
-            element_stack.pop()
     print(F"Found {count} observations.")
     print(F"None count {none_count}")
     print_tags: bool = False
@@ -126,9 +402,9 @@ def get_test_results():
             print(tag)
 
 
-def get_all_test_types():
+def get_all_test_types(jobs: int = 1, file_name="export/apple_health_export/export_cda.xml"):
     print("This may take a few minutes...")
-    names, _ = find_display_names("export/apple_health_export/export_cda.xml", ["component", "observation", "code"])
+    names, _ = find_display_names(file_name, ["component", "observation", "code"], jobs)
     max_count_name = max(names, key=names.get)
     max_count = names[max_count_name]
 
@@ -144,8 +420,21 @@ if __name__ == "__main__":
                                      "an export can be millions of records, so this can take a long time."
                                      "When run with no arguments, it prints all tests and all results.")
     parser.add_argument("-l", "--list", action="store_true", help="List all observations. SLOW! (minutes)")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Parse the file in this many processes, for --list. Default is 1.")
+    parser.add_argument("--source", type=str, default="export/apple_health_export",
+                        help="The export directory, or the export zip, which is read without unzipping it.")
+    parser.add_argument("--profile", action="store_true",
+                        help="Print where the time went, and peak memory, to stderr at the end.")
+    parser.add_argument("--profile-file", type=str,
+                        help="Also run cProfile, and write its stats to this file. Implies --profile.")
     args = parser.parse_args()
-    if args.list:
-        get_all_test_types()
-    else:
-        get_test_results()
\ No newline at end of file
+    if args.profile or args.profile_file:
+        profiling.start(args.profile_file)
+    cda_file = source_dir(args.source) / "export_cda.xml"
+    with profiling.phase("parse xml"):
+        if args.list:
+            get_all_test_types(args.jobs, cda_file)
+        else:
+            get_test_results(cda_file)
+    profiling.report()